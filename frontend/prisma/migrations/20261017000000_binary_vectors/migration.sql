@@ -0,0 +1,6 @@
+-- AlterTable
+ALTER TABLE "UnknownSample" ALTER COLUMN "embedding" DROP NOT NULL,
+ADD COLUMN     "embeddingVec" BYTEA;
+
+-- AlterTable
+ALTER TABLE "Cluster" ADD COLUMN     "centroidVec" BYTEA;
@@ -6,12 +6,36 @@ from pathlib import Path
 env_path = Path(__file__).parent.parent / '.env'
 load_dotenv(dotenv_path=env_path)
 
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.routers import process, health, embeddings
+from app.services.ann_index import ann_index
+from app.utils.logger import get_logger
 import os
 
-app = FastAPI()
+logger = get_logger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the saved ANN index and catch up on samples added while we were down
+    try:
+        if not ann_index.load():
+            logger.info("No saved ANN index, building it from the database")
+        ann_index.sync()
+        if ann_index.unsaved:
+            ann_index.save()
+    except Exception as e:
+        logger.warning(f"ANN index not ready at startup, it is built on the first compare: {e}")
+
+    yield
+
+    if ann_index.unsaved:
+        ann_index.save()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
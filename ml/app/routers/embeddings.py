@@ -1,63 +1,168 @@
 from fastapi import APIRouter, HTTPException, Query
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
+from datetime import datetime
+import json
 import numpy as np
 
 from app.services.db_embeddings import (
     get_all_embeddings,
     get_embedding_by_id,
-    get_embeddings_by_cluster,
+    get_embeddings_by_ids,
     get_embeddings_as_numpy,
-    parse_embedding_to_numpy
+    iter_embeddings,
+    parse_embedding_to_numpy,
+    parse_fields,
+    METADATA_FIELDS
 )
-from app.services.embeddings import extract_embedding
-from app.services.preprocess import preprocess_audio
+from app.services.ann_index import ann_index, ANN_NPROBE
+from app.services.embedding_store import embedding_store
+from app.services.embeddings import extract_embedding, embedding_dimension
+from app.services.export import export_embeddings, FORMATS as EXPORT_FORMATS
+from app.services.preprocess import decode_audio_bytes
 from app.utils.logger import get_logger
 
 router = APIRouter(prefix="/embeddings", tags=["embeddings"])
 logger = get_logger(__name__)
 
 
+def _serialize_sample(sample: dict) -> dict:
+    """Make a sample row JSON friendly: ISO timestamps and plain lists for binary vectors."""
+    if 'created_at' in sample and sample['created_at']:
+        sample['created_at'] = sample['created_at'].isoformat()
+    if isinstance(sample.get('embedding'), np.ndarray):
+        sample['embedding'] = sample['embedding'].tolist()
+    return sample
+
+
 class CompareRequest(BaseModel):
-    file_url: str
+    file_url: Optional[str] = None
+    file_urls: List[str] = []           # compare several files in one call
+    vectors: List[List[float]] = []     # or embeddings computed elsewhere
     top_k: int = 5
+    nprobe: int = ANN_NPROBE    # inverted lists scanned by the ANN index
+    rerank: bool = True         # re-score the ANN candidates with the exact vectors
+    exact: bool = False         # brute-force scan instead of the ANN index
+    include_vectors: bool = False   # return the embedding of every match
+
+
+def _download_embedding(file_url: str) -> np.ndarray:
+    """Download an audio file and embed it in memory."""
+    import requests
+    import os
+    from urllib.parse import urlparse
+    
+    response = requests.get(file_url)
+    if response.status_code != 200:
+        raise HTTPException(status_code=400, detail=f"Failed to download audio file {file_url}")
+    
+    filename = os.path.basename(urlparse(file_url).path) or "audio.wav"
+    audio, _ = decode_audio_bytes(response.content, filename)
+    return extract_embedding(audio)
 
 
 @router.get("/")
 async def list_embeddings(
     limit: Optional[int] = Query(None, description="Maximum number of embeddings to return"),
     offset: int = Query(0, description="Number of embeddings to skip"),
-    cluster_id: Optional[int] = Query(None, description="Filter by cluster ID (null for unclustered)")
+    after_id: Optional[int] = Query(None, description="Only return samples with a larger ID (keyset pagination)"),
+    cluster_id: Optional[int] = Query(None, description="Filter by cluster ID"),
+    fields: Optional[str] = Query(None, description="Comma separated fields, add 'embedding' to get the vectors"),
+    format: str = Query("json", pattern="^(json|ndjson)$", description="json, or ndjson to stream one sample per line")
 ):
     """
     Retrieve embeddings from the UnknownSample table.
     
     Query parameters:
     - limit: Maximum number of results (default: all)
-    - offset: Skip N records (for pagination)
-    - cluster_id: Filter by cluster (omit to get all, use 'null' for unclustered)
+    - offset: Skip N records (prefer after_id for deep pages)
+    - after_id: Return samples after this ID, pass next_after_id of the previous page
+    - cluster_id: Filter by cluster (omit to get all)
+    - fields: Columns to return, all but the embedding by default
+    - format: ndjson streams the rows from a server-side cursor, so memory
+      use stays flat for full-archive exports
     """
     try:
-        if cluster_id is not None:
-            results = get_embeddings_by_cluster(cluster_id)
-        else:
-            results = get_all_embeddings(limit=limit, offset=offset)
+        selected = parse_fields(fields) or METADATA_FIELDS
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        if format == "ndjson":
+            if offset > 0:
+                raise HTTPException(status_code=400, detail="Use after_id instead of offset with ndjson")
+            
+            rows = iter_embeddings(fields=selected, after_id=after_id, cluster_id=cluster_id, limit=limit)
+            lines = (json.dumps(_serialize_sample(row)) + "\n" for row in rows)
+            return StreamingResponse(lines, media_type="application/x-ndjson")
+        
+        results = get_all_embeddings(
+            limit=limit,
+            offset=offset,
+            after_id=after_id,
+            cluster_id=cluster_id,
+            fields=selected
+        )
         
-        # Convert datetime to string for JSON serialization
         for result in results:
-            if 'created_at' in result and result['created_at']:
-                result['created_at'] = result['created_at'].isoformat()
+            _serialize_sample(result)
         
         return {
             "count": len(results),
-            "embeddings": results
+            "embeddings": results,
+            # Pass as after_id to get the next page
+            "next_after_id": results[-1]['id'] if results and limit is not None and len(results) == limit else None
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching embeddings: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch embeddings: {str(e)}")
 
 
+@router.get("/export")
+async def export_embeddings_stream(
+    format: str = Query("arrow", description="arrow (IPC stream), parquet or npz"),
+    after_id: Optional[int] = Query(None, description="Only samples with a larger ID, for incremental pulls"),
+    cluster_id: Optional[int] = Query(None, description="Filter by cluster ID"),
+    region: Optional[str] = Query(None, description="Filter by region"),
+    created_after: Optional[datetime] = Query(None, description="Only samples created at or after this time"),
+    created_before: Optional[datetime] = Query(None, description="Only samples created before this time")
+):
+    """
+    Stream embeddings with their metadata as a file.
+    
+    Every sample with an embedding matching the filters is exported with id,
+    cluster_id, region, lat, lng, language_guess and created_at. Rows come
+    from a server-side cursor in fixed-size batches, so memory stays bounded
+    however large the export is. At most EXPORT_MAX_CONCURRENT exports run
+    at once, 429 beyond that.
+    """
+    try:
+        chunks = export_embeddings(
+            format,
+            after_id=after_id,
+            cluster_id=cluster_id,
+            region=region,
+            created_after=created_after,
+            created_before=created_before
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ImportError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    
+    media_type, extension = EXPORT_FORMATS[format]
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="embeddings.{extension}"'}
+    )
+
+
 @router.get("/{sample_id}")
 async def get_embedding(sample_id: int):
     """
@@ -69,11 +174,7 @@ async def get_embedding(sample_id: int):
         if result is None:
             raise HTTPException(status_code=404, detail=f"Sample {sample_id} not found")
         
-        # Convert datetime to string
-        if 'created_at' in result and result['created_at']:
-            result['created_at'] = result['created_at'].isoformat()
-        
-        return result
+        return _serialize_sample(result)
     except HTTPException:
         raise
     except Exception as e:
@@ -84,75 +185,77 @@ async def get_embedding(sample_id: int):
 @router.post("/compare")
 async def compare_audio(data: CompareRequest):
     """
-    Compare a new audio file against all embeddings in the database.
+    Compare new audio files or vectors against all embeddings in the database.
     
-    Returns the top K most similar samples based on cosine similarity.
+    Returns the top K most similar samples of each query based on cosine
+    similarity, found with the ANN index (see app.services.ann_index). The
+    details of all matches are read with one query and leave out the
+    embedding unless include_vectors is set. A request with a single
+    file_url gets a single result back, batches get a list of results.
     """
     try:
-        # Download and process the audio file
-        import requests
-        import tempfile
-        import os
-        
-        response = requests.get(data.file_url)
-        if response.status_code != 200:
-            raise HTTPException(status_code=400, detail="Failed to download audio file")
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
-            tmp.write(response.content)
-            temp_path = tmp.name
-        
-        try:
-            # Preprocess and extract embedding from new audio
-            audio = preprocess_audio(temp_path)
-            new_embedding = extract_embedding(audio)
-            
-            # Fetch all database embeddings
-            ids, db_embeddings = get_embeddings_as_numpy()
-            
-            if len(ids) == 0:
-                return {
-                    "message": "No embeddings in database to compare against",
-                    "matches": []
-                }
-            
-            # Calculate cosine similarity
-            new_embedding_norm = new_embedding / np.linalg.norm(new_embedding)
-            db_embeddings_norm = db_embeddings / np.linalg.norm(db_embeddings, axis=1, keepdims=True)
-            
-            similarities = np.dot(db_embeddings_norm, new_embedding_norm)
-            
-            # Get top K matches
-            top_k_indices = np.argsort(similarities)[::-1][:data.top_k]
-            
+        queries = [("file", url) for url in ([data.file_url] if data.file_url else []) + data.file_urls]
+        queries += [("vector", index) for index in range(len(data.vectors))]
+        if not queries:
+            raise HTTPException(status_code=400, detail="Provide file_url, file_urls or vectors")
+        
+        if data.vectors:
+            dimension = embedding_dimension()
+            wrong = [index for index, vector in enumerate(data.vectors) if len(vector) != dimension]
+            if wrong:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"vectors {wrong} don't have the {dimension} dimensions of the embedding model"
+                )
+        
+        embeddings = [
+            _download_embedding(source) if kind == "file" else np.asarray(data.vectors[source], dtype=np.float32)
+            for kind, source in queries
+        ]
+        
+        # Pick up samples inserted since the last request
+        ann_index.sync()
+        
+        if ann_index.size == 0:
+            return {
+                "message": "No embeddings in database to compare against",
+                "matches": []
+            }
+        
+        searches = [
+            ann_index.search(embedding, data.top_k, nprobe=data.nprobe, rerank=data.rerank, exact=data.exact)
+            for embedding in embeddings
+        ]
+        
+        # Fetch full sample details of every match at once
+        matched_ids = {sample_id for top_ids, _, _ in searches for sample_id in top_ids.tolist()}
+        samples = get_embeddings_by_ids(sorted(matched_ids), include_embedding=data.include_vectors)
+        
+        results = []
+        for (kind, source), (top_ids, similarities, scanned) in zip(queries, searches):
             matches = []
-            for idx in top_k_indices:
-                sample_id = ids[idx]
-                similarity = float(similarities[idx])
-                
-                # Fetch full sample details
-                sample = get_embedding_by_id(sample_id)
+            for sample_id, similarity in zip(top_ids.tolist(), similarities.tolist()):
+                sample = samples.get(sample_id)
                 if sample:
-                    # Convert datetime to string
-                    if 'created_at' in sample and sample['created_at']:
-                        sample['created_at'] = sample['created_at'].isoformat()
-                    
                     matches.append({
                         "sample_id": sample_id,
                         "similarity": similarity,
-                        "details": sample
+                        "details": _serialize_sample(dict(sample))
                     })
             
-            return {
-                "query_file": data.file_url,
-                "total_samples_compared": len(ids),
+            results.append({
+                "query_file" if kind == "file" else "query_vector": source,
+                "total_samples_compared": scanned,
+                "index_size": ann_index.size,
+                "search": "exact" if data.exact or not ann_index.trained else "ivfpq",
                 "top_k": data.top_k,
                 "matches": matches
-            }
-            
-        finally:
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+            })
+        
+        if len(results) == 1 and data.file_url:
+            return results[0]
+        
+        return {"results": results}
                 
     except HTTPException:
         raise
@@ -176,8 +279,29 @@ async def export_embeddings_numpy():
             "embedding_dimension": embeddings.shape[1] if len(embeddings) > 0 else 0,
             "sample_ids": ids,
             "embeddings_shape": list(embeddings.shape),
-            "note": "Actual embedding vectors not returned in JSON. Use this endpoint to verify structure."
+            "note": "Actual embedding vectors not returned in JSON, download them from /embeddings/export."
         }
     except Exception as e:
         logger.error(f"Error exporting embeddings: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to export embeddings: {str(e)}")
+
+
+@router.post("/store/rebuild")
+async def rebuild_embedding_store():
+    """
+    Rebuild the local embedding store and the ANN index from the database.
+    
+    Only needed after samples were deleted or re-clustered, new samples are
+    picked up on their own.
+    """
+    try:
+        embedding_store.rebuild()
+        ann_index.rebuild()
+        
+        return {
+            "store": embedding_store.stats(),
+            "index": ann_index.stats()
+        }
+    except Exception as e:
+        logger.error(f"Error rebuilding embedding store: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to rebuild embedding store: {str(e)}")
@@ -1,7 +1,7 @@
 from fastapi import APIRouter
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-import tempfile
+from urllib.parse import urlparse
 import requests
 import os
 
@@ -27,18 +27,10 @@ async def process_audio(data: ProcessRequest):
             status_code=400
         )
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
-        tmp.write(response.content)
-        temp_path = tmp.name
+    filename = os.path.basename(urlparse(data.file_url).path) or "audio.wav"
+    result = processor.process(response.content, filename)
 
-    try:
-        result = processor.process(temp_path)
+    result["lat"] = data.lat
+    result["lng"] = data.lng
 
-        result["lat"] = data.lat
-        result["lng"] = data.lng
-
-        return JSONResponse(content=result)
-
-    finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+    return JSONResponse(content=result)
@@ -0,0 +1,518 @@
+import os
+import threading
+import numpy as np
+from pathlib import Path
+from typing import List, Tuple
+from app.services.embedding_store import embedding_store
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Index files live here, one directory per service instance
+ANN_INDEX_DIR = os.getenv("ANN_INDEX_DIR", str(Path(__file__).resolve().parent.parent / "models" / "ann_index"))
+# Below this many samples a brute-force scan is cheap enough, the quantizers are trained once it's reached
+ANN_MIN_TRAIN = int(os.getenv("ANN_MIN_TRAIN", "2048"))
+# Inverted lists scanned per query, more means better recall and slower queries
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+# Product quantizer sub-vectors, the embedding dimension must be a multiple of it
+ANN_SUBSPACES = int(os.getenv("ANN_SUBSPACES", "64"))
+# Approximate candidates re-scored exactly per requested result
+ANN_RERANK_FACTOR = int(os.getenv("ANN_RERANK_FACTOR", "32"))
+# Index files are rewritten in the background after this many new samples
+ANN_SAVE_EVERY = int(os.getenv("ANN_SAVE_EVERY", "256"))
+
+# The quantizers are retrained once the index grew this much past its training size
+RETRAIN_FACTOR = 4
+# Most vectors used to train the quantizers
+TRAIN_SAMPLE = 10000
+KMEANS_ITERATIONS = 15
+SYNC_BATCH = 1000
+# Rows whose vectors are read from the embedding store at a time while (re)encoding
+ENCODE_BATCH = 8192
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+def _nearest(points: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    """Index of the closest center (euclidean) for every point."""
+    # ||p - c||² = ||p||² - 2 p·c + ||c||², ||p||² doesn't change the argmin
+    return np.argmax(points @ centers.T - 0.5 * np.einsum("ij,ij->i", centers, centers), axis=1)
+
+
+def _kmeans(points: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+    """Plain Lloyd's k-means, enough to train the coarse and product quantizers."""
+    centers = points[rng.choice(len(points), size=k, replace=False)].copy()
+
+    for _ in range(KMEANS_ITERATIONS):
+        labels = _nearest(points, centers)
+        counts = np.bincount(labels, minlength=k)
+
+        # Sum the points of each cluster as contiguous runs of the sorted labels,
+        # empty clusters keep their old center
+        order = np.argsort(labels, kind="stable")
+        filled = counts > 0
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+        centers[filled] = np.add.reduceat(points[order], starts, axis=0) / counts[filled, None]
+
+    return centers
+
+
+
+
+class InvertedLists:
+    """
+    Sample ids and PQ codes per inverted list, each list in its own arrays.
+
+    A query only touches the lists it probes, so its cost follows the rows in
+    those lists rather than the size of the index.
+    """
+
+    def __init__(self, nlist: int, subspaces: int):
+        self.ids = [np.empty(0, dtype=np.int64) for _ in range(nlist)]
+        self.codes = [np.empty((0, subspaces), dtype=np.uint8) for _ in range(nlist)]
+        self.sizes = np.zeros(nlist, dtype=np.int64)
+
+    def add(self, ids: np.ndarray, lists: np.ndarray, codes: np.ndarray):
+        """Appends encoded rows to their lists, ids stay in insertion order within a list."""
+        order = np.argsort(lists, kind="stable")
+        ids, lists, codes = ids[order], lists[order], codes[order]
+        bounds = np.flatnonzero(np.diff(lists)) + 1
+
+        for start, end in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [len(lists)]))):
+            number = lists[start]
+            size, grown = self.sizes[number], self.sizes[number] + end - start
+
+            if grown > len(self.ids[number]):
+                # Grow by doubling so appends stay amortised O(subspaces)
+                capacity = max(grown, 2 * len(self.ids[number]), 16)
+                for arrays in (self.ids, self.codes):
+                    old = arrays[number]
+                    arrays[number] = np.zeros((capacity, *old.shape[1:]), dtype=old.dtype)
+                    arrays[number][:size] = old[:size]
+
+            self.ids[number][size:grown] = ids[start:end]
+            self.codes[number][size:grown] = codes[start:end]
+            self.sizes[number] = grown
+
+    def gather(self, probe: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Ids, codes and list number of every row in the probed lists."""
+        probe = [number for number in probe if self.sizes[number]]
+        if not probe:
+            return np.empty(0, dtype=np.int64), np.empty((0, self.codes[0].shape[1]), dtype=np.uint8), np.empty(0, dtype=np.int64)
+
+        return (
+            np.concatenate([self.ids[number][:self.sizes[number]] for number in probe]),
+            np.concatenate([self.codes[number][:self.sizes[number]] for number in probe]),
+            np.repeat(probe, self.sizes[probe])
+        )
+
+    def arrays(self) -> dict:
+        """The lists back to back, as saved."""
+        return {
+            "list_sizes": self.sizes.copy(),
+            "list_ids": np.concatenate([ids[:size] for ids, size in zip(self.ids, self.sizes)]),
+            "list_codes": np.concatenate([codes[:size] for codes, size in zip(self.codes, self.sizes)])
+        }
+
+    @classmethod
+    def from_arrays(cls, sizes: np.ndarray, ids: np.ndarray, codes: np.ndarray) -> "InvertedLists":
+        lists = cls(len(sizes), codes.shape[1])
+        bounds = np.cumsum(sizes)[:-1]
+        # Views of the loaded arrays, a list is only copied once it grows
+        lists.ids = np.split(ids, bounds)
+        lists.codes = np.split(codes, bounds)
+        lists.sizes = np.asarray(sizes, dtype=np.int64).copy()
+        return lists
+
+
+class AnnIndex:
+    """
+    IVF-PQ index over the unit-length UnknownSample embeddings.
+
+    A coarse k-means quantizer splits the vectors into inverted lists and a
+    product quantizer stores each vector's residual to its list center in
+    ANN_SUBSPACES bytes. A query scans only the ANN_NPROBE closest lists and
+    scores their codes with per-subspace lookup tables, then optionally
+    re-scores the best candidates exactly.
+
+    The index holds no float32 vectors of its own. Exact scans and re-scoring
+    read them from the embedding store, which every worker process maps from
+    the same files, so the index only adds ids and codes to a process.
+
+    Vectors are cosine-normalized, so the inner product is the cosine
+    similarity throughout. Until ANN_MIN_TRAIN samples exist every query is an
+    exact scan of the store.
+
+    add() only encodes and appends. Training and saving happen on a background
+    thread that sync() starts when either is due, never on the request that
+    triggered it. Training fits the quantizers without holding the lock, so
+    searches and adds go on meanwhile.
+    """
+
+    def __init__(self, directory: str = ANN_INDEX_DIR, subspaces: int = ANN_SUBSPACES,
+                 min_train: int = ANN_MIN_TRAIN, seed: int = 0, store=None):
+        self.directory = Path(directory)
+        self.subspaces = subspaces
+        self.min_train = min_train
+        self.store = store if store is not None else embedding_store
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.RLock()
+        # One training at a time, it also owns rng
+        self.train_lock = threading.Lock()
+        # One save at a time, they write the same files
+        self.save_lock = threading.Lock()
+        self.maintenance = None
+        # Bumped whenever the rows are replaced, a training of the old rows is then dropped
+        self.epoch = 0
+        self._reset()
+
+    def _reset(self):
+        self.epoch += 1
+        self.size = 0
+        self.ids = np.empty(0, dtype=np.int64)
+
+        self.coarse = None
+        self.codebooks = None
+        self.lists = None
+        self.trained_size = 0
+
+        self.last_id = 0
+        self.unsaved = 0
+
+    @property
+    def trained(self) -> bool:
+        return self.coarse is not None
+
+    @property
+    def needs_training(self) -> bool:
+        """Enough samples and either no quantizers yet or RETRAIN_FACTOR times the rows they were trained on."""
+        return self.size >= self.min_train and (
+            not self.trained or self.size >= RETRAIN_FACTOR * self.trained_size
+        )
+
+    def _reserve(self, capacity: int):
+        if capacity <= len(self.ids):
+            return
+
+        # Grow by doubling so appends stay amortised O(1)
+        grown = np.zeros(max(capacity, 2 * len(self.ids), 1024), dtype=np.int64)
+        grown[:self.size] = self.ids[:self.size]
+        self.ids = grown
+
+    def _vectors(self, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Unit-length vectors of the given samples from the embedding store, with the ids it has."""
+        found, vectors = self.store.vectors_of(ids)
+        return ids[found], vectors
+
+    def _encode(self, vectors: np.ndarray, coarse: np.ndarray = None,
+                codebooks: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Inverted list and PQ code of each (unit-length) vector, with the current quantizers by default."""
+        coarse = self.coarse if coarse is None else coarse
+        codebooks = self.codebooks if codebooks is None else codebooks
+
+        lists = _nearest(vectors, coarse)
+        residuals = vectors - coarse[lists]
+
+        width = vectors.shape[1] // self.subspaces
+        codes = np.empty((len(vectors), self.subspaces), dtype=np.uint8)
+        for m in range(self.subspaces):
+            codes[:, m] = _nearest(residuals[:, m * width:(m + 1) * width], codebooks[m])
+
+        return lists, codes
+
+    def _fill(self, lists: InvertedLists, ids: np.ndarray, coarse: np.ndarray = None,
+              codebooks: np.ndarray = None) -> int:
+        """Encodes the given samples into lists in batches, returns how many the store had."""
+        encoded = 0
+        for start in range(0, len(ids), ENCODE_BATCH):
+            batch, vectors = self._vectors(ids[start:start + ENCODE_BATCH])
+            if len(batch):
+                lists.add(batch, *self._encode(vectors, coarse, codebooks))
+            encoded += len(batch)
+        return encoded
+
+    def train(self):
+        """
+        (Re)trains the quantizers on the indexed samples and re-encodes all of them.
+
+        The quantizers are fitted to a snapshot of the rows outside the lock,
+        which is only taken to swap them in and encode the rows added meanwhile.
+        Vectors are read from the embedding store ENCODE_BATCH rows at a time.
+        """
+        with self.train_lock:
+            with self.lock:
+                epoch, size = self.epoch, self.size
+                # Rows are never written again once appended, so this view stays valid
+                ids = self.ids[:size]
+
+            sample_ids = ids
+            if size > TRAIN_SAMPLE:
+                sample_ids = ids[np.sort(self.rng.choice(size, size=TRAIN_SAMPLE, replace=False))]
+            _, sample = self._vectors(sample_ids)
+            sample = np.ascontiguousarray(sample)
+
+            dim = sample.shape[1]
+            if dim % self.subspaces:
+                raise ValueError(f"Embedding dimension {dim} is not a multiple of {self.subspaces} subspaces")
+
+            nlist = int(np.clip(np.sqrt(size), 8, 4096))
+            coarse = _kmeans(sample, nlist, self.rng)
+
+            residuals = sample - coarse[_nearest(sample, coarse)]
+            width = dim // self.subspaces
+            ksub = min(256, len(sample))
+            codebooks = np.stack([
+                _kmeans(np.ascontiguousarray(residuals[:, m * width:(m + 1) * width]), ksub, self.rng)
+                for m in range(self.subspaces)
+            ])
+
+            lists = InvertedLists(nlist, self.subspaces)
+            encoded = self._fill(lists, ids, coarse, codebooks)
+            if encoded < size:
+                logger.warning(f"{size - encoded} indexed samples are gone from the embedding store, left them out")
+
+            with self.lock:
+                if self.epoch != epoch:
+                    logger.info("Dropped ANN training, the index was replaced while it ran")
+                    return
+
+                self._fill(lists, self.ids[size:self.size], coarse, codebooks)
+                self.coarse, self.codebooks, self.lists = coarse, codebooks, lists
+                self.trained_size = size
+                self.unsaved = max(self.unsaved, 1)
+
+            logger.info(f"Trained ANN index on {len(sample)} of {size} vectors with {nlist} lists")
+
+    def _maintain(self):
+        try:
+            training = self.needs_training
+            if training:
+                self.train()
+            if training or self.unsaved >= ANN_SAVE_EVERY:
+                self.save()
+        except Exception as e:
+            logger.error(f"ANN index maintenance failed: {e}")
+
+    def maintain_in_background(self) -> bool:
+        """
+        Starts a thread that trains the index and saves it, if either is due and no such thread is running.
+
+        Returns:
+            Whether a thread was started
+        """
+        with self.lock:
+            if not self.needs_training and self.unsaved < ANN_SAVE_EVERY:
+                return False
+            if self.maintenance is not None and self.maintenance.is_alive():
+                return False
+
+            self.maintenance = threading.Thread(target=self._maintain, name="ann-maintenance", daemon=True)
+            self.maintenance.start()
+            return True
+
+    def add(self, ids: List[int], vectors: np.ndarray):
+        """
+        Append samples, encoded with the current quantizers if there are any.
+
+        Args:
+            ids: UnknownSample ids, increasing and already in the embedding store
+            vectors: 2D array with one embedding per id
+        """
+        if len(ids) == 0:
+            return
+
+        ids = np.asarray(ids, dtype=np.int64)
+
+        with self.lock:
+            start, end = self.size, self.size + len(ids)
+            self._reserve(end)
+
+            self.ids[start:end] = ids
+            if self.trained:
+                vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+                self.lists.add(ids, *self._encode(vectors))
+
+            self.size = end
+            self.last_id = max(self.last_id, int(ids[-1]))
+            self.unsaved += len(ids)
+
+    def search(self, query: np.ndarray, k: int, nprobe: int = ANN_NPROBE,
+               rerank: bool = True, exact: bool = False) -> Tuple[np.ndarray, np.ndarray, int]:
+        """
+        Find the k samples most similar to query.
+
+        Args:
+            query: Embedding vector
+            k: Number of results
+            nprobe: Inverted lists to scan
+            rerank: Re-score the best ANN_RERANK_FACTOR * k candidates exactly
+            exact: Skip the index and scan every vector in the embedding store
+
+        Returns:
+            Tuple of (sample ids, cosine similarities, vectors scanned),
+            best match first
+        """
+        query = _normalize(np.asarray(query, dtype=np.float32).ravel())
+
+        with self.lock:
+            if self.size == 0 or k <= 0:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), 0
+
+            if exact or not self.trained:
+                candidates, _, scores = self.store.similarities(query)
+                scanned = len(candidates)
+            else:
+                coarse_scores = self.coarse @ query
+                nprobe = min(max(1, nprobe), len(self.coarse))
+                probe = np.argpartition(-coarse_scores, nprobe - 1)[:nprobe]
+
+                candidates, codes, lists = self.lists.gather(probe)
+                scanned = len(candidates)
+                width = len(query) // self.subspaces
+                tables = np.einsum("mkd,md->mk", self.codebooks, query.reshape(self.subspaces, width))
+                scores = coarse_scores[lists] + tables[np.arange(self.subspaces), codes].sum(axis=1)
+
+                if rerank:
+                    keep = min(len(candidates), max(k, ANN_RERANK_FACTOR * k))
+                    if keep < len(candidates):
+                        candidates = candidates[np.argpartition(-scores, keep - 1)[:keep]]
+                    candidates, vectors = self._vectors(np.sort(candidates))
+                    scores = vectors @ query
+
+        k = min(k, len(candidates))
+        if k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), scanned
+
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        return candidates[top], scores[top], scanned
+
+    def save(self):
+        """
+        Writes the index to directory, the file is replaced atomically.
+
+        Only ids, codes and quantizers are written, the vectors stay in the
+        embedding store. The lock is held just to copy them.
+        """
+        with self.save_lock:
+            with self.lock:
+                arrays = {
+                    "ids": self.ids[:self.size].copy(),
+                    "last_id": np.int64(self.last_id),
+                    "trained_size": np.int64(self.trained_size)
+                }
+                if self.trained:
+                    arrays["coarse"] = self.coarse
+                    arrays["codebooks"] = self.codebooks
+                    arrays.update(self.lists.arrays())
+                saved = self.unsaved
+
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp = self.directory / "index.npz.tmp"
+            with open(tmp, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(tmp, self.directory / "index.npz")
+
+            with self.lock:
+                self.unsaved = max(0, self.unsaved - saved)
+
+            logger.info(f"Saved ANN index with {len(arrays['ids'])} samples to {self.directory}")
+
+    def load(self) -> bool:
+        """
+        Reads a saved index.
+
+        Returns:
+            False if there is no usable index on disk
+        """
+        index_path = self.directory / "index.npz"
+        if not index_path.exists():
+            return False
+
+        with self.lock:
+            try:
+                with np.load(index_path) as saved:
+                    arrays = {name: saved[name] for name in saved.files}
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable ANN index in {self.directory}: {e}")
+                return False
+
+            if "coarse" in arrays and "list_sizes" not in arrays:
+                logger.warning(f"Ignoring ANN index in {self.directory}, it was saved without inverted lists")
+                return False
+            if "coarse" in arrays and arrays["list_codes"].shape[1] != self.subspaces:
+                logger.warning(f"Ignoring ANN index in {self.directory}, it has a different number of subspaces")
+                return False
+
+            self.epoch += 1
+            self.size = len(arrays["ids"])
+            self.ids = arrays["ids"]
+            self.coarse = arrays.get("coarse")
+            self.codebooks = arrays.get("codebooks")
+            self.lists = InvertedLists.from_arrays(
+                arrays["list_sizes"], arrays["list_ids"], arrays["list_codes"]
+            ) if self.trained else None
+            self.last_id = int(arrays["last_id"])
+            self.trained_size = int(arrays["trained_size"])
+            self.unsaved = 0
+
+        logger.info(f"Loaded ANN index with {self.size} samples up to sample {self.last_id}")
+        return True
+
+    def _sync(self) -> int:
+        self.store.sync()
+
+        added = 0
+        with self.lock:
+            for ids, vectors in self.store.after(self.last_id):
+                for start in range(0, len(ids), SYNC_BATCH):
+                    self.add(ids[start:start + SYNC_BATCH], vectors[start:start + SYNC_BATCH])
+                added += len(ids)
+
+        if added:
+            logger.info(f"Added {added} samples to the ANN index")
+        return added
+
+    def sync(self) -> int:
+        """
+        Adds the samples the embedding store got since the last sync.
+
+        Samples are read by id after last_id. The embedding store holds rows back
+        while an id in front of them may still commit, one that commits later
+        than that is only picked up by rebuild(). Training and saving, when due,
+        run in the background.
+
+        Returns:
+            Number of samples added
+        """
+        added = self._sync()
+        self.maintain_in_background()
+        return added
+
+    def rebuild(self):
+        """Drops the index, builds it again from the embedding store and trains it right away."""
+        with self.lock:
+            self._reset()
+            self._sync()
+
+        if self.needs_training:
+            self.train()
+        self.save()
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "trained": self.trained,
+            "lists": len(self.coarse) if self.trained else 0,
+            "largest_list": int(self.lists.sizes.max()) if self.trained else 0,
+            "trained_size": self.trained_size,
+            "last_id": self.last_id,
+            "unsaved": self.unsaved
+        }
+
+
+ann_index = AnnIndex()
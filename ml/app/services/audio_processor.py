@@ -2,10 +2,10 @@
 
 import numpy as np
 
-from .preprocess import preprocess_audio
+from .preprocess import preprocess_audio, decode_audio_bytes
 from .whisper_utils import load_whisper_model, detect_language, transcribe_audio
 from .embeddings import load_embedding_model, extract_embedding
-from .clustering import cluster_embedding, cluster_embedding_with_db
+from .clustering import cluster_embedding
 from app.utils.logger import get_logger
 
 logger = get_logger(__name__)
@@ -33,14 +33,21 @@ class AudioProcessor:
         self.use_db_clustering = use_db_clustering
 
 
-    def process(self, path: str):
-        
+    def process(self, source, filename: str = "audio.wav"):
+        """
+        Runs the pipeline on a file path or on the raw bytes of a download.
 
-        audio, sr = preprocess_audio(path)
+        Bytes are decoded in memory and the decoded array is reused for
+        Whisper, so the audio is only decoded once.
+        """
+        if isinstance(source, (bytes, bytearray)):
+            audio, sr = decode_audio_bytes(source, filename)
+        else:
+            audio, sr = preprocess_audio(source)
 
         lang, confidence = detect_language(audio)
 
-        transcript = transcribe_audio(path)
+        transcript = transcribe_audio(audio)
 
         embedding = extract_embedding(audio)
 
@@ -51,24 +58,23 @@ class AudioProcessor:
         if confidence < self.conf_threshold:
             if self.use_db_clustering:
                 try:
-                    from app.services.db_embeddings import get_embeddings_as_numpy
+                    from app.services.ann_index import ann_index
                     from app.services.db_clusters import create_new_cluster
+                    from app.services.db_embeddings import get_embeddings_by_ids
                     
-                    db_ids, db_embeddings = get_embeddings_as_numpy()
+                    # Closest stored sample from the ANN index, so the cost doesn't
+                    # grow with the archive the way a scan of every sample does
+                    ann_index.sync()
+                    best_ids, similarities, _ = ann_index.search(embedding, 1)
                     
-                    if len(db_ids) > 0:
-                        from app.services.db_embeddings import get_all_embeddings
-                        db_samples = get_all_embeddings()
-                        db_cluster_ids = [sample.get('cluster_id') for sample in db_samples]
+                    if len(best_ids) > 0:
+                        similarity_score = float(similarities[0])
                         
-                        cluster_id, similarity_score = cluster_embedding_with_db(
-                            embedding=embedding,
-                            db_embeddings=db_embeddings,
-                            db_cluster_ids=db_cluster_ids,
-                            similarity_threshold=self.similarity_threshold,
-                            eps=self.clustering_eps,
-                            use_dbscan=False
-                        )
+                        if similarity_score >= self.similarity_threshold:
+                            # The index only holds the cluster a sample had when it was stored
+                            best_sample = get_embeddings_by_ids([int(best_ids[0])]).get(int(best_ids[0]))
+                            if best_sample is not None and best_sample['cluster_id'] is not None:
+                                cluster_id = best_sample['cluster_id']
                         
                         if cluster_id is None:
                             cluster_id = create_new_cluster(centroid=embedding)
@@ -3,10 +3,22 @@ import numpy as np
 from typing import Optional, Dict, Any
 from app.utils.db import execute_query
 from app.utils.logger import get_logger
+from app.services.vector_codec import VECTOR_STORAGE, encode_vector, decode_vector
 
 logger = get_logger(__name__)
 
 
+def _centroid_params(centroid: Optional[np.ndarray]) -> tuple:
+    """(json, binary) column values for the configured VECTOR_STORAGE, the other one is NULL."""
+    if centroid is None:
+        return None, None
+
+    if VECTOR_STORAGE == "bytea":
+        return None, encode_vector(centroid)
+
+    return json.dumps(np.asarray(centroid).tolist()), None
+
+
 def create_new_cluster(centroid: Optional[np.ndarray] = None) -> int:
     """
     Create a new cluster in the database.
@@ -17,18 +29,14 @@ def create_new_cluster(centroid: Optional[np.ndarray] = None) -> int:
     Returns:
         The ID of the newly created cluster
     """
-    centroid_json = None
-    if centroid is not None:
-        centroid_json = json.dumps(centroid.tolist())
-    
     query = """
-        INSERT INTO "Cluster" (centroid, "sampleCount", "createdAt")
-        VALUES (%s, 0, NOW())
+        INSERT INTO "Cluster" (centroid, "centroidVec", "sampleCount", "createdAt")
+        VALUES (%s, %s, 0, NOW())
         RETURNING id
     """
     
     try:
-        result = execute_query(query, params=(centroid_json,), fetch=True)
+        result = execute_query(query, params=_centroid_params(centroid), fetch=True)
         cluster_id = result[0]['id']
         logger.info(f"Created new cluster with ID: {cluster_id}")
         return cluster_id
@@ -45,16 +53,14 @@ def update_cluster_centroid(cluster_id: int, centroid: np.ndarray):
         cluster_id: The cluster ID to update
         centroid: New centroid vector (numpy array)
     """
-    centroid_json = json.dumps(centroid.tolist())
-    
     query = """
         UPDATE "Cluster"
-        SET centroid = %s
+        SET centroid = %s, "centroidVec" = %s
         WHERE id = %s
     """
     
     try:
-        execute_query(query, params=(centroid_json, cluster_id), fetch=False)
+        execute_query(query, params=(*_centroid_params(centroid), cluster_id), fetch=False)
         logger.info(f"Updated centroid for cluster {cluster_id}")
     except Exception as e:
         logger.error(f"Error updating cluster centroid: {e}")
@@ -93,7 +99,7 @@ def get_cluster_info(cluster_id: int) -> Optional[Dict[str, Any]]:
         Dictionary with cluster information or None if not found
     """
     query = """
-        SELECT id, centroid, "sampleCount", "createdAt"
+        SELECT id, centroid, "centroidVec", "sampleCount", "createdAt"
         FROM "Cluster"
         WHERE id = %s
     """
@@ -101,7 +107,11 @@ def get_cluster_info(cluster_id: int) -> Optional[Dict[str, Any]]:
     try:
         result = execute_query(query, params=(cluster_id,), fetch=True)
         if result:
-            return result[0]
+            row = result[0]
+            vector = row.pop('centroidVec', None)
+            if vector is not None:
+                row['centroid'] = decode_vector(vector).tolist()
+            return row
         return None
     except Exception as e:
         logger.error(f"Error fetching cluster info: {e}")
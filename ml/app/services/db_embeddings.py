@@ -1,46 +1,182 @@
 import numpy as np
-from typing import List, Optional, Dict, Any
-from app.utils.db import execute_query
+from datetime import datetime
+from typing import List, Optional, Dict, Any, Iterator, Tuple
+from app.utils.db import execute_query, stream_query
 from app.utils.logger import get_logger
+from app.services.vector_codec import decode_vector
 
 logger = get_logger(__name__)
 
 
-def get_all_embeddings(limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
+def _with_embedding(row: Dict[str, Any]) -> Dict[str, Any]:
     """
-    Fetch all embeddings from the UnknownSample table.
+    Put the vector of a row under 'embedding', whichever column stores it.
+
+    Rows written with VECTOR_STORAGE=bytea have the vector in "embeddingVec",
+    it is decoded without copying and wins over the JSON column.
+    """
+    vector = row.pop('embedding_vec', None)
+    if vector is not None:
+        row['embedding'] = decode_vector(vector)
+    return row
+
+
+# Field name -> column expression for a projected UnknownSample query
+SAMPLE_FIELDS = {
+    'id': 'id',
+    'file_url': '"fileUrl" as file_url',
+    'language_guess': '"languageGuess" as language_guess',
+    'confidence': 'confidence',
+    'transcript': 'transcript',
+    'cluster_id': '"clusterId" as cluster_id',
+    'region': 'region',
+    'lat': 'lat',
+    'lng': 'lng',
+    'keywords': 'keywords',
+    'created_at': '"createdAt" as created_at',
+    'embedding': 'embedding, "embeddingVec" as embedding_vec'
+}
+
+# Everything but the vector
+METADATA_FIELDS = [field for field in SAMPLE_FIELDS if field != 'embedding']
+
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """
+    Parse a comma separated field list, e.g. "id,cluster_id,embedding".
     
     Args:
-        limit: Maximum number of records to fetch (None for all)
+        fields: Field names from SAMPLE_FIELDS, None or empty for the default
+        
+    Returns:
+        List of field names, or None if none were given
+        
+    Raises:
+        ValueError: For unknown field names
+    """
+    if not fields:
+        return None
+    
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SAMPLE_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields {unknown}, choose from {list(SAMPLE_FIELDS)}")
+    
+    return names
+
+
+def _sample_conditions(
+    after_id: Optional[int] = None,
+    cluster_id: Optional[int] = None,
+    region: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    has_embedding: bool = False
+) -> Tuple[str, list]:
+    """WHERE clause and its params for the UnknownSample filters, empty without any."""
+    conditions, params = [], []
+    if after_id is not None:
+        conditions.append("id > %s")
+        params.append(after_id)
+    if cluster_id is not None:
+        conditions.append('"clusterId" = %s')
+        params.append(cluster_id)
+    if region is not None:
+        conditions.append("region = %s")
+        params.append(region)
+    if created_after is not None:
+        conditions.append('"createdAt" >= %s')
+        params.append(created_after)
+    if created_before is not None:
+        conditions.append('"createdAt" < %s')
+        params.append(created_before)
+    if has_embedding:
+        conditions.append('(embedding IS NOT NULL OR "embeddingVec" IS NOT NULL)')
+    
+    return ("WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+
+def build_sample_query(
+    fields: Optional[List[str]] = None,
+    after_id: Optional[int] = None,
+    cluster_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    offset: int = 0,
+    **filters
+) -> Tuple[str, tuple]:
+    """
+    Build a parameterized UnknownSample query in id order.
+    
+    Args:
+        fields: Fields to select (see SAMPLE_FIELDS), None for all of them.
+            The id is always selected.
+        after_id: Only samples with a larger ID (keyset pagination)
+        cluster_id: Only samples of this cluster
+        limit: Maximum number of records
         offset: Number of records to skip
+        **filters: region, created_after, created_before or has_embedding
         
     Returns:
-        List of dictionaries containing id, embedding, and metadata
+        Tuple of (query, params)
     """
-    query = """
+    fields = list(SAMPLE_FIELDS) if fields is None else ['id'] + [f for f in fields if f != 'id']
+    columns = ",\n            ".join(SAMPLE_FIELDS[field] for field in fields)
+    where, params = _sample_conditions(after_id, cluster_id, **filters)
+    
+    query = f"""
         SELECT 
-            id,
-            "fileUrl" as file_url,
-            "languageGuess" as language_guess,
-            confidence,
-            transcript,
-            "clusterId" as cluster_id,
-            region,
-            keywords,
-            embedding,
-            "createdAt" as created_at
+            {columns}
         FROM "UnknownSample"
+        {where}
         ORDER BY id
     """
     
     if limit is not None:
-        query += f" LIMIT {limit}"
+        query += " LIMIT %s"
+        params.append(limit)
     
     if offset > 0:
-        query += f" OFFSET {offset}"
+        query += " OFFSET %s"
+        params.append(offset)
+    
+    return query, tuple(params)
+
+
+def build_count_query(after_id: Optional[int] = None, cluster_id: Optional[int] = None, **filters) -> Tuple[str, tuple]:
+    """
+    Build the COUNT(*) query matching build_sample_query with the same filters.
+    
+    Returns:
+        Tuple of (query, params)
+    """
+    where, params = _sample_conditions(after_id, cluster_id, **filters)
+    return f'SELECT COUNT(*) AS count FROM "UnknownSample" {where}', tuple(params)
+
+
+def get_all_embeddings(
+    limit: Optional[int] = None,
+    offset: int = 0,
+    after_id: Optional[int] = None,
+    cluster_id: Optional[int] = None,
+    fields: Optional[List[str]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Fetch all embeddings from the UnknownSample table.
+    
+    Args:
+        limit: Maximum number of records to fetch (None for all)
+        offset: Number of records to skip
+        after_id: Only samples with a larger ID, cheaper than offset for paging
+        cluster_id: Only samples of this cluster
+        fields: Fields to return (see SAMPLE_FIELDS), None for all of them
+        
+    Returns:
+        List of dictionaries containing id, embedding, and metadata
+    """
+    query, params = build_sample_query(fields, after_id, cluster_id, limit, offset)
     
     try:
-        results = execute_query(query, fetch=True)
+        results = [_with_embedding(row) for row in execute_query(query, params=params, fetch=True)]
         logger.info(f"Fetched {len(results)} embeddings from database")
         return results
     except Exception as e:
@@ -48,6 +184,36 @@ def get_all_embeddings(limit: Optional[int] = None, offset: int = 0) -> List[Dic
         raise
 
 
+def iter_embeddings(
+    fields: Optional[List[str]] = None,
+    after_id: Optional[int] = None,
+    cluster_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    batch_size: int = 1000,
+    conn=None,
+    **filters
+) -> Iterator[Dict[str, Any]]:
+    """
+    Stream samples from a server-side cursor, batch_size rows at a time.
+    
+    Args:
+        fields: Fields to return (see SAMPLE_FIELDS), None for all of them
+        after_id: Only samples with a larger ID
+        cluster_id: Only samples of this cluster
+        limit: Maximum number of records (None for all)
+        batch_size: Rows fetched per round trip
+        conn: Connection to run on, e.g. from snapshot_connection(), a dedicated one by default
+        **filters: region, created_after, created_before or has_embedding
+        
+    Yields:
+        One dictionary per sample, in id order
+    """
+    query, params = build_sample_query(fields, after_id, cluster_id, limit, **filters)
+    
+    for row in stream_query(query, params=params, batch_size=batch_size, conn=conn):
+        yield _with_embedding(row)
+
+
 def get_embedding_by_id(sample_id: int) -> Optional[Dict[str, Any]]:
     """
     Fetch a single embedding by ID.
@@ -69,6 +235,7 @@ def get_embedding_by_id(sample_id: int) -> Optional[Dict[str, Any]]:
             region,
             keywords,
             embedding,
+            "embeddingVec" as embedding_vec,
             "createdAt" as created_at
         FROM "UnknownSample"
         WHERE id = %s
@@ -78,7 +245,7 @@ def get_embedding_by_id(sample_id: int) -> Optional[Dict[str, Any]]:
         results = execute_query(query, params=(sample_id,), fetch=True)
         if results:
             logger.info(f"Fetched embedding for sample ID: {sample_id}")
-            return results[0]
+            return _with_embedding(results[0])
         logger.warning(f"No embedding found for sample ID: {sample_id}")
         return None
     except Exception as e:
@@ -86,6 +253,92 @@ def get_embedding_by_id(sample_id: int) -> Optional[Dict[str, Any]]:
         raise
 
 
+def get_embeddings_by_ids(sample_ids: List[int], include_embedding: bool = False) -> Dict[int, Dict[str, Any]]:
+    """
+    Fetch several samples in one query.
+    
+    Args:
+        sample_ids: IDs of the UnknownSample records
+        include_embedding: Also return the embedding vectors
+        
+    Returns:
+        Dictionary of sample ID to sample, IDs that don't exist are missing
+    """
+    if not sample_ids:
+        return {}
+    
+    vector_columns = """,
+            embedding,
+            "embeddingVec" as embedding_vec""" if include_embedding else ""
+    
+    query = f"""
+        SELECT 
+            id,
+            "fileUrl" as file_url,
+            "languageGuess" as language_guess,
+            confidence,
+            transcript,
+            "clusterId" as cluster_id,
+            region,
+            keywords,
+            "createdAt" as created_at{vector_columns}
+        FROM "UnknownSample"
+        WHERE id = ANY(%s)
+    """
+    
+    try:
+        results = execute_query(query, params=(list(sample_ids),), fetch=True)
+        logger.info(f"Fetched {len(results)} of {len(sample_ids)} samples by ID")
+        return {row['id']: _with_embedding(row) for row in results}
+    except Exception as e:
+        logger.error(f"Error fetching embeddings by IDs: {e}")
+        raise
+
+
+def get_vectors_after(after_id: int, limit: int) -> List[Dict[str, Any]]:
+    """
+    Fetch only the id, cluster, age and vector of samples after a given id.
+    
+    Samples without an embedding are included too (embedding None), so
+    callers can tell them apart from ids that aren't committed yet.
+    
+    Args:
+        after_id: Return samples with a larger ID than this
+        limit: Maximum number of records to fetch
+        
+    Returns:
+        List of dictionaries with id, cluster_id, age (seconds since
+        createdAt, by the database clock) and embedding, ordered by id
+    """
+    query = """
+        SELECT 
+            id,
+            "clusterId" as cluster_id,
+            EXTRACT(EPOCH FROM now() - "createdAt") as age,
+            embedding,
+            "embeddingVec" as embedding_vec
+        FROM "UnknownSample"
+        WHERE id > %s
+        ORDER BY id
+        LIMIT %s
+    """
+    
+    try:
+        results = execute_query(query, params=(after_id, limit), fetch=True)
+        return [
+            {
+                'id': row['id'],
+                'cluster_id': row['cluster_id'],
+                'age': float(row['age']),
+                'embedding': parse_embedding_to_numpy(row['embedding']) if row['embedding'] is not None else None
+            }
+            for row in map(_with_embedding, results)
+        ]
+    except Exception as e:
+        logger.error(f"Error fetching vectors after ID {after_id}: {e}")
+        raise
+
+
 def get_embeddings_by_cluster(cluster_id: Optional[int]) -> List[Dict[str, Any]]:
     """
     Fetch embeddings filtered by cluster ID.
@@ -108,6 +361,7 @@ def get_embeddings_by_cluster(cluster_id: Optional[int]) -> List[Dict[str, Any]]
                 region,
                 keywords,
                 embedding,
+                "embeddingVec" as embedding_vec,
                 "createdAt" as created_at
             FROM "UnknownSample"
             WHERE "clusterId" IS NULL
@@ -126,6 +380,7 @@ def get_embeddings_by_cluster(cluster_id: Optional[int]) -> List[Dict[str, Any]]
                 region,
                 keywords,
                 embedding,
+                "embeddingVec" as embedding_vec,
                 "createdAt" as created_at
             FROM "UnknownSample"
             WHERE "clusterId" = %s
@@ -134,7 +389,7 @@ def get_embeddings_by_cluster(cluster_id: Optional[int]) -> List[Dict[str, Any]]
         params = (cluster_id,)
     
     try:
-        results = execute_query(query, params=params, fetch=True)
+        results = [_with_embedding(row) for row in execute_query(query, params=params, fetch=True)]
         logger.info(f"Fetched {len(results)} embeddings for cluster {cluster_id}")
         return results
     except Exception as e:
@@ -147,12 +402,19 @@ def parse_embedding_to_numpy(embedding_json: Any) -> np.ndarray:
     Convert JSON embedding to numpy array.
     
     Args:
-        embedding_json: JSON array or list representing the embedding
+        embedding_json: JSON array or list representing the embedding,
+            or the packed bytes of a binary one
         
     Returns:
         Numpy array of the embedding
     """
     try:
+        if isinstance(embedding_json, np.ndarray):
+            return embedding_json.astype(np.float32, copy=False)
+
+        if isinstance(embedding_json, (bytes, memoryview)):
+            return decode_vector(embedding_json)
+
         if isinstance(embedding_json, list):
             return np.array(embedding_json, dtype=np.float32)
         
@@ -0,0 +1,390 @@
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+import numpy as np
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Tuple
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Shared by every worker process on the host, they map the same files
+EMBEDDING_STORE_DIR = os.getenv(
+    "EMBEDDING_STORE_DIR", str(Path(__file__).resolve().parent.parent / "models" / "embedding_store")
+)
+# The append-only tail is merged into the base once it holds this many rows
+EMBEDDING_STORE_COMPACT_ROWS = int(os.getenv("EMBEDDING_STORE_COMPACT_ROWS", "4096"))
+# How long a missing id may still be an insert that hasn't committed, see settled()
+EMBEDDING_STORE_SETTLE_SECONDS = float(os.getenv("EMBEDDING_STORE_SETTLE_SECONDS", "30"))
+# Postgres is asked for new samples at most this often, by all processes on the host together
+EMBEDDING_STORE_SYNC_SECONDS = float(os.getenv("EMBEDDING_STORE_SYNC_SECONDS", "2"))
+
+SYNC_BATCH = 1000
+COPY_ROWS = 65536
+# Stored for samples without a cluster
+NO_CLUSTER = -1
+
+# Row data of a segment, one file each, written in this order so that a row
+# counts once its id is in place
+COLUMNS = (("vectors", np.float32), ("clusters", np.int64), ("ids", np.int64))
+
+
+def settled(rows: List[dict], last_id: int, settle_seconds: float = EMBEDDING_STORE_SETTLE_SECONDS) -> List[dict]:
+    """
+    The rows that can be stored without skipping a sample for good.
+
+    Ids are handed out before the insert commits, so a gap in front of a row
+    can be a sample that is still being written. The store only moves past
+    ids, so rows behind a gap wait until they are settle_seconds old. Older
+    gaps are deleted or rolled back samples.
+
+    Args:
+        rows: Rows from get_vectors_after(last_id), in id order
+        last_id: Newest stored id
+
+    Returns:
+        The leading rows up to the first one behind a recent gap
+    """
+    previous = last_id
+    for position, row in enumerate(rows):
+        if row['id'] != previous + 1 and row['age'] < settle_seconds:
+            return rows[:position]
+        previous = row['id']
+    return rows
+
+
+class EmbeddingStore:
+    """
+    On-disk copy of the UnknownSample vectors that worker processes memory-map.
+
+    Vectors are stored cosine-normalized as float32 rows next to their sample
+    and cluster ids. A generation directory holds a compacted base segment
+    and an append-only tail, each a set of raw little-endian files
+    (ids, clusters, vectors). sync() appends the samples inserted since the
+    last one to the tail, holding back rows behind an id that may not have
+    committed yet (see settled()). Once the tail reaches EMBEDDING_STORE_COMPACT_ROWS,
+    base and tail are concatenated into a new generation, and the CURRENT
+    file is switched to it atomically. rebuild() writes a new generation
+    straight from Postgres.
+
+    Readers never copy the matrix. They map the files, so scans run against
+    the page cache, and every process on the host shares the same physical
+    pages. Writers in different processes take a file lock.
+    """
+
+    def __init__(self, directory: str = EMBEDDING_STORE_DIR, compact_rows: int = EMBEDDING_STORE_COMPACT_ROWS,
+                 sync_seconds: float = EMBEDDING_STORE_SYNC_SECONDS):
+        self.directory = Path(directory)
+        self.compact_rows = compact_rows
+        self.sync_seconds = sync_seconds
+        self.lock = threading.RLock()
+
+        self.generation = None
+        self.dim = 0
+        self.base = self._empty()
+        self.tail = self._empty()
+
+    def _empty(self):
+        return {
+            "ids": np.empty(0, dtype=np.int64),
+            "clusters": np.empty(0, dtype=np.int64),
+            "vectors": np.empty((0, self.dim), dtype=np.float32)
+        }
+
+    @contextmanager
+    def _writer(self):
+        """Serialises writers across threads and processes."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with self.lock, open(self.directory / ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self.refresh()
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _path(self, generation: int, segment: str, column: str) -> Path:
+        return self.directory / f"gen-{generation}" / f"{segment}.{column}"
+
+    def _read_current(self):
+        try:
+            current = json.loads((self.directory / "CURRENT").read_text())
+            return current["generation"], current["dim"]
+        except FileNotFoundError:
+            return None, 0
+
+    def _write_current(self, generation: int, dim: int):
+        tmp = self.directory / "CURRENT.tmp"
+        tmp.write_text(json.dumps({"generation": generation, "dim": dim}))
+        os.replace(tmp, self.directory / "CURRENT")
+
+    def _map(self, generation: int, segment: str) -> dict:
+        """Maps the complete rows of a segment, the id file decides how many there are."""
+        id_path = self._path(generation, segment, "ids")
+        rows = id_path.stat().st_size // 8 if id_path.exists() else 0
+        if rows == 0:
+            return self._empty()
+
+        mapped = {}
+        for column, dtype in COLUMNS:
+            shape = (rows, self.dim) if column == "vectors" else (rows,)
+            mapped[column] = np.memmap(self._path(generation, segment, column), dtype=dtype, mode="r", shape=shape)
+        return mapped
+
+    def refresh(self):
+        """Picks up rows and generations written by other processes, cheap when nothing changed."""
+        with self.lock:
+            generation, dim = self._read_current()
+
+            if generation != self.generation or dim != self.dim:
+                self.generation, self.dim = generation, dim
+                self.base = self._map(generation, "base") if generation is not None else self._empty()
+                self.tail = self._empty()
+
+            if generation is not None:
+                rows = self._path(generation, "tail", "ids")
+                if rows.exists() and rows.stat().st_size // 8 != len(self.tail["ids"]):
+                    self.tail = self._map(generation, "tail")
+
+    def _append(self, ids: List[int], clusters: List[int], vectors: np.ndarray):
+        if self.generation is None:
+            self._new_generation(0, vectors.shape[1])
+        elif self.dim == 0:
+            self._write_current(self.generation, vectors.shape[1])
+            self.refresh()
+
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Embedding has {vectors.shape[1]} dimensions, the store holds {self.dim}")
+
+        rows = len(self.tail["ids"])
+        values = {
+            "vectors": vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12),
+            "clusters": np.asarray(clusters, dtype=np.int64),
+            "ids": np.asarray(ids, dtype=np.int64)
+        }
+
+        for column, dtype in COLUMNS:
+            path = self._path(self.generation, "tail", column)
+            width = np.dtype(dtype).itemsize * (self.dim if column == "vectors" else 1)
+            with open(path, "ab") as f:
+                # Drops whatever a writer that died halfway left behind the last complete row
+                f.truncate(rows * width)
+                f.write(np.ascontiguousarray(values[column], dtype=dtype).tobytes())
+
+        self.refresh()
+
+    def append(self, ids: List[int], clusters: List[int], vectors: np.ndarray):
+        """
+        Append samples to the tail.
+
+        Args:
+            ids: UnknownSample ids, increasing and above last_id
+            clusters: Cluster id of each sample, NO_CLUSTER for none
+            vectors: 2D array with one embedding per id
+        """
+        with self._writer():
+            self._append(ids, clusters, np.asarray(vectors, dtype=np.float32))
+
+    def _new_generation(self, generation: int, dim: int, segments=()):
+        """Writes the given segments one after another as the base of a new generation and switches to it."""
+        directory = self.directory / f"gen-{generation}"
+        shutil.rmtree(directory, ignore_errors=True)
+        directory.mkdir(parents=True)
+
+        for column, dtype in COLUMNS:
+            with open(directory / f"base.{column}", "wb") as out:
+                for segment in segments:
+                    # In slices, so compacting a large store doesn't read it into memory at once
+                    for start in range(0, len(segment[column]), COPY_ROWS):
+                        out.write(np.ascontiguousarray(segment[column][start:start + COPY_ROWS], dtype=dtype).tobytes())
+            (directory / f"tail.{column}").touch()
+
+        old = self.generation
+        self._write_current(generation, dim)
+        self.refresh()
+
+        # Processes that still map the old files keep them until they refresh
+        if old is not None and old != generation:
+            shutil.rmtree(self.directory / f"gen-{old}", ignore_errors=True)
+
+    def compact(self):
+        """Merges the tail into a new base."""
+        with self._writer():
+            if len(self.tail["ids"]) == 0:
+                return
+
+            self._new_generation(self.generation + 1, self.dim, (self.base, self.tail))
+            logger.info(f"Compacted embedding store to {self.size} rows (generation {self.generation})")
+
+    def _sync(self) -> int:
+        from app.services.db_embeddings import get_vectors_after
+
+        added = 0
+        after_id = self.last_id
+        while True:
+            fetched = get_vectors_after(after_id, SYNC_BATCH)
+            rows = settled(fetched, after_id)
+            # Samples without an embedding only count for spotting gaps
+            stored = [row for row in rows if row['embedding'] is not None]
+
+            if stored:
+                self._append(
+                    [row['id'] for row in stored],
+                    [NO_CLUSTER if row['cluster_id'] is None else row['cluster_id'] for row in stored],
+                    np.vstack([row['embedding'] for row in stored])
+                )
+                added += len(stored)
+
+            if not rows or len(rows) < len(fetched):
+                break
+            after_id = rows[-1]['id']
+
+        if len(self.tail["ids"]) >= self.compact_rows:
+            self._new_generation(self.generation + 1, self.dim, (self.base, self.tail))
+
+        return added
+
+    def _synced_recently(self) -> bool:
+        """Whether any process on the host synced within sync_seconds, the .synced file's mtime says when."""
+        try:
+            return time.time() - (self.directory / ".synced").stat().st_mtime < self.sync_seconds
+        except FileNotFoundError:
+            return False
+
+    def sync(self, force: bool = False) -> int:
+        """
+        Appends the samples inserted since the last sync, compacting when the tail is full.
+
+        Requests call this before every search, so it only takes the file lock
+        and queries Postgres once per sync_seconds across all processes. In
+        between it just maps the rows other processes appended.
+
+        Args:
+            force: Sync even if another sync just ran
+
+        Returns:
+            Number of samples added
+        """
+        if not force and self._synced_recently():
+            self.refresh()
+            return 0
+
+        with self._writer():
+            # Another process may have synced while this one waited for the lock
+            if not force and self._synced_recently():
+                return 0
+
+            added = self._sync()
+            (self.directory / ".synced").touch()
+
+        if added:
+            logger.info(f"Added {added} samples to the embedding store")
+        return added
+
+    def rebuild(self):
+        """Replaces the store with a fresh copy of the UnknownSample table."""
+        with self._writer():
+            self._new_generation((self.generation or 0) + 1, 0)
+            self._sync()
+
+        logger.info(f"Rebuilt embedding store with {self.size} rows")
+
+    @property
+    def size(self) -> int:
+        return len(self.base["ids"]) + len(self.tail["ids"])
+
+    @property
+    def last_id(self) -> int:
+        for segment in (self.tail, self.base):
+            if len(segment["ids"]):
+                return int(segment["ids"][-1])
+        return 0
+
+    def segments(self):
+        """The mapped (ids, clusters, vectors) of the base and of the tail."""
+        with self.lock:
+            return [
+                (segment["ids"], segment["clusters"], segment["vectors"])
+                for segment in (self.base, self.tail) if len(segment["ids"])
+            ]
+
+    def similarities(self, query: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Cosine similarity of query to every stored sample.
+
+        Args:
+            query: Embedding vector
+
+        Returns:
+            Tuple of (sample ids, cluster ids, similarities), cluster id
+            NO_CLUSTER for unclustered samples
+        """
+        query = np.asarray(query, dtype=np.float32).ravel()
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+        segments = self.segments()
+        if not segments:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        return (
+            np.concatenate([ids for ids, _, _ in segments]),
+            np.concatenate([clusters for _, clusters, _ in segments]),
+            np.concatenate([vectors @ query for _, _, vectors in segments])
+        )
+
+    def vectors_of(self, sample_ids) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Look up stored vectors by sample id, reading only those rows of the mapped files.
+
+        Args:
+            sample_ids: Sample ids
+
+        Returns:
+            Tuple of (mask of the ids that are stored, their vectors in the
+            order of sample_ids)
+        """
+        sample_ids = np.asarray(sample_ids, dtype=np.int64)
+        with self.lock:
+            segments, dim = self.segments(), self.dim
+        found = np.zeros(len(sample_ids), dtype=bool)
+        vectors = np.empty((len(sample_ids), dim), dtype=np.float32)
+
+        for ids, _, segment_vectors in segments:
+            # Ids are sorted within a segment
+            positions = np.minimum(np.searchsorted(ids, sample_ids), len(ids) - 1)
+            hit = ids[positions] == sample_ids
+            vectors[hit] = segment_vectors[positions[hit]]
+            found |= hit
+
+        return found, vectors[found]
+
+    def after(self, last_id: int):
+        """
+        Rows with an id above last_id, as views on the mapped files.
+
+        Returns:
+            List of (ids, vectors) per segment
+        """
+        found = []
+        for ids, _, vectors in self.segments():
+            start = int(np.searchsorted(ids, last_id, side="right"))
+            if start < len(ids):
+                found.append((ids[start:], vectors[start:]))
+        return found
+
+    def stats(self) -> dict:
+        return {
+            "generation": self.generation,
+            "rows": self.size,
+            "base_rows": len(self.base["ids"]),
+            "tail_rows": len(self.tail["ids"]),
+            "dimensions": self.dim,
+            "last_id": self.last_id
+        }
+
+
+embedding_store = EmbeddingStore()
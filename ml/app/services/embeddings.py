@@ -1,11 +1,20 @@
+import os
+import numpy as np
 import torch
 import librosa
 from functools import lru_cache
-from transformers import Wav2Vec2FeatureExtractor, Wav2Vec2Model
+from transformers import Wav2Vec2Config, Wav2Vec2FeatureExtractor, Wav2Vec2Model
 from pathlib import Path
 
 SAMPLE_RATE = 16000
 
+# Clips longer than this are embedded window by window instead of in one pass
+CHUNK_THRESHOLD_SECONDS = float(os.getenv("EMBEDDING_CHUNK_THRESHOLD_SECONDS", "30"))
+CHUNK_WINDOW_SECONDS = float(os.getenv("EMBEDDING_CHUNK_WINDOW_SECONDS", "10"))
+CHUNK_OVERLAP_SECONDS = float(os.getenv("EMBEDDING_CHUNK_OVERLAP_SECONDS", "1"))
+# Windows per forward pass, this is what bounds peak memory in chunked mode
+CHUNK_BATCH_SIZE = int(os.getenv("EMBEDDING_CHUNK_BATCH_SIZE", "4"))
+
 # Lazily load model ONLY when first requested
 @lru_cache()
 def load_embedding_model(model_name="facebook/wav2vec2-large-xlsr-53"):
@@ -22,7 +31,29 @@ def load_embedding_model(model_name="facebook/wav2vec2-large-xlsr-53"):
     return feature_extractor, model
 
 
-def extract_embedding(audio):
+@lru_cache()
+def embedding_dimension(model_name="facebook/wav2vec2-large-xlsr-53"):
+    """Length of the vectors extract_embedding() returns, read from the model config without loading the weights."""
+    base_path = Path(__file__).resolve().parent.parent / "models" / "wav2vec2"
+
+    return Wav2Vec2Config.from_pretrained(model_name, cache_dir=str(base_path)).hidden_size
+
+
+def extract_embedding(audio, chunked=None):
+    """
+    Mean-pooled wav2vec2 embedding of a 16 kHz clip.
+
+    Args:
+        audio: 1D float array
+        chunked: None picks the windowed path for clips longer than
+            CHUNK_THRESHOLD_SECONDS, True/False forces one or the other
+    """
+    if chunked is None:
+        chunked = len(audio) > CHUNK_THRESHOLD_SECONDS * SAMPLE_RATE
+
+    if chunked:
+        return extract_embedding_chunked(audio)
+
     feature_extractor, model = load_embedding_model()
 
     inputs = feature_extractor(
@@ -37,3 +68,92 @@ def extract_embedding(audio):
         embedding = outputs.last_hidden_state.mean(dim=1)
 
     return embedding.squeeze().numpy()
+
+
+def split_windows(num_samples: int, window: int, overlap: int):
+    """
+    Split a clip into overlapping (start, end) sample ranges.
+
+    A new window is only started if it reaches past the end of the previous
+    one, so the last window is always longer than the overlap.
+    """
+    hop = max(window - overlap, 1)
+    starts = range(0, max(num_samples - overlap, 1), hop)
+
+    return [(start, min(start + window, num_samples)) for start in starts]
+
+
+def extract_embedding_chunked(
+    audio,
+    window_seconds: float = CHUNK_WINDOW_SECONDS,
+    overlap_seconds: float = CHUNK_OVERLAP_SECONDS,
+    batch_size: int = CHUNK_BATCH_SIZE,
+):
+    """
+    Embed a long clip window by window with bounded memory.
+
+    The clip is normalized once as a whole, cut into overlapping windows and
+    run batch_size windows per forward pass. Each window contributes the sum
+    of its frame vectors and its frame count, so the result is the
+    frame-count weighted mean of the window means. Peak memory depends on
+    window_seconds * batch_size, not on the length of the clip.
+
+    Args:
+        audio: 1D float array at SAMPLE_RATE
+        window_seconds: Length of each window
+        overlap_seconds: Overlap between consecutive windows
+        batch_size: Number of windows per forward pass
+
+    Returns:
+        1D numpy embedding
+    """
+    feature_extractor, model = load_embedding_model()
+
+    audio = np.asarray(audio, dtype=np.float32)
+    if feature_extractor.do_normalize:
+        audio = (audio - audio.mean()) / np.sqrt(audio.var() + 1e-7)
+
+    window = int(window_seconds * SAMPLE_RATE)
+    overlap = int(overlap_seconds * SAMPLE_RATE)
+    windows = split_windows(len(audio), window, overlap)
+
+    total = None
+    frames = 0
+
+    for i in range(0, len(windows), max(batch_size, 1)):
+        group = windows[i:i + batch_size]
+        longest = max(end - start for start, end in group)
+
+        input_values = torch.zeros((len(group), longest), dtype=torch.float32)
+        attention_mask = torch.zeros((len(group), longest), dtype=torch.long)
+        for row, (start, end) in enumerate(group):
+            input_values[row, :end - start] = torch.from_numpy(audio[start:end])
+            attention_mask[row, :end - start] = 1
+
+        with torch.no_grad():
+            hidden_states = model(input_values, attention_mask=attention_mask).last_hidden_state
+            frame_mask = model._get_feature_vector_attention_mask(
+                hidden_states.shape[1],
+                attention_mask,
+            ).unsqueeze(-1).to(hidden_states.dtype)
+
+            window_sum = (hidden_states * frame_mask).sum(dim=(0, 1))
+            total = window_sum if total is None else total + window_sum
+            frames += int(frame_mask.sum())
+
+    return (total / max(frames, 1)).numpy()
+
+
+def chunking_divergence(audio, **chunk_args) -> float:
+    """
+    Cosine distance between the full-pass and the windowed embedding of a clip.
+
+    Use it on real recordings before changing the window settings; it should
+    stay well below the clustering thresholds.
+    """
+    full = extract_embedding(audio, chunked=False)
+    chunked = extract_embedding_chunked(audio, **chunk_args)
+
+    similarity = np.dot(full, chunked) / (np.linalg.norm(full) * np.linalg.norm(chunked))
+
+    return float(1 - similarity)
@@ -0,0 +1,303 @@
+import io
+import os
+import threading
+import weakref
+import zipfile
+import numpy as np
+from typing import Any, Dict, Iterator, List
+from app.services.db_embeddings import build_count_query, iter_embeddings, parse_embedding_to_numpy
+from app.utils.db import snapshot_connection
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Samples per Arrow record batch / Parquet row group / npz write
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "2048"))
+# Exports running at once, each holds a database connection and a worker thread
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", "2"))
+
+EXPORT_FIELDS = ['cluster_id', 'region', 'lat', 'lng', 'language_guess', 'created_at', 'embedding']
+
+FORMATS = {
+    "arrow": ("application/vnd.apache.arrow.stream", "arrow"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "npz": ("application/octet-stream", "npz")
+}
+
+# Stored in the npz cluster_id column for samples without a cluster
+NO_CLUSTER = -1
+
+_export_slots = threading.BoundedSemaphore(EXPORT_MAX_CONCURRENT)
+
+
+class _ChunkSink:
+    """Write-only file object that the writers write to, drained into the response after every batch."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def writable(self) -> bool:
+        return True
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _batches(rows: Iterator[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _record_batch(rows: List[Dict[str, Any]], schema):
+    import pyarrow as pa
+
+    vectors = np.vstack([parse_embedding_to_numpy(row['embedding']) for row in rows])
+    dim = schema.field('embedding').type.list_size
+
+    columns = [pa.array([row[name] for row in rows], type=schema.field(name).type) for name in schema.names[:-1]]
+    columns.append(pa.FixedSizeListArray.from_arrays(pa.array(vectors.reshape(-1), type=pa.float32()), dim))
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def _arrow_schema(dim: int):
+    import pyarrow as pa
+
+    return pa.schema([
+        ('id', pa.int64()),
+        ('cluster_id', pa.int64()),
+        ('region', pa.string()),
+        ('lat', pa.float64()),
+        ('lng', pa.float64()),
+        ('language_guess', pa.string()),
+        ('created_at', pa.timestamp('us')),
+        ('embedding', pa.list_(pa.float32(), dim))
+    ])
+
+
+def _stream_arrow(rows, parquet: bool) -> Iterator[bytes]:
+    """Arrow IPC stream or Parquet file, one record batch / row group per EXPORT_BATCH_ROWS samples."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = _ChunkSink()
+    writer = None
+
+    for batch in _batches(rows, EXPORT_BATCH_ROWS):
+        if writer is None:
+            # The vector width is only known once the first row is in
+            schema = _arrow_schema(len(parse_embedding_to_numpy(batch[0]['embedding'])))
+            writer = pq.ParquetWriter(sink, schema) if parquet else pa.ipc.new_stream(sink, schema)
+
+        record_batch = _record_batch(batch, schema)
+        if parquet:
+            writer.write_table(pa.Table.from_batches([record_batch]))
+        else:
+            writer.write_batch(record_batch)
+        yield sink.drain()
+
+    if writer is None:
+        schema = _arrow_schema(0)
+        writer = pq.ParquetWriter(sink, schema) if parquet else pa.ipc.new_stream(sink, schema)
+
+    writer.close()
+    yield sink.drain()
+
+
+def _stream_npz(rows, count: int) -> Iterator[bytes]:
+    """
+    npz archive like np.savez writes, readable with np.load.
+
+    The embedding matrix is streamed first, its .npy header needs the row
+    count up front. The metadata columns are collected on the way (a few
+    dozen bytes per sample) and written after it.
+    """
+    sink = _ChunkSink()
+    archive = zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED, allowZip64=True)
+
+    ids = np.zeros(count, dtype=np.int64)
+    clusters = np.full(count, NO_CLUSTER, dtype=np.int64)
+    lat = np.full(count, np.nan)
+    lng = np.full(count, np.nan)
+    created_at = np.zeros(count, dtype="datetime64[us]")
+    regions, languages = [], []
+
+    written = 0
+    member = None
+    for batch in _batches(rows, EXPORT_BATCH_ROWS):
+        vectors = np.vstack([parse_embedding_to_numpy(row['embedding']) for row in batch]).astype("<f4")
+        if member is None:
+            member = archive.open("embedding.npy", mode="w", force_zip64=True)
+            np.lib.format.write_array_header_1_0(
+                member, {"descr": "<f4", "fortran_order": False, "shape": (count, vectors.shape[1])}
+            )
+
+        if written + len(batch) > count:
+            raise RuntimeError("More samples than counted, the export snapshot changed")
+
+        member.write(vectors.tobytes())
+        for offset, row in enumerate(batch, start=written):
+            ids[offset] = row['id']
+            if row['cluster_id'] is not None:
+                clusters[offset] = row['cluster_id']
+            if row['lat'] is not None:
+                lat[offset] = row['lat']
+            if row['lng'] is not None:
+                lng[offset] = row['lng']
+            created_at[offset] = np.datetime64(row['created_at'].replace(tzinfo=None), "us")
+            regions.append(row['region'] or "")
+            languages.append(row['language_guess'] or "")
+
+        written += len(batch)
+        yield sink.drain()
+
+    if written != count:
+        raise RuntimeError(f"Streamed {written} samples but counted {count}, the export snapshot changed")
+
+    if member is None:
+        archive.writestr("embedding.npy", _npy_bytes(np.zeros((0, 0), dtype="<f4")))
+    else:
+        member.close()
+
+    columns = {
+        "id": ids,
+        "cluster_id": clusters,
+        "region": np.array(regions, dtype=str),
+        "lat": lat,
+        "lng": lng,
+        "language_guess": np.array(languages, dtype=str),
+        "created_at": created_at
+    }
+    for name, values in columns.items():
+        archive.writestr(f"{name}.npy", _npy_bytes(values))
+        yield sink.drain()
+
+    archive.close()
+    yield sink.drain()
+
+
+def _npy_bytes(array: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    return buffer.getvalue()
+
+
+def check_format(format: str):
+    """
+    Fail before any bytes are sent if a format can't be written.
+
+    Raises:
+        ValueError: For unknown formats
+        ImportError: When pyarrow, needed for arrow and parquet, isn't installed
+    """
+    if format not in FORMATS:
+        raise ValueError(f"Unknown export format {format}, choose from {list(FORMATS)}")
+
+    if format in ("arrow", "parquet"):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ImportError(f"The {format} export needs pyarrow, install it or use format=npz")
+
+
+def export_embeddings(format: str, **filters) -> Iterator[bytes]:
+    """
+    Stream every matching sample with its embedding in the given format.
+
+    The samples are read from a server-side cursor in one REPEATABLE READ
+    snapshot, so memory stays bounded by EXPORT_BATCH_ROWS and the npz
+    row count matches the rows that follow it.
+
+    The checks run right away, before any bytes are sent. The export then
+    holds one of EXPORT_MAX_CONCURRENT slots until its chunks are exhausted
+    or closed.
+
+    Args:
+        format: "arrow" (IPC stream), "parquet" or "npz"
+        **filters: after_id, cluster_id, region, created_after, created_before
+
+    Returns:
+        Iterator over the chunks of the encoded file
+
+    Raises:
+        ValueError: For unknown formats
+        ImportError: When pyarrow, needed for arrow and parquet, isn't installed
+        RuntimeError: When EXPORT_MAX_CONCURRENT exports are already running
+    """
+    check_format(format)
+
+    if not _export_slots.acquire(blocking=False):
+        raise RuntimeError(f"{EXPORT_MAX_CONCURRENT} exports are already running, try again later")
+
+    slot = _Slot()
+    chunks = _export(format, filters, slot)
+    # A generator that never started doesn't run its finally, free the slot when it's collected
+    weakref.finalize(chunks, slot.release)
+    return chunks
+
+
+class _Slot:
+    """One taken export slot, released once however many times release() is called."""
+
+    def __init__(self):
+        self.held = True
+
+    def release(self):
+        if self.held:
+            self.held = False
+            _export_slots.release()
+
+
+def _export(format: str, filters: Dict[str, Any], slot: _Slot) -> Iterator[bytes]:
+    try:
+        with snapshot_connection() as conn:
+            rows = iter_embeddings(
+                fields=EXPORT_FIELDS,
+                batch_size=EXPORT_BATCH_ROWS,
+                conn=conn,
+                has_embedding=True,
+                **filters
+            )
+
+            if format == "npz":
+                query, params = build_count_query(has_embedding=True, **filters)
+                with conn.cursor() as cursor:
+                    cursor.execute(query, params)
+                    count = cursor.fetchone()[0]
+                chunks = _stream_npz(rows, count)
+            else:
+                chunks = _stream_arrow(rows, parquet=format == "parquet")
+
+            exported = 0
+            for chunk in chunks:
+                exported += len(chunk)
+                if chunk:
+                    yield chunk
+    finally:
+        slot.release()
+
+    logger.info(f"Exported {exported} bytes of embeddings as {format}")
@@ -1,8 +1,16 @@
+import io
+import os
+import subprocess
 import librosa
 import numpy as np
+import soundfile as sf
+import soxr
 
 SAMPLE_RATE = 16000
 
+# Containers libsndfile can't read, these go straight to ffmpeg
+FFMPEG_FORMATS = {".m4a", ".mp4", ".aac", ".webm", ".opus", ".mp3"}
+
 def preprocess_audio(path: str):
     """
     Loads audio from a file and returns:
@@ -18,3 +26,67 @@ def preprocess_audio(path: str):
     audio = np.asarray(audio, dtype=np.float32)
 
     return audio, sr
+
+
+def _decode_with_soundfile(data: bytes) -> np.ndarray:
+    audio, sr = sf.read(io.BytesIO(data), dtype="float32", always_2d=True)
+    audio = audio.mean(axis=1)
+
+    if sr != SAMPLE_RATE:
+        audio = soxr.resample(audio, sr, SAMPLE_RATE, quality="HQ")
+
+    return np.ascontiguousarray(audio, dtype=np.float32)
+
+
+def _decode_with_ffmpeg(data: bytes) -> np.ndarray:
+    """
+    Decode with an ffmpeg subprocess straight to 16 kHz mono float32.
+
+    mp4/m4a files often keep their index at the end, which ffmpeg can't
+    reach through a pipe, so on Linux the bytes are handed over as an
+    anonymous in-memory file (memfd) that ffmpeg can seek in.
+    """
+    output_args = ["-f", "f32le", "-ac", "1", "-ar", str(SAMPLE_RATE), "pipe:1"]
+
+    if hasattr(os, "memfd_create"):
+        fd = os.memfd_create("upload")
+        try:
+            os.write(fd, data)
+            result = subprocess.run(
+                ["ffmpeg", "-v", "error", "-nostdin", "-i", f"/proc/self/fd/{fd}", *output_args],
+                capture_output=True,
+                pass_fds=(fd,),
+            )
+        finally:
+            os.close(fd)
+    else:
+        result = subprocess.run(
+            ["ffmpeg", "-v", "error", "-i", "pipe:0", *output_args],
+            input=data,
+            capture_output=True,
+        )
+
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode(errors="ignore").strip())
+
+    return np.frombuffer(result.stdout, dtype=np.float32)
+
+
+def decode_audio_bytes(data: bytes, filename: str = "audio.wav"):
+    """
+    Decodes audio bytes in memory, without a temp file, and returns:
+    - audio: numpy array (float32, 16 kHz mono)
+    - sr: sample rate
+    """
+    file_ext = os.path.splitext(filename)[1].lower()
+
+    try:
+        if file_ext not in FFMPEG_FORMATS:
+            try:
+                return _decode_with_soundfile(data), SAMPLE_RATE
+            except sf.LibsndfileError:
+                pass
+
+        return _decode_with_ffmpeg(data), SAMPLE_RATE
+    except Exception as e:
+        raise ValueError(f"Failed to decode audio {filename}: {e}")
@@ -0,0 +1,49 @@
+import os
+import struct
+import numpy as np
+
+# Same layout as ml_v2/orchastrater/services/vector_codec.py and the encoder's
+# application/x-embedding-* bodies: "EMB", a dtype code, the dimension as uint32,
+# then the little-endian values
+HEADER = struct.Struct("<3scI")
+DTYPES = {b"f": "<f4", b"e": "<f2"}
+CODES = {"f32": b"f", "f16": b"e"}
+
+# jsonb or bytea, see the orchestrator's utils/env.py
+VECTOR_STORAGE = os.getenv("VECTOR_STORAGE", "jsonb")
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "f32")
+
+
+def encode_vector(vector, dtype: str = VECTOR_DTYPE) -> bytes:
+    """
+    Pack a vector for a bytea column.
+
+    Args:
+        vector: 1D array-like
+        dtype: "f32" or "f16"
+
+    Returns:
+        Header followed by the raw little-endian values
+    """
+    code = CODES[dtype]
+    values = np.asarray(vector, dtype=DTYPES[code]).ravel()
+
+    return HEADER.pack(b"EMB", code, len(values)) + values.tobytes()
+
+
+def decode_vector(data) -> np.ndarray:
+    """
+    Read a packed vector as float32 without copying f32 data.
+
+    Args:
+        data: bytes or memoryview from a bytea column
+
+    Returns:
+        Read-only float32 numpy array (a view on data for f32)
+    """
+    magic, code, dim = HEADER.unpack_from(data)
+    if magic != b"EMB" or code not in DTYPES:
+        raise ValueError("Invalid binary vector header")
+
+    vector = np.frombuffer(data, dtype=DTYPES[code], count=dim, offset=HEADER.size)
+    return vector.astype(np.float32, copy=False)
@@ -21,10 +21,12 @@ def detect_language(audio):
     return lang, confidence
 
 
-def transcribe_audio(path: str):
+def transcribe_audio(audio):
     """
     Whisper speech-to-text.
+
+    audio can be a file path or an already decoded float32 16 kHz array.
     """
     model = load_whisper_model()
-    result = model.transcribe(path)
+    result = model.transcribe(audio)
     return result["text"]
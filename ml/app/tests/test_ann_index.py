@@ -0,0 +1,61 @@
+from app.services.ann_index import AnnIndex
+from app.services.embedding_store import EmbeddingStore, NO_CLUSTER
+import numpy as np
+
+
+def _vectors(count, dim=256, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((40, dim)).astype(np.float32)
+    return centers[rng.integers(0, 40, size=count)] + 0.5 * rng.standard_normal((count, dim)).astype(np.float32)
+
+
+def test_ann_recall_and_persistence(tmp_path):
+    vectors = _vectors(3000)
+    queries, indexed = vectors[:50], vectors[50:]
+    ids = np.arange(1, len(indexed) + 1)
+
+    # The index reads vectors from the store, like sync() fills it
+    store = EmbeddingStore(directory=str(tmp_path / "store"), compact_rows=1000)
+    index = AnnIndex(directory=str(tmp_path / "index"), subspaces=32, min_train=1000, store=store)
+    # Added in batches like sync() does, add() never trains
+    for start in range(0, len(indexed), 500):
+        store.append(ids[start:start + 500], [NO_CLUSTER] * len(ids[start:start + 500]), indexed[start:start + 500])
+        index.add(ids[start:start + 500], indexed[start:start + 500])
+    assert not index.trained and index.needs_training
+
+    index.train()
+    assert index.trained and not index.needs_training
+    # Every sample sits in exactly one inverted list
+    assert index.lists.sizes.sum() == len(indexed)
+    assert sorted(index.lists.arrays()["list_ids"].tolist()) == ids.tolist()
+
+    unit = indexed / np.linalg.norm(indexed, axis=1, keepdims=True)
+    found = 0
+    for query in queries:
+        expected = ids[np.argsort(-(unit @ (query / np.linalg.norm(query))))[:10]]
+        result, scores, scanned = index.search(query, 10, nprobe=8)
+
+        assert scanned < len(indexed)
+        assert np.all(np.diff(scores) <= 0)
+        found += len(set(expected) & set(result.tolist()))
+
+    assert found / (10 * len(queries)) > 0.9
+
+    exact, _, scanned = index.search(queries[0], 10, exact=True)
+    assert scanned == len(indexed)
+    assert exact.tolist() == ids[np.argsort(-(unit @ (queries[0] / np.linalg.norm(queries[0]))))[:10]].tolist()
+
+    index.save()
+    assert [path.name for path in (tmp_path / "index").iterdir()] == ["index.npz"]
+    loaded = AnnIndex(directory=str(tmp_path / "index"), subspaces=32, min_train=1000, store=store)
+    assert loaded.load()
+    assert loaded.last_id == ids[-1]
+
+    before = index.search(queries[0], 5)[0]
+    after = loaded.search(queries[0], 5)[0]
+    assert before.tolist() == after.tolist()
+
+    # The loaded index keeps taking new samples
+    store.append([ids[-1] + 1], [NO_CLUSTER], queries[:1])
+    loaded.add([ids[-1] + 1], queries[:1])
+    assert loaded.search(queries[0], 1)[0][0] == ids[-1] + 1
@@ -0,0 +1,62 @@
+from app.services.embedding_store import EmbeddingStore, NO_CLUSTER, settled
+import numpy as np
+
+
+def test_store_append_compact_and_share(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((30, 64)).astype(np.float32)
+
+    writer = EmbeddingStore(directory=str(tmp_path), compact_rows=1000)
+    writer.append(list(range(1, 21)), [7] * 10 + [NO_CLUSTER] * 10, vectors[:20])
+
+    # A second process only maps the files
+    reader = EmbeddingStore(directory=str(tmp_path))
+    reader.refresh()
+    assert reader.size == 20 and reader.last_id == 20
+
+    ids, clusters, similarities = reader.similarities(vectors[3])
+    assert ids[np.argmax(similarities)] == 4
+    assert clusters[3] == 7 and clusters[15] == NO_CLUSTER
+    assert np.isclose(similarities.max(), 1.0, atol=1e-5)
+
+    writer.append(list(range(21, 31)), [8] * 10, vectors[20:])
+    writer.compact()
+    assert writer.stats()["tail_rows"] == 0 and writer.size == 30
+
+    # The reader follows the new generation on its next refresh
+    reader.refresh()
+    assert reader.size == 30
+    assert [ids.tolist() for ids, _ in reader.after(25)] == [[26, 27, 28, 29, 30]]
+
+    ids, clusters, similarities = reader.similarities(vectors[27])
+    assert ids[np.argmax(similarities)] == 28 and clusters[np.argmax(similarities)] == 8
+
+    found, stored = reader.vectors_of([28, 999, 3])
+    assert found.tolist() == [True, False, True]
+    assert np.allclose(stored[0], vectors[27] / np.linalg.norm(vectors[27]), atol=1e-6)
+
+
+def test_sync_is_throttled_across_processes(tmp_path, monkeypatch):
+    writer = EmbeddingStore(directory=str(tmp_path), sync_seconds=60)
+    reader = EmbeddingStore(directory=str(tmp_path), sync_seconds=60)
+    calls = []
+    for store in (writer, reader):
+        monkeypatch.setattr(store, "_sync", lambda store=store: calls.append(store) or 0)
+
+    writer.sync()
+    # Within sync_seconds of any sync on the host, neither process asks Postgres again
+    writer.sync()
+    reader.sync()
+    assert calls == [writer]
+
+    reader.sync(force=True)
+    assert calls == [writer, reader]
+
+
+def test_sync_holds_rows_back_behind_recent_gaps():
+    rows = [{'id': i, 'age': age} for i, age in ((11, 90.0), (13, 90.0), (14, 2.0), (16, 1.0), (17, 1.0))]
+
+    # 12 is old enough to be gone for good, 15 may still commit
+    assert [row['id'] for row in settled(rows, 10, settle_seconds=30)] == [11, 13, 14]
+    assert [row['id'] for row in settled(rows, 10, settle_seconds=0)] == [11, 13, 14, 16, 17]
+    assert settled(rows[3:], 14, settle_seconds=30) == []
@@ -1,10 +1,11 @@
-from app.services.embeddings import load_embedding_model, extract_embedding
+from app.services.embeddings import load_embedding_model, extract_embedding, chunking_divergence
 from app.services.preprocess import preprocess_audio
 import numpy as np
 
 from pathlib import Path
 
 SAMPLE = str(Path(__file__).resolve().parent / "sample_audio" / "beary.m4a")
+SAMPLE_DIR = Path(__file__).resolve().parent / "sample_audio"
 
 def test_embeddings():
     feat, model = load_embedding_model("facebook/wav2vec2-large-xlsr-53")
@@ -15,3 +16,13 @@ def test_embeddings():
     assert isinstance(emb, np.ndarray)
     assert emb.ndim == 1          
     assert 100 < len(emb) < 2000  
+
+
+def test_chunked_embedding_divergence():
+    for path in sorted(SAMPLE_DIR.glob("*.m4a")):
+        audio, _ = preprocess_audio(str(path))
+
+        # Short windows so every sample clip is actually split
+        distance = chunking_divergence(audio, window_seconds=4, overlap_seconds=0.5)
+
+        assert distance < 0.05, f"{path.name}: cosine distance to full pass {distance:.5f}"
@@ -1,4 +1,4 @@
-from app.services.preprocess import preprocess_audio
+from app.services.preprocess import preprocess_audio, decode_audio_bytes
 import os
 
 from pathlib import Path
@@ -13,3 +13,14 @@ def test_preprocess():
     assert isinstance(audio, list) or hasattr(audio, "__len__")
     assert sr == 16000
     assert len(audio) > 0
+
+
+def test_decode_audio_bytes_matches_file_load():
+    with open(SAMPLE, "rb") as f:
+        audio, sr = decode_audio_bytes(f.read(), "beary.m4a")
+
+    expected, _ = preprocess_audio(SAMPLE)
+
+    assert sr == 16000
+    assert audio.dtype == "float32"
+    assert abs(len(audio) - len(expected)) <= 1
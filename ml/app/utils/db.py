@@ -1,4 +1,5 @@
 import os
+import uuid
 from contextlib import contextmanager
 from typing import Optional
 import psycopg2
@@ -8,8 +9,8 @@ from app.utils.logger import get_logger
 
 logger = get_logger(__name__)
 
-# Global connection pool
-_connection_pool: Optional[pool.SimpleConnectionPool] = None
+# Global connection pool, shared by the request threads of the threadpool
+_connection_pool: Optional[pool.ThreadedConnectionPool] = None
 
 
 def get_database_url() -> str:
@@ -33,7 +34,7 @@ def initialize_pool(minconn: int = 1, maxconn: int = 10):
     
     try:
         db_url = get_database_url()
-        _connection_pool = pool.SimpleConnectionPool(
+        _connection_pool = pool.ThreadedConnectionPool(
             minconn,
             maxconn,
             dsn=db_url
@@ -85,6 +86,26 @@ def get_db_connection():
             _connection_pool.putconn(conn)
 
 
+@contextmanager
+def dedicated_connection():
+    """
+    Context manager for a connection of its own, opened outside the pool.
+    
+    For streamed responses: they hold their connection for as long as the
+    client takes to read the body, which would starve the pool.
+    """
+    conn = psycopg2.connect(get_database_url())
+    try:
+        yield conn
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Database error: {e}")
+        raise
+    finally:
+        conn.close()
+
+
 def execute_query(query: str, params: tuple = None, fetch: bool = True):
     """
     Execute a SQL query and optionally fetch results.
@@ -104,3 +125,49 @@ def execute_query(query: str, params: tuple = None, fetch: bool = True):
             if fetch:
                 return cursor.fetchall()
             return None
+
+
+@contextmanager
+def snapshot_connection():
+    """
+    Dedicated connection in a read-only REPEATABLE READ transaction.
+    
+    Every query run on it sees the same snapshot of the database, e.g. a
+    COUNT(*) and the rows streamed right after it. Like stream_query it
+    is opened outside the pool, it lives as long as the response.
+    """
+    with dedicated_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+        yield conn
+
+
+def stream_query(query: str, params: tuple = None, batch_size: int = 1000, conn=None):
+    """
+    Execute a SQL query on a server-side (named) cursor and yield its rows.
+    
+    Rows are transferred batch_size at a time, so memory use doesn't grow
+    with the size of the result. The connection is held until the generator
+    is exhausted or closed, so by default a dedicated one is opened rather
+    than taking one from the pool.
+    
+    Args:
+        query: SQL query string
+        params: Query parameters (for parameterized queries)
+        batch_size: Rows fetched from the server per round trip
+        conn: Connection to use, a dedicated one by default
+        
+    Yields:
+        One dictionary per row
+    """
+    if conn is None:
+        with dedicated_connection() as conn:
+            yield from stream_query(query, params, batch_size, conn)
+        return
+    
+    with conn.cursor(name=f"stream_{uuid.uuid4().hex}", cursor_factory=RealDictCursor) as cursor:
+        cursor.itersize = batch_size
+        cursor.execute(query, params)
+        
+        for row in cursor:
+            yield row
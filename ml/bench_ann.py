@@ -0,0 +1,104 @@
+# ml/bench_ann.py
+#
+# Recall vs latency of the ANN index (app/services/ann_index.py) against the
+# brute-force scan /embeddings/compare used to do.
+#
+#   python bench_ann.py                     # our UnknownSample embeddings, needs DATABASE_URL
+#   python bench_ann.py --synthetic 50000   # clustered random vectors instead
+#
+# A held-out slice of the vectors is used as queries, the rest is indexed.
+import argparse
+import tempfile
+import time
+import numpy as np
+
+from app.services.ann_index import AnnIndex
+from app.services.embedding_store import EmbeddingStore, NO_CLUSTER
+
+
+def synthetic(count: int, dim: int, languages: int, seed: int) -> np.ndarray:
+    """Vectors scattered around a few hundred centers, roughly how samples group by language."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((languages, dim)).astype(np.float32)
+    labels = rng.integers(0, languages, size=count)
+    return centers[labels] + 0.8 * rng.standard_normal((count, dim)).astype(np.float32)
+
+
+def from_database() -> np.ndarray:
+    from app.services.db_embeddings import get_embeddings_as_numpy
+
+    _, vectors = get_embeddings_as_numpy()
+    return vectors.astype(np.float32)
+
+
+def brute_force(vectors: np.ndarray, query: np.ndarray, k: int) -> np.ndarray:
+    similarities = vectors @ query
+    top = np.argpartition(-similarities, k - 1)[:k]
+    return top[np.argsort(-similarities[top])]
+
+
+def percentiles(samples):
+    return np.percentile(samples, 50) * 1000, np.percentile(samples, 95) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall vs latency of the ANN index")
+    parser.add_argument("--synthetic", type=int, default=0, help="use this many random vectors instead of the database")
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    vectors = synthetic(args.synthetic, args.dim, 300, seed=0) if args.synthetic else from_database()
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    queries, indexed = vectors[:args.queries], vectors[args.queries:]
+    ids = np.arange(1, len(indexed) + 1)
+    k = args.k
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = EmbeddingStore(directory=f"{directory}/store", compact_rows=len(indexed) + 1)
+        store.append(ids, [NO_CLUSTER] * len(ids), indexed)
+        index = AnnIndex(directory=f"{directory}/index", store=store)
+
+        started = time.perf_counter()
+        index.add(ids, indexed)
+        index.train()
+        print(f"{len(indexed)} vectors of {indexed.shape[1]} dims, {len(queries)} queries, k={k}")
+        print(f"build {time.perf_counter() - started:.1f}s, {len(index.coarse)} lists")
+
+        started = time.perf_counter()
+        index.save()
+        saved = time.perf_counter() - started
+        started = time.perf_counter()
+        index.load()
+        print(f"save {saved * 1000:.0f} ms, load {(time.perf_counter() - started) * 1000:.0f} ms\n")
+
+        truth, timings = [], []
+        for query in queries:
+            started = time.perf_counter()
+            truth.append(set(ids[brute_force(indexed, query, k)]))
+            timings.append(time.perf_counter() - started)
+
+        p50, p95 = percentiles(timings)
+        print(f"{'mode':<22}{'recall@' + str(k):>10}{'scanned':>10}{'p50 ms':>9}{'p95 ms':>9}")
+        print(f"{'brute force':<22}{1.0:>10.3f}{len(indexed):>10}{p50:>9.2f}{p95:>9.2f}")
+
+        for nprobe in (1, 2, 4, 8, 16, 32):
+            for rerank in (False, True):
+                found, scanned, timings = 0, 0, []
+                for query, expected in zip(queries, truth):
+                    started = time.perf_counter()
+                    result, _, count = index.search(query, k, nprobe=nprobe, rerank=rerank)
+                    timings.append(time.perf_counter() - started)
+                    found += len(expected.intersection(result.tolist()))
+                    scanned += count
+
+                p50, p95 = percentiles(timings)
+                mode = f"nprobe={nprobe}" + (" +rerank" if rerank else "")
+                recall = found / (k * len(queries))
+                print(f"{mode:<22}{recall:>10.3f}{scanned // len(queries):>10}{p50:>9.2f}{p95:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+# ml/bench_chunking.py
+#
+# How far the windowed embedding of a clip drifts from a single full pass
+# (app/services/embeddings.py), per file. Run it on real recordings before
+# changing the EMBEDDING_CHUNK_* settings.
+#
+#   python bench_chunking.py                          # the test clips in app/tests/sample_audio
+#   python bench_chunking.py --window 10 --overlap 1 clip1.m4a clip2.wav
+import argparse
+from pathlib import Path
+
+from app.services.embeddings import chunking_divergence, SAMPLE_RATE
+from app.services.preprocess import preprocess_audio
+
+SAMPLE_DIR = Path(__file__).resolve().parent / "app" / "tests" / "sample_audio"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cosine distance between chunked and full-pass embeddings")
+    parser.add_argument("files", nargs="*", type=Path, help="audio files, the test clips by default")
+    parser.add_argument("--window", type=float, default=4.0, help="window length in seconds")
+    parser.add_argument("--overlap", type=float, default=0.5, help="overlap between windows in seconds")
+    args = parser.parse_args()
+
+    files = args.files or sorted(SAMPLE_DIR.glob("*.m4a"))
+
+    print(f"{'file':<30}{'seconds':>9}{'distance':>11}")
+    for path in files:
+        audio, _ = preprocess_audio(str(path))
+        distance = chunking_divergence(audio, window_seconds=args.window, overlap_seconds=args.overlap)
+        print(f"{path.name:<30}{len(audio) / SAMPLE_RATE:>9.1f}{distance:>11.5f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,222 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
 import uvicorn
+import asyncio
+import os
 import logging
 import librosa
-from services.preprocess_audio import preprocess_audio
-from services.generate_embeddings import extract_embedding
+from contextlib import asynccontextmanager
+from services.preprocess_audio import preprocess_audio, decode_audio_bytes, decode_pcm, PCM_FORMATS, SAMPLE_RATE
+from services.embedding_cache import embedding_cache
+from services.batching import batcher
+from services.inference_pool import inference_pool, InferenceQueueFull
+from services.generate_embeddings import backend_parity
+from services.backends import BACKEND, BACKENDS
+from services import embedding_format
+from services.warmup import warm_up, startup_state
+from services.prefork import serve
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("encoder-service")
 
-app = FastAPI(title="Audio Encoder Service")
+async def run_warm_up():
+    try:
+        # Not an admitted request, weight=0 keeps it out of the queue counts
+        await inference_pool.run(warm_up, weight=0)
+    except Exception as e:
+        startup_state.error = str(e)
+        logger.error(f"Encoder warm-up failed: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm up in the background so /health answers while the model loads.
+    # Until it's done /ready reports 503 and /vectorize answers 503 with
+    # Retry-After right away (require_ready()), nothing waits for it
+    warm_up_task = asyncio.create_task(run_warm_up())
+
+    yield
+
+    warm_up_task.cancel()
+    await batcher.close()
+    inference_pool.shutdown()
+
+
+app = FastAPI(title="Audio Encoder Service", lifespan=lifespan)
+
+def require_ready():
+    if not startup_state.ready:
+        raise HTTPException(
+            status_code=503,
+            detail="Encoder is still loading the model",
+            headers={"Retry-After": "5"}
+        )
+
+
+@asynccontextmanager
+async def admitted(name):
+    """inference_pool.admit() that turns a full queue into a 503 with Retry-After."""
+    try:
+        async with inference_pool.admit():
+            yield
+
+    except InferenceQueueFull as e:
+        logger.warning(f"Rejecting {name}: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail="Encoder is overloaded, try again later",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+
+async def encode(audio_source: bytes, decode, name, kind):
+    """
+        Decodes audio_source with decode() on the inference pool and runs it through
+        the batcher, turning a full queue into a 503 with Retry-After and a body
+        decode() rejects with ValueError into a 400.
+
+        Identical bytes are answered from the embedding cache without decoding or
+        queueing.
+    """
+    require_ready()
+
+    cache_key = embedding_cache.key(audio_source, kind)
+    embedding = await embedding_cache.get(cache_key)
+    if embedding is not None:
+        logger.info(f"Embedding cache hit for {name}")
+        return embedding
+
+    async with admitted(name):
+        try:
+            audio = await inference_pool.run(decode, audio_source)
+        except ValueError as e:
+            # The body isn't audio decode() can read, the client's fault
+            raise HTTPException(status_code=400, detail=str(e))
+        logger.info("Preprocessed audio successfully")
+        embedding = await batcher.submit(audio)
+        logger.info("Generated embedding successfully")
+
+    await embedding_cache.put(cache_key, embedding)
+
+    return embedding
+
+
+def embedding_response(request: Request, embedding, name):
+    media_type = embedding_format.negotiate(request.headers.get("accept"))
+    if media_type != embedding_format.JSON:
+        return Response(
+            content=embedding_format.encode_embedding(embedding, media_type),
+            media_type=media_type
+        )
+
+    return {
+        "fileName": name,
+        "embedding": embedding.tolist()
+    }
+
 
 @app.post('/vectorize')
-async def vectorize_audio(file: UploadFile = File(...)):
+async def vectorize_audio(request: Request, file: UploadFile = File(...)):
     
     logger.info(f"Received audio file: {file.filename}")
 
     if not file:
         raise HTTPException(status_code=400, detail="file not provided")
     
-    audio = preprocess_audio(file)
-    logger.info("Preprocessed audio successfully")
-    embedding = extract_embedding(audio)
-    logger.info("Generated embedding successfully")
+    data = await file.read()
+    embedding = await encode(
+        data,
+        lambda raw: decode_audio_bytes(raw, file.filename or "audio.wav"),
+        file.filename,
+        "file"
+    )
+
+    return embedding_response(request, embedding, file.filename)
+
+
+@app.post('/vectorize/pcm')
+async def vectorize_pcm(request: Request, sample_rate: int = SAMPLE_RATE):
+    """
+        Takes mono PCM that the caller already decoded, as the raw request body.
+        Content-Type is application/x-pcm-f32 or application/x-pcm-s16.
+    """
+    body = await request.body()
+    content_type = request.headers.get("content-type")
+    logger.info(f"Received {len(body)} bytes of PCM ({content_type}, {sample_rate} Hz)")
+
+    if not body:
+        raise HTTPException(status_code=400, detail="empty PCM body")
+
+    if (content_type or "").split(";")[0].strip().lower() not in PCM_FORMATS:
+        raise HTTPException(status_code=415, detail=f"Content-Type must be one of {list(PCM_FORMATS)}")
+
+    embedding = await encode(
+        body,
+        lambda data: decode_pcm(data, content_type, sample_rate),
+        "pcm",
+        f"pcm:{content_type}:{sample_rate}"
+    )
+
+    return embedding_response(request, embedding, None)
+
+
+@app.post('/parity')
+async def check_parity(file: UploadFile = File(...), backend: str = BACKEND):
+    """Cosine distance between the fp32 eager embedding and the given backend."""
+
+    if backend not in BACKENDS:
+        raise HTTPException(status_code=400, detail=f"backend must be one of {BACKENDS}")
+
+    require_ready()
+
+    # Queued like any upload, so parity checks can't starve /vectorize
+    async with admitted(file.filename):
+        audio = await inference_pool.run(preprocess_audio, file)
+        distance = await inference_pool.run(backend_parity, audio, backend)
+    logger.info(f"Parity of {backend} against eager fp32: cosine distance {distance:.6f}")
 
     return {
         "fileName": file.filename,
-        "embedding": embedding.tolist()
+        "backend": backend,
+        "cosine_distance": distance
+    }
+
+
+@app.get('/health')
+def health_check():
+    return {"status": "healthy", "service": "encoder"}
+
+
+@app.get('/ready')
+def readiness():
+    if not startup_state.ready:
+        return JSONResponse(status_code=503, content=startup_state.as_dict())
+
+    return startup_state.as_dict()
+
+
+@app.get('/stats')
+def stats():
+    return {
+        "backend": BACKEND,
+        "startup": startup_state.as_dict(),
+        "inference": inference_pool.stats(),
+        "cache": embedding_cache.stats()
     }
 
 
 def main():
-    uvicorn.run(
-        "main:app",
-        host="0.0.0.0",
-        port=8001,
-        reload=True
-    )
+    # ENCODER_RELOAD=1 keeps the single process auto-reloading dev server
+    if os.getenv("ENCODER_RELOAD") == "1":
+        uvicorn.run(
+            "main:app",
+            host="0.0.0.0",
+            port=8001,
+            reload=True
+        )
+        return
+
+    serve("main:app", host="0.0.0.0", port=8001)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,171 @@
+import os
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy
+import torch
+from transformers import Wav2Vec2Config, Wav2Vec2Model
+
+from utils.logger import get_logger
+
+logger = get_logger("backends")
+
+# eager = fp32 PyTorch, int8 = dynamic int8 Linear layers, onnx = onnxruntime
+BACKEND = os.getenv("ENCODER_BACKEND", "eager")
+BACKENDS = ("eager", "int8", "onnx")
+
+MODELS_DIR = Path(__file__).resolve().parent.parent / "models"
+ONNX_OPSET = 17
+
+
+def artifact_path(model_name: str, backend: str) -> Path:
+    """Exported / quantized models live next to the HF cache in models/."""
+    safe_name = model_name.replace("/", "--")
+    suffix = "pt" if backend == "int8" else "onnx"
+
+    return MODELS_DIR / f"wav2vec2-{backend}" / f"{safe_name}.{suffix}"
+
+
+def load_eager(model_name: str):
+    model = Wav2Vec2Model.from_pretrained(
+        model_name,
+        cache_dir = str(MODELS_DIR / "wav2vec2")
+    )
+    model.eval()
+
+    return model
+
+
+def quantize_int8(model):
+    # The positional conv uses weight norm, fold it into a plain weight first so
+    # the quantized state dict has the same keys on every load
+    for module in model.modules():
+        if torch.nn.utils.parametrize.is_parametrized(module):
+            for name in list(module.parametrizations.keys()):
+                torch.nn.utils.parametrize.remove_parametrizations(module, name)
+
+    return torch.ao.quantization.quantize_dynamic(
+        model,
+        {torch.nn.Linear},
+        dtype=torch.qint8
+    )
+
+
+def load_int8(model_name: str):
+    path = artifact_path(model_name, "int8")
+
+    if path.exists():
+        logger.info(f"Loading cached int8 model from {path}")
+        config = Wav2Vec2Config.from_pretrained(model_name, cache_dir = str(MODELS_DIR / "wav2vec2"))
+
+        # Build the skeleton without initialising fp32 weights, they get replaced
+        # by the cached int8 state dict anyway
+        with torch.device("meta"):
+            model = Wav2Vec2Model(config)
+        model = quantize_int8(model.to_empty(device="cpu"))
+        model.load_state_dict(torch.load(path))
+        model.eval()
+
+        return model
+
+    logger.info(f"Quantizing Linear layers of {model_name} to int8")
+    model = quantize_int8(load_eager(model_name))
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    torch.save(model.state_dict(), path)
+    logger.info(f"Saved int8 model to {path}")
+
+    return model
+
+
+class OnnxWav2Vec2:
+    """
+        Wraps an onnxruntime session so it can be called like Wav2Vec2Model:
+        model(input_values, attention_mask=...).last_hidden_state
+    """
+
+    def __init__(self, path: Path, config):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = torch.get_num_threads()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        self.session = onnxruntime.InferenceSession(
+            str(path),
+            sess_options=options,
+            providers=["CPUExecutionProvider"]
+        )
+        self.config = config
+
+    def eval(self):
+        return self
+
+    def __call__(self, input_values, attention_mask=None):
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_values, dtype=torch.long)
+
+        (hidden_states,) = self.session.run(
+            ["last_hidden_state"],
+            {
+                "input_values": input_values.numpy().astype(numpy.float32),
+                "attention_mask": attention_mask.numpy().astype(numpy.int64)
+            }
+        )
+
+        return SimpleNamespace(last_hidden_state=torch.from_numpy(hidden_states))
+
+
+def export_onnx(model_name: str, path: Path):
+    model = load_eager(model_name)
+
+    # Two clips of different length so the exporter sees a real padding mask
+    input_values = torch.randn(2, 32000)
+    attention_mask = torch.ones(2, 32000, dtype=torch.long)
+    attention_mask[1, 16000:] = 0
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    logger.info(f"Exporting {model_name} to ONNX at {path}")
+
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (input_values, attention_mask),
+            str(path),
+            input_names=["input_values", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_values": {0: "batch", 1: "samples"},
+                "attention_mask": {0: "batch", 1: "samples"},
+                "last_hidden_state": {0: "batch", 1: "frames"}
+            },
+            opset_version=ONNX_OPSET,
+            dynamo=False
+        )
+
+    return model.config
+
+
+def load_onnx(model_name: str):
+    path = artifact_path(model_name, "onnx")
+
+    if path.exists():
+        config = Wav2Vec2Config.from_pretrained(model_name, cache_dir = str(MODELS_DIR / "wav2vec2"))
+    else:
+        config = export_onnx(model_name, path)
+
+    logger.info(f"Loading ONNX model from {path}")
+    return OnnxWav2Vec2(path, config)
+
+
+def load_backend(model_name: str, backend: str = BACKEND):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown encoder backend '{backend}', expected one of {BACKENDS}")
+
+    loaders = {
+        "eager": load_eager,
+        "int8": load_int8,
+        "onnx": load_onnx
+    }
+
+    return loaders[backend](model_name)
@@ -0,0 +1,148 @@
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+
+from services.generate_embeddings import extract_embeddings_batch
+from services.inference_pool import inference_pool
+from utils.logger import get_logger
+
+logger = get_logger("batching")
+
+# How long the first request of a batch waits for company before we run it
+BATCH_WINDOW_MS = float(os.getenv("ENCODER_BATCH_WINDOW_MS", "20"))
+MAX_BATCH_SIZE = int(os.getenv("ENCODER_MAX_BATCH_SIZE", "8"))
+
+# Clips are only batched together while longest/shortest stays under this ratio,
+# otherwise the short clips spend most of the forward pass on padding
+MAX_LENGTH_RATIO = float(os.getenv("ENCODER_MAX_LENGTH_RATIO", "1.5"))
+
+
+@dataclass
+class _Pending:
+    audio: object
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+def group_by_length(items: list, max_ratio: float = MAX_LENGTH_RATIO):
+    """
+        Sorts pending requests by clip length and cuts the list into groups whose
+        longest clip is at most max_ratio times the shortest one.
+    """
+    ordered = sorted(items, key=lambda p: len(p.audio))
+    groups = []
+    current = []
+
+    for item in ordered:
+        if current and len(item.audio) > max_ratio * max(len(current[0].audio), 1):
+            groups.append(current)
+            current = []
+        current.append(item)
+
+    if current:
+        groups.append(current)
+
+    return groups
+
+
+class EmbeddingBatcher:
+    """
+        Collects concurrent /vectorize requests and runs them through wav2vec2
+        together.
+
+        A batch is closed when MAX_BATCH_SIZE requests are waiting or when the
+        oldest one has waited BATCH_WINDOW_MS, whichever happens first. Each
+        length group is handed to the inference pool, so with more than one slot
+        the next batch is collected while the previous one is still running.
+    """
+
+    def __init__(
+        self,
+        window_ms: float = BATCH_WINDOW_MS,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_length_ratio: float = MAX_LENGTH_RATIO
+    ):
+        self.window = window_ms / 1000
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_length_ratio = max_length_ratio
+        self._queue: asyncio.Queue = None
+        self._worker: asyncio.Task = None
+        self._running = set()
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def submit(self, audio):
+        """Queues one clip and waits for its embedding."""
+        self._ensure_worker()
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_Pending(audio=audio, future=future))
+
+        return await future
+
+    async def _collect(self):
+        first = await self._queue.get()
+        batch = [first]
+        deadline = first.enqueued_at + self.window
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            batch = [p for p in batch if not p.future.cancelled()]
+
+            for group in group_by_length(batch, self.max_length_ratio):
+                task = asyncio.create_task(self._run_group(group))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+    async def _run_group(self, group: list):
+        started = time.perf_counter()
+
+        try:
+            embeddings = await inference_pool.run(
+                extract_embeddings_batch,
+                [p.audio for p in group],
+                weight=len(group)
+            )
+        except Exception as e:
+            logger.error(f"Batched forward pass failed for {len(group)} clips: {e}")
+            for p in group:
+                if not p.future.done():
+                    p.future.set_exception(e)
+            return
+
+        for p, embedding in zip(group, embeddings):
+            if not p.future.done():
+                p.future.set_result(embedding)
+
+        logger.info(f"Encoded batch of {len(group)} clips in {(time.perf_counter() - started) * 1000:.1f}ms")
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+        for task in list(self._running):
+            task.cancel()
+
+
+batcher = EmbeddingBatcher()
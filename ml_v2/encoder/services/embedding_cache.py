@@ -0,0 +1,206 @@
+import asyncio
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from services.backends import BACKEND
+from services.generate_embeddings import (
+    MODEL_NAME,
+    CHUNK_THRESHOLD_SECONDS,
+    CHUNK_WINDOW_SECONDS,
+    CHUNK_OVERLAP_SECONDS
+)
+from utils.logger import get_logger
+
+logger = get_logger("embedding_cache")
+
+CACHE_MAX_MB = float(os.getenv("ENCODER_CACHE_MAX_MB", "64"))
+DISK_CACHE_ENABLED = os.getenv("ENCODER_DISK_CACHE", "1") == "1"
+DISK_CACHE_MAX_MB = float(os.getenv("ENCODER_DISK_CACHE_MAX_MB", "1024"))
+DISK_CACHE_DIR = Path(__file__).resolve().parent.parent / "models" / "embedding-cache"
+# Eviction trims the disk tier to this share of its budget, so it doesn't rescan on every write
+DISK_EVICT_TO = 0.9
+
+
+def model_fingerprint():
+    """
+        Everything that changes the vector for the same audio. It goes into every
+        key, so switching model, backend or pooling settings never serves stale
+        embeddings.
+    """
+    return (
+        f"{MODEL_NAME}|{BACKEND}|mean"
+        f"|chunk>{CHUNK_THRESHOLD_SECONDS}s:{CHUNK_WINDOW_SECONDS}s/{CHUNK_OVERLAP_SECONDS}s"
+    )
+
+
+class EmbeddingCache:
+    """
+        Two tier cache of embeddings keyed by the hash of the uploaded audio bytes.
+
+        Memory is an LRU bounded by max_mb, disk is one .npy file per key under
+        models/embedding-cache, next to the model weights. Disk hits are promoted
+        back into memory.
+
+        The disk tier is bounded by disk_max_mb. A hit touches its file, and once
+        the directory grows past the budget the files with the oldest mtime are
+        removed, so it is an LRU too, shared by every worker process. Disk reads
+        and writes run on a thread, never on the event loop.
+    """
+
+    def __init__(self, max_mb: float = CACHE_MAX_MB, disk_dir: Path = None, disk_max_mb: float = DISK_CACHE_MAX_MB):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = int(disk_max_mb * 1024 * 1024)
+        self.fingerprint = model_fingerprint()
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+        # Unknown until the first write scans the directory
+        self._disk_bytes = None
+        self._disk_lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_evictions = 0
+
+    def key(self, data: bytes, kind: str):
+        """kind separates encoded files from raw PCM bodies with the same bytes."""
+        digest = hashlib.sha256()
+        digest.update(self.fingerprint.encode())
+        digest.update(kind.encode())
+        digest.update(data)
+
+        return digest.hexdigest()
+
+    def _disk_path(self, key: str):
+        return self.disk_dir / key[:2] / f"{key}.npy"
+
+    async def get(self, key: str):
+        embedding = self._entries.get(key)
+        if embedding is not None:
+            self._entries.move_to_end(key)
+            self.memory_hits += 1
+            return embedding
+
+        if self.disk_dir is not None:
+            embedding = await asyncio.to_thread(self._load, key)
+
+            if embedding is not None:
+                self.disk_hits += 1
+                self._remember(key, embedding)
+                return embedding
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, embedding):
+        embedding = np.asarray(embedding, dtype=np.float32)
+        self._remember(key, embedding)
+
+        if self.disk_dir is not None:
+            await asyncio.to_thread(self._store, key, embedding)
+
+    def _load(self, key: str):
+        path = self._disk_path(key)
+        try:
+            embedding = np.load(path, allow_pickle=False)
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+
+        try:
+            # The mtime is the recency eviction goes by
+            os.utime(path)
+        except OSError:
+            pass
+
+        return embedding
+
+    def _store(self, key: str, embedding):
+        path = self._disk_path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Write then rename so a crash never leaves half a file behind
+            tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_path, "wb") as f:
+                np.save(f, embedding, allow_pickle=False)
+            os.replace(tmp_path, path)
+            size = path.stat().st_size
+        except OSError as e:
+            logger.warning(f"Could not write embedding cache entry {key}: {e}")
+            return
+
+        with self._disk_lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, size, _ in self._scan())
+            else:
+                self._disk_bytes += size
+
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict()
+
+    def _scan(self):
+        """(mtime, size, path) of every cached file, other workers' included."""
+        files = []
+        for path in self.disk_dir.glob("*/*.npy"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        return files
+
+    def _evict(self):
+        """Removes the least recently used files until the disk tier is at DISK_EVICT_TO of its budget."""
+        files = sorted(self._scan())
+        total = sum(size for _, size, _ in files)
+        target = self.max_disk_bytes * DISK_EVICT_TO
+
+        evicted = 0
+        for _, size, path in files:
+            if total <= target:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            evicted += 1
+
+        self._disk_bytes = total
+        self.disk_evictions += evicted
+        logger.info(f"Evicted {evicted} embeddings from the disk cache, {total / 1024 / 1024:.1f} MB left")
+
+    def _remember(self, key: str, embedding):
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key).nbytes
+
+        self._entries[key] = embedding
+        self._bytes += embedding.nbytes
+
+        while self._bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.nbytes
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._entries),
+            "memory_bytes": self._bytes,
+            "disk_enabled": self.disk_dir is not None,
+            "disk_bytes": self._disk_bytes,
+            "disk_max_bytes": self.max_disk_bytes,
+            "disk_evictions": self.disk_evictions
+        }
+
+
+embedding_cache = EmbeddingCache(disk_dir=DISK_CACHE_DIR if DISK_CACHE_ENABLED else None)
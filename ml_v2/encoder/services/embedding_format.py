@@ -0,0 +1,52 @@
+"""
+    Response formats for /vectorize, picked from the Accept header.
+
+    application/json            {"fileName": ..., "embedding": [...]} (default)
+    application/x-embedding-f32 8 byte header + little-endian float32 values
+    application/x-embedding-f16 8 byte header + little-endian float16 values
+    application/x-npy           the vector as a .npy file
+
+    The binary header is b"EMB" + dtype char (b"f" float32, b"e" float16)
+    followed by the dimension as a little-endian uint32.
+"""
+import io
+import struct
+import numpy as np
+
+JSON = "application/json"
+RAW_F32 = "application/x-embedding-f32"
+RAW_F16 = "application/x-embedding-f16"
+NPY = "application/x-npy"
+
+MAGIC = b"EMB"
+HEADER = struct.Struct("<3scI")
+
+RAW_DTYPES = {
+    RAW_F32: (b"f", "<f4"),
+    RAW_F16: (b"e", "<f2"),
+}
+
+
+def negotiate(accept_header: str):
+    """Returns the first supported media type in the Accept header, JSON otherwise."""
+    for part in (accept_header or "").split(","):
+        media_type = part.split(";")[0].strip().lower()
+        if media_type in (RAW_F32, RAW_F16, NPY, JSON):
+            return media_type
+
+    return JSON
+
+
+def encode_embedding(embedding, media_type: str) -> bytes:
+    embedding = np.asarray(embedding)
+
+    if media_type in RAW_DTYPES:
+        code, dtype = RAW_DTYPES[media_type]
+        return HEADER.pack(MAGIC, code, embedding.size) + embedding.astype(dtype).tobytes()
+
+    if media_type == NPY:
+        buffer = io.BytesIO()
+        np.save(buffer, embedding.astype("<f4"), allow_pickle=False)
+        return buffer.getvalue()
+
+    raise ValueError(f"Unsupported embedding format: {media_type}")
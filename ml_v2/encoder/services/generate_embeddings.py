@@ -4,11 +4,21 @@ from functools import lru_cache
 from transformers import Wav2Vec2FeatureExtractor, Wav2Vec2Model
 from pathlib import Path
 import numpy
+import os
+from services.backends import BACKEND, load_backend
 
 SAMPLE_RATE = 16000
+MODEL_NAME = "facebook/wav2vec2-large-xlsr-53"
+
+# Clips longer than this are embedded window by window instead of in one pass
+CHUNK_THRESHOLD_SECONDS = float(os.getenv("EMBEDDING_CHUNK_THRESHOLD_SECONDS", "30"))
+CHUNK_WINDOW_SECONDS = float(os.getenv("EMBEDDING_CHUNK_WINDOW_SECONDS", "10"))
+CHUNK_OVERLAP_SECONDS = float(os.getenv("EMBEDDING_CHUNK_OVERLAP_SECONDS", "1"))
+# Windows per forward pass, this is what bounds peak memory in chunked mode
+CHUNK_BATCH_SIZE = int(os.getenv("EMBEDDING_CHUNK_BATCH_SIZE", "4"))
 
 @lru_cache()
-def load_embedding_model(model_name="facebook/wav2vec2-large-xlsr-53"):
+def load_embedding_model(model_name=MODEL_NAME, backend=BACKEND):
     base_path = Path(__file__).resolve().parent.parent /"models"/"wav2vec2"
     
     feature_extractor = Wav2Vec2FeatureExtractor.from_pretrained(
@@ -16,16 +26,23 @@ def load_embedding_model(model_name="facebook/wav2vec2-large-xlsr-53"):
         cache_dir = str(base_path)
     )
 
-    model = Wav2Vec2Model.from_pretrained(
-        model_name,
-        cache_dir = str(base_path)
-    )
+    model = load_backend(model_name, backend)
 
     model.eval()
 
     return model, feature_extractor
 
-def extract_embedding(audio):
+def extract_embedding(audio, chunked=None):
+    """
+        chunked=None picks the windowed path for clips over CHUNK_THRESHOLD_SECONDS,
+        True/False forces one or the other.
+    """
+    if chunked is None:
+        chunked = len(audio) > CHUNK_THRESHOLD_SECONDS * SAMPLE_RATE
+
+    if chunked:
+        return extract_embedding_chunked(audio)
+
     model, feature_extractor = load_embedding_model()
 
     inputs = feature_extractor(
@@ -39,4 +56,180 @@ def extract_embedding(audio):
         outputs = model(**inputs)
         embedding = outputs.last_hidden_state.mean(dim=1)
 
-    return embedding.squeeze().cpu().numpy()
\ No newline at end of file
+    return embedding.squeeze().cpu().numpy()
+
+def frame_attention_mask(config, num_frames, attention_mask):
+    """
+        Maps the sample level mask from the feature extractor down to the frames
+        produced by the conv feature encoder. Only needs the config so it works
+        for every backend.
+    """
+    lengths = attention_mask.sum(dim=-1)
+    for kernel, stride in zip(config.conv_kernel, config.conv_stride):
+        lengths = torch.div(lengths - kernel, stride, rounding_mode="floor") + 1
+
+    return torch.arange(num_frames)[None, :] < lengths[:, None]
+
+def masked_mean_pool(model, hidden_states, attention_mask):
+    """
+        Mean pools the last hidden state over the frames that belong to the clip,
+        padded frames never reach the average.
+    """
+    frame_mask = frame_attention_mask(
+        model.config,
+        hidden_states.shape[1],
+        attention_mask
+    )
+    frame_mask = frame_mask.unsqueeze(-1).to(hidden_states.dtype)
+
+    summed = (hidden_states * frame_mask).sum(dim=1)
+    counts = frame_mask.sum(dim=1).clamp(min=1)
+
+    return summed / counts
+
+def extract_embeddings_batch(audios: list):
+    """
+        Runs a single forward pass over several clips.
+
+        args:
+            audios: list of 1D float arrays at SAMPLE_RATE
+
+        output:
+            list of embeddings in the same order, each equal (up to float error)
+            to what extract_embedding would return for that clip on its own
+    """
+    results = [None] * len(audios)
+    short = []
+
+    # Long clips go through the windowed path on their own
+    for i, audio in enumerate(audios):
+        if len(audio) > CHUNK_THRESHOLD_SECONDS * SAMPLE_RATE:
+            results[i] = extract_embedding_chunked(audio)
+        else:
+            short.append(i)
+
+    if len(short) == 1:
+        results[short[0]] = extract_embedding(audios[short[0]], chunked=False)
+
+    elif short:
+        model, feature_extractor = load_embedding_model()
+
+        inputs = feature_extractor(
+            [audios[i] for i in short],
+            sampling_rate = SAMPLE_RATE,
+            return_tensors = "pt",
+            padding = True,
+            return_attention_mask = True
+        )
+
+        with torch.no_grad():
+            outputs = model(
+                inputs.input_values,
+                attention_mask = inputs.attention_mask
+            )
+            embeddings = masked_mean_pool(model, outputs.last_hidden_state, inputs.attention_mask)
+
+        for i, embedding in zip(short, embeddings.cpu().numpy()):
+            results[i] = embedding
+
+    return results
+
+def split_windows(num_samples: int, window: int, overlap: int):
+    """
+        Returns (start, end) sample ranges of overlapping windows covering the clip.
+
+        A new window is only started if it reaches past the end of the previous one,
+        so the last window is always longer than the overlap.
+    """
+    hop = max(window - overlap, 1)
+    starts = range(0, max(num_samples - overlap, 1), hop)
+
+    return [(start, min(start + window, num_samples)) for start in starts]
+
+def extract_embedding_chunked(
+    audio,
+    window_seconds: float = CHUNK_WINDOW_SECONDS,
+    overlap_seconds: float = CHUNK_OVERLAP_SECONDS,
+    batch_size: int = CHUNK_BATCH_SIZE
+):
+    """
+        Embeds a long clip window by window.
+
+        The clip is normalized once as a whole (like the feature extractor would do
+        for a full pass), cut into overlapping windows and run batch_size windows at
+        a time. Every window contributes the sum of its frame vectors and its frame
+        count, so the result is the frame-count weighted mean of the window means.
+        Memory depends on window_seconds * batch_size, not on the clip length.
+    """
+    model, feature_extractor = load_embedding_model()
+
+    audio = numpy.asarray(audio, dtype=numpy.float32)
+    if feature_extractor.do_normalize:
+        audio = (audio - audio.mean()) / numpy.sqrt(audio.var() + 1e-7)
+
+    window = int(window_seconds * SAMPLE_RATE)
+    overlap = int(overlap_seconds * SAMPLE_RATE)
+    windows = split_windows(len(audio), window, overlap)
+
+    total = None
+    frames = 0
+
+    for i in range(0, len(windows), max(batch_size, 1)):
+        group = windows[i:i + batch_size]
+        longest = max(end - start for start, end in group)
+
+        input_values = torch.zeros((len(group), longest), dtype=torch.float32)
+        attention_mask = torch.zeros((len(group), longest), dtype=torch.long)
+        for row, (start, end) in enumerate(group):
+            input_values[row, :end - start] = torch.from_numpy(audio[start:end])
+            attention_mask[row, :end - start] = 1
+
+        with torch.no_grad():
+            hidden_states = model(input_values, attention_mask = attention_mask).last_hidden_state
+            frame_mask = frame_attention_mask(
+                model.config,
+                hidden_states.shape[1],
+                attention_mask
+            ).unsqueeze(-1).to(hidden_states.dtype)
+
+            window_sum = (hidden_states * frame_mask).sum(dim=(0, 1))
+            total = window_sum if total is None else total + window_sum
+            frames += int(frame_mask.sum())
+
+    return (total / max(frames, 1)).cpu().numpy()
+
+def chunking_divergence(audio, **chunk_args):
+    """
+        Cosine distance between the full pass and the windowed embedding of a clip.
+        Compare it against SIMILARITY_THRESHOLD in the orchestrator before changing
+        the window settings.
+    """
+    full = extract_embedding(audio, chunked=False)
+    chunked = extract_embedding_chunked(audio, **chunk_args)
+
+    return cosine_distance(full, chunked)
+
+def cosine_distance(a, b):
+    similarity = numpy.dot(a, b) / (numpy.linalg.norm(a) * numpy.linalg.norm(b))
+
+    return float(1 - similarity)
+
+def backend_parity(audio, backend=BACKEND):
+    """
+        Cosine distance between the fp32 eager embedding and the one produced by
+        backend for the same clip. Anything well under the orchestrator's
+        SIMILARITY_THRESHOLD (0.2) leaves cluster assignment unchanged.
+    """
+    def embed(model, feature_extractor):
+        inputs = feature_extractor(audio, sampling_rate = SAMPLE_RATE, return_tensors = "pt")
+        with torch.no_grad():
+            return model(inputs.input_values).last_hidden_state.mean(dim=1).squeeze().cpu().numpy()
+
+    def models(name):
+        # Reuse the serving model instead of loading a second copy of it
+        return load_embedding_model() if name == BACKEND else load_embedding_model(backend=name)
+
+    reference = embed(*models("eager"))
+    candidate = embed(*models(backend))
+
+    return cosine_distance(reference, candidate)
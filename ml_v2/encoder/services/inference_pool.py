@@ -0,0 +1,106 @@
+import asyncio
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from utils.logger import get_logger
+
+logger = get_logger("inference_pool")
+
+# Number of decode / forward passes allowed to run at the same time
+INFERENCE_SLOTS = int(os.getenv("ENCODER_INFERENCE_SLOTS", "1"))
+# Requests allowed to wait for a slot before new ones are turned away
+MAX_QUEUE = int(os.getenv("ENCODER_MAX_QUEUE", "32"))
+
+
+class InferenceQueueFull(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Inference queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class InferencePool:
+    """
+        Runs the CPU heavy parts of a request (decode, wav2vec2) on a dedicated
+        thread pool so the event loop stays free for health checks and new uploads.
+
+        Every admitted request is either waiting or running. A request is running
+        while one of its tasks holds a slot, a batched task counts for every
+        request it carries. Once MAX_QUEUE requests are waiting, admit() fails fast
+        instead of letting latency grow without a bound.
+    """
+
+    def __init__(self, slots: int = INFERENCE_SLOTS, max_queue: int = MAX_QUEUE):
+        self.slots = max(1, slots)
+        self.max_queue = max(0, max_queue)
+        self.executor = ThreadPoolExecutor(max_workers=self.slots, thread_name_prefix="inference")
+
+        self.waiting = 0
+        self.in_flight = 0
+        self.rejected = 0
+        self.completed = 0
+        # Exponential moving average of task duration, used for Retry-After
+        self.avg_service_time = 1.0
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.waiting * self.avg_service_time / self.slots))
+
+    @asynccontextmanager
+    async def admit(self):
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise InferenceQueueFull(self.retry_after())
+
+        self.waiting += 1
+        try:
+            yield
+        finally:
+            self.waiting -= 1
+
+    async def run(self, fn, *args, weight: int = 1):
+        """
+            Runs fn(*args) on an inference slot.
+
+            weight is the number of admitted requests the task works for, they move
+            from waiting to in_flight for as long as the task runs.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._timed, fn, args, weight, loop)
+
+    def _timed(self, fn, args, weight, loop):
+        loop.call_soon_threadsafe(self._move, weight)
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            loop.call_soon_threadsafe(self._finish, weight, elapsed)
+
+    def _move(self, weight: int):
+        self.waiting -= weight
+        self.in_flight += weight
+
+    def _finish(self, weight: int, elapsed: float):
+        self.in_flight -= weight
+        self.waiting += weight
+        self.completed += 1
+        self.avg_service_time = 0.8 * self.avg_service_time + 0.2 * elapsed
+
+    def stats(self):
+        return {
+            "slots": self.slots,
+            "max_queue": self.max_queue,
+            "queue_depth": self.waiting,
+            "in_flight": self.in_flight,
+            "completed_tasks": self.completed,
+            "rejected_requests": self.rejected,
+            "avg_service_time_ms": round(self.avg_service_time * 1000, 1)
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+inference_pool = InferencePool()
@@ -0,0 +1,144 @@
+import gc
+import os
+import signal
+import socket
+import time
+
+import torch
+import uvicorn
+
+from services.backends import BACKEND
+from services.generate_embeddings import load_embedding_model
+from utils.logger import get_logger
+
+logger = get_logger("prefork")
+
+# Worker processes serving the encoder, 0 means one per two cores
+ENCODER_WORKERS = int(os.getenv("ENCODER_WORKERS", "0"))
+# Restarts allowed per worker slot before the server gives up on it
+MAX_RESTARTS = int(os.getenv("ENCODER_MAX_RESTARTS", "5"))
+
+
+def worker_count(workers: int = ENCODER_WORKERS) -> int:
+    if workers > 0:
+        return workers
+
+    return max(1, (os.cpu_count() or 1) // 2)
+
+
+def threads_per_worker(workers: int) -> int:
+    """Each worker gets an equal share of the cores for its intra-op thread pool."""
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+def preload():
+    """
+        Loads the weights in the parent so forked workers share them copy-on-write.
+
+        Torch is kept on one thread until the fork, a parent whose intra-op pool
+        already ran can deadlock its children. onnxruntime sessions own native
+        threads and are not fork safe, so with that backend every worker loads
+        its own session.
+    """
+    if BACKEND == "onnx":
+        logger.info("onnx backend: workers load their own session")
+        return
+
+    torch.set_num_threads(1)
+
+    started = time.perf_counter()
+    load_embedding_model()
+    logger.info(f"Preloaded {BACKEND} weights in {time.perf_counter() - started:.2f}s")
+
+    # Move everything alive now to the permanent generation, otherwise the
+    # collector in each worker touches these objects and un-shares their pages
+    gc.collect()
+    gc.freeze()
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    return sock
+
+
+def run_worker(app: str, sock: socket.socket, threads: int):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    torch.set_num_threads(threads)
+    logger.info(f"Worker {os.getpid()} serving with {threads} torch threads")
+
+    server = uvicorn.Server(uvicorn.Config(app, log_level="info"))
+    server.run(sockets=[sock])
+
+
+def spawn(app: str, sock: socket.socket, threads: int) -> int:
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            run_worker(app, sock, threads)
+        except BaseException as e:
+            logger.error(f"Worker {os.getpid()} crashed: {e}")
+            code = 1
+        finally:
+            os._exit(code)
+
+    return pid
+
+
+def serve(app: str, host: str, port: int, workers: int = ENCODER_WORKERS):
+    """
+        Prefork server: loads the model once, binds the port once and forks
+        workers that accept on the shared socket. Dead workers are replaced up to
+        MAX_RESTARTS times, SIGTERM / SIGINT stop all of them.
+    """
+    workers = worker_count(workers)
+    threads = threads_per_worker(workers)
+
+    preload()
+    sock = bind_socket(host, port)
+    logger.info(f"Starting {workers} encoder workers on {host}:{port}, {threads} threads each")
+
+    children = {spawn(app, sock, threads): slot for slot in range(workers)}
+    restarts = [0] * workers
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+
+        slot = children.pop(pid, None)
+        if slot is None or stopping:
+            continue
+
+        logger.warning(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}")
+        if restarts[slot] >= MAX_RESTARTS:
+            logger.error(f"Worker slot {slot} restarted {MAX_RESTARTS} times, not restarting it again")
+            continue
+
+        restarts[slot] += 1
+        children[spawn(app, sock, threads)] = slot
+
+    sock.close()
@@ -1,27 +1,122 @@
 from fastapi import UploadFile
 import numpy as np
-import librosa
-import tempfile
+import soundfile as sf
+import soxr
+import subprocess
+import io
 import os
-import shutil
 
+SAMPLE_RATE = 16000
+
+# Containers libsndfile can't read, these go straight to ffmpeg
+FFMPEG_FORMATS = {".m4a", ".mp4", ".aac", ".webm", ".opus", ".mp3"}
+
+
+def decode_with_soundfile(data: bytes):
+    audio, sr = sf.read(io.BytesIO(data), dtype="float32", always_2d=True)
+    audio = audio.mean(axis=1)
+
+    if sr != SAMPLE_RATE:
+        audio = soxr.resample(audio, sr, SAMPLE_RATE, quality="HQ")
+
+    return np.ascontiguousarray(audio, dtype=np.float32)
+
+
+def decode_with_ffmpeg(data: bytes):
+    """
+        Decodes any container ffmpeg understands into 16 kHz mono float32.
+
+        mp4/m4a files often keep their index at the end, which ffmpeg can't reach
+        through a pipe. On Linux the bytes go into an anonymous in-memory file
+        (memfd) instead, so ffmpeg can seek without anything touching the disk.
+    """
+    output_args = ["-f", "f32le", "-ac", "1", "-ar", str(SAMPLE_RATE), "pipe:1"]
+
+    if hasattr(os, "memfd_create"):
+        fd = os.memfd_create("upload")
+        try:
+            os.write(fd, data)
+            result = subprocess.run(
+                ["ffmpeg", "-v", "error", "-nostdin", "-i", f"/proc/self/fd/{fd}", *output_args],
+                capture_output=True,
+                pass_fds=(fd,)
+            )
+        finally:
+            os.close(fd)
+    else:
+        result = subprocess.run(
+            ["ffmpeg", "-v", "error", "-i", "pipe:0", *output_args],
+            input=data,
+            capture_output=True
+        )
+
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode(errors="ignore").strip())
+
+    return np.frombuffer(result.stdout, dtype=np.float32)
+
+
+def decode_audio_bytes(data: bytes, filename: str = "audio.wav"):
+    """
+        Turns the raw bytes of an upload into float32 16 kHz mono PCM without
+        writing them to a temp file. Bytes neither decoder can read raise
+        ValueError.
+    """
+    file_ext = os.path.splitext(filename)[1].lower()
 
-def preprocess_audio(file: UploadFile):
-    SAMPLE_RATE = 16000
-    filename = file.filename or "audio.wav"
-    file_ext = os.path.splitext(filename)[1] 
-    
     try:
+        if file_ext not in FFMPEG_FORMATS:
+            try:
+                return decode_with_soundfile(data)
+            except sf.LibsndfileError:
+                pass
+
+        return decode_with_ffmpeg(data)
+    except Exception as e:
+        raise ValueError(f"Failed to decode audio {filename}: {e}")
+
+
+# Raw PCM bodies accepted by /vectorize/pcm, always mono and little-endian
+PCM_FORMATS = {
+    "application/x-pcm-f32": "<f4",
+    "application/x-pcm-s16": "<i2",
+}
+
+
+def decode_pcm(data: bytes, content_type: str, sample_rate: int = SAMPLE_RATE):
+    """
+        Turns an already decoded PCM body into float32 16 kHz audio. float32 at
+        16 kHz is used as is, int16 is scaled to [-1, 1). Bodies that can't be
+        PCM of the given type raise ValueError.
+    """
+    dtype = PCM_FORMATS.get((content_type or "").split(";")[0].strip().lower())
+    if dtype is None:
+        raise ValueError(f"Unsupported PCM content type '{content_type}', expected one of {list(PCM_FORMATS)}")
 
-        with tempfile.NamedTemporaryFile(suffix=file_ext) as tmp:
-            
-            shutil.copyfileobj(file.file, tmp)
-            tmp.flush()
+    width = np.dtype(dtype).itemsize
+    if len(data) % width:
+        raise ValueError(f"PCM body of {len(data)} bytes is not a whole number of {width} byte samples")
 
-            audio, sr = librosa.load(tmp.name, sr=SAMPLE_RATE, mono=True)
+    if sample_rate <= 0:
+        raise ValueError(f"Invalid sample rate {sample_rate}")
 
-            return audio
+    audio = np.frombuffer(data, dtype=dtype)
+    if dtype == "<i2":
+        audio = audio.astype(np.float32) / 32768.0
+    else:
+        audio = audio.astype(np.float32, copy=False)
 
+    if sample_rate != SAMPLE_RATE:
+        audio = soxr.resample(audio, sample_rate, SAMPLE_RATE, quality="HQ")
+
+    return audio
+
+
+def preprocess_audio(file: UploadFile):
+    filename = file.filename or "audio.wav"
+
+    try:
+        return decode_audio_bytes(file.file.read(), filename)
 
     except Exception as e:
         raise ValueError(f"Failed to procces audio:{e}")
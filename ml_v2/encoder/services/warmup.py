@@ -0,0 +1,68 @@
+import os
+import time
+
+import numpy as np
+
+from services.generate_embeddings import (
+    SAMPLE_RATE,
+    load_embedding_model,
+    extract_embedding,
+    extract_embeddings_batch
+)
+from utils.logger import get_logger
+
+logger = get_logger("warmup")
+
+# Clip lengths pushed through the model before the service reports ready
+WARMUP_SECONDS = [
+    float(seconds) for seconds in os.getenv("ENCODER_WARMUP_SECONDS", "1,5,15").split(",") if seconds.strip()
+]
+
+
+class StartupState:
+    """Cold start timings, filled in once by warm_up() and served from /ready and /stats."""
+
+    def __init__(self):
+        self.ready = False
+        self.error = None
+        self.model_load_seconds = None
+        self.warmup_seconds = None
+
+    def as_dict(self):
+        return {
+            "ready": self.ready,
+            "error": self.error,
+            "model_load_seconds": self.model_load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "warmup_lengths_seconds": WARMUP_SECONDS
+        }
+
+
+startup_state = StartupState()
+
+
+def warm_up():
+    """
+        Loads the model and runs a forward pass per WARMUP_SECONDS length, plus one
+        small padded batch, so the first real request doesn't pay for lazy
+        initialisation.
+    """
+    started = time.perf_counter()
+    load_embedding_model()
+    startup_state.model_load_seconds = round(time.perf_counter() - started, 3)
+    logger.info(f"Loaded embedding model in {startup_state.model_load_seconds:.2f}s")
+
+    rng = np.random.default_rng(0)
+    started = time.perf_counter()
+
+    for seconds in WARMUP_SECONDS:
+        clip = (rng.standard_normal(int(seconds * SAMPLE_RATE)) * 0.1).astype(np.float32)
+        extract_embedding(clip)
+
+    if WARMUP_SECONDS:
+        clip = (rng.standard_normal(int(WARMUP_SECONDS[0] * SAMPLE_RATE)) * 0.1).astype(np.float32)
+        extract_embeddings_batch([clip, clip[: len(clip) * 3 // 4]])
+
+    startup_state.warmup_seconds = round(time.perf_counter() - started, 3)
+    startup_state.ready = True
+    logger.info(f"Warm-up passes for {WARMUP_SECONDS}s clips took {startup_state.warmup_seconds:.2f}s, encoder is ready")
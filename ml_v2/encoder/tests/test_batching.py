@@ -0,0 +1,44 @@
+from services import generate_embeddings
+from services.generate_embeddings import extract_embedding, extract_embeddings_batch
+from transformers import Wav2Vec2Config, Wav2Vec2FeatureExtractor, Wav2Vec2Model
+import numpy as np
+import torch
+
+
+def tiny_model():
+    """Randomly initialised wav2vec2 with the layout of xlsr-53 (layer norm feature encoder), just much smaller."""
+    torch.manual_seed(0)
+    config = Wav2Vec2Config(
+        hidden_size=32,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=64,
+        conv_dim=(16, 16, 16),
+        conv_kernel=(10, 3, 3),
+        conv_stride=(5, 2, 2),
+        num_conv_pos_embeddings=16,
+        num_conv_pos_embedding_groups=2,
+        feat_extract_norm="layer",
+        do_stable_layer_norm=True
+    )
+    model = Wav2Vec2Model(config)
+    model.eval()
+
+    feature_extractor = Wav2Vec2FeatureExtractor(do_normalize=True, return_attention_mask=True)
+    return model, feature_extractor
+
+
+def test_batched_embeddings_match_single_clips(monkeypatch):
+    model = tiny_model()
+    monkeypatch.setattr(generate_embeddings, "load_embedding_model", lambda: model)
+
+    rng = np.random.default_rng(0)
+    # Different lengths, so all but the longest clip are padded in the batch
+    audios = [rng.standard_normal(length).astype(np.float32) for length in (16000, 9000, 23517, 4000)]
+
+    batched = extract_embeddings_batch(audios)
+
+    for audio, embedding in zip(audios, batched):
+        single = extract_embedding(audio, chunked=False)
+        assert embedding.shape == single.shape
+        assert np.allclose(embedding, single, atol=1e-4)
@@ -0,0 +1,66 @@
+from services.embedding_cache import EmbeddingCache, DISK_EVICT_TO
+import asyncio
+import os
+import time
+import numpy as np
+
+DIM = 1024
+MB = 1024 * 1024
+
+
+def embeddings(count):
+    rng = np.random.default_rng(0)
+    return [rng.standard_normal(DIM).astype(np.float32) for _ in range(count)]
+
+
+def test_disk_hit_survives_memory_eviction(tmp_path):
+    # Room for two embeddings in memory
+    cache = EmbeddingCache(max_mb=2.5 * DIM * 4 / MB, disk_dir=tmp_path)
+    vectors = embeddings(3)
+    keys = [cache.key(str(i).encode(), "file") for i in range(3)]
+
+    async def scenario():
+        for key, vector in zip(keys, vectors):
+            await cache.put(key, vector)
+        assert keys[0] not in cache._entries
+
+        found = await cache.get(keys[0])
+        assert np.array_equal(found, vectors[0])
+        assert cache.disk_hits == 1 and cache.misses == 0
+        # Promoted back into memory, the next lookup doesn't touch the disk
+        await cache.get(keys[0])
+        assert cache.memory_hits == 1
+
+    asyncio.run(scenario())
+
+
+def test_disk_tier_evicts_least_recently_used_at_its_bound(tmp_path):
+    vectors = embeddings(8)
+    file_size = 128 + DIM * 4
+    # Room for five files on disk, none in memory
+    cache = EmbeddingCache(max_mb=0, disk_dir=tmp_path, disk_max_mb=5.5 * file_size / MB)
+    keys = [cache.key(str(i).encode(), "file") for i in range(len(vectors))]
+    started = time.time() - 1000
+
+    async def scenario():
+        for i, (key, vector) in enumerate(zip(keys[:5], vectors[:5])):
+            await cache.put(key, vector)
+            # Distinct mtimes, oldest first
+            os.utime(cache._disk_path(key), (started + i, started + i))
+
+        # A hit makes the oldest file the most recently used one
+        assert await cache.get(keys[0]) is not None
+
+        for key, vector in zip(keys[5:], vectors[5:]):
+            await cache.put(key, vector)
+
+    asyncio.run(scenario())
+
+    on_disk = {key for key in keys if cache._disk_path(key).exists()}
+    used = sum(cache._disk_path(key).stat().st_size for key in on_disk)
+
+    assert cache.disk_evictions >= 3
+    assert used <= cache.max_disk_bytes and cache.stats()["disk_bytes"] == used
+    assert keys[0] in on_disk and keys[7] in on_disk
+    assert keys[1] not in on_disk and keys[2] not in on_disk
+    assert used <= cache.max_disk_bytes * DISK_EVICT_TO + file_size
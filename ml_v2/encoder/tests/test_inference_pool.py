@@ -0,0 +1,58 @@
+from services.inference_pool import InferencePool, InferenceQueueFull
+import asyncio
+import threading
+import pytest
+
+
+def test_admit_rejects_once_the_queue_is_full():
+    async def scenario():
+        pool = InferencePool(slots=1, max_queue=2)
+
+        async with pool.admit():
+            async with pool.admit():
+                with pytest.raises(InferenceQueueFull) as rejected:
+                    async with pool.admit():
+                        pass
+                assert rejected.value.retry_after >= 1
+
+        stats = pool.stats()
+        assert stats["queue_depth"] == 0 and stats["rejected_requests"] == 1
+
+        # Room again once the others left
+        async with pool.admit():
+            assert pool.waiting == 1
+
+        pool.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_running_requests_leave_the_queue():
+    async def scenario():
+        pool = InferencePool(slots=1, max_queue=1)
+        started, release = threading.Event(), threading.Event()
+
+        def work():
+            started.set()
+            release.wait(5)
+            return 42
+
+        async with pool.admit():
+            task = asyncio.create_task(pool.run(work))
+            await asyncio.to_thread(started.wait, 5)
+
+            assert pool.waiting == 0 and pool.in_flight == 1
+            # The running request doesn't hold a queue place
+            async with pool.admit():
+                pass
+
+            release.set()
+            assert await task == 42
+
+        # Work nobody was admitted for (warm-up) runs with weight=0 and isn't counted
+        assert await pool.run(lambda: 7, weight=0) == 7
+        assert pool.waiting == 0 and pool.in_flight == 0
+
+        pool.shutdown()
+
+    asyncio.run(scenario())
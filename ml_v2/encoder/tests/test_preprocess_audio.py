@@ -0,0 +1,51 @@
+from services.preprocess_audio import decode_pcm, SAMPLE_RATE
+import numpy as np
+import pytest
+
+
+def test_s16_is_scaled_to_unit_range():
+    samples = np.array([-32768, -16384, 0, 16384, 32767], dtype="<i2")
+    audio = decode_pcm(samples.tobytes(), "application/x-pcm-s16")
+
+    assert audio.dtype == np.float32
+    assert np.allclose(audio, [-1.0, -0.5, 0.0, 0.5, 32767 / 32768])
+
+
+def test_f32_at_16khz_is_used_as_is():
+    samples = np.linspace(-1, 1, 100, dtype="<f4")
+    audio = decode_pcm(samples.tobytes(), "application/x-pcm-f32; charset=binary")
+
+    assert np.array_equal(audio, samples)
+
+
+@pytest.mark.parametrize("content_type, length", [
+    ("application/x-pcm-s16", 5),
+    ("application/x-pcm-f32", 6),
+])
+def test_partial_samples_are_rejected(content_type, length):
+    with pytest.raises(ValueError, match="whole number"):
+        decode_pcm(b"\x00" * length, content_type)
+
+
+@pytest.mark.parametrize("content_type", ["audio/wav", "application/x-pcm-f64", "", None])
+def test_unsupported_content_types_are_rejected(content_type):
+    with pytest.raises(ValueError, match="Unsupported PCM content type"):
+        decode_pcm(b"\x00" * 8, content_type)
+
+
+def test_other_sample_rates_are_resampled_to_16khz():
+    rate = 44100
+    t = np.arange(rate) / rate
+    tone = (0.5 * np.sin(2 * np.pi * 440 * t)).astype("<f4")
+
+    audio = decode_pcm(tone.tobytes(), "application/x-pcm-f32", sample_rate=rate)
+
+    assert audio.dtype == np.float32
+    assert abs(len(audio) - SAMPLE_RATE) <= 1
+    # Still a 440 Hz tone of the same level
+    spectrum = np.abs(np.fft.rfft(audio))
+    assert abs(np.argmax(spectrum) * SAMPLE_RATE / len(audio) - 440) < 2
+    assert np.isclose(np.sqrt(np.mean(audio ** 2)), 0.5 / np.sqrt(2), atol=0.01)
+
+    with pytest.raises(ValueError, match="sample rate"):
+        decode_pcm(tone.tobytes(), "application/x-pcm-f32", sample_rate=0)
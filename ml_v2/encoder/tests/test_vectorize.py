@@ -0,0 +1,17 @@
+from fastapi.testclient import TestClient
+import main
+from services.embedding_cache import EmbeddingCache
+from services.warmup import startup_state
+
+
+def test_undecodable_upload_is_a_bad_request(monkeypatch):
+    monkeypatch.setattr(startup_state, "ready", True)
+    monkeypatch.setattr(main, "embedding_cache", EmbeddingCache())
+
+    # No lifespan, the model is never loaded: the body has to be rejected before inference
+    client = TestClient(main.app)
+    for filename in ("garbage.wav", "garbage.mp3"):
+        response = client.post("/vectorize", files={"file": (filename, b"\x00not audio at all\xff" * 64)})
+
+        assert response.status_code == 400
+        assert "Failed to decode audio" in response.json()["detail"]
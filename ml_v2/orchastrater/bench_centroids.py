@@ -0,0 +1,114 @@
+# orchestrator/bench_centroids.py
+#
+# Many parallel uploads landing in one cluster, against a simulated Cluster row
+# with a fixed write latency. Compares the old read-modify-write update with the
+# centroid accumulator: final centroid vs the exact mean, updates lost, number
+# of UPDATE statements and how long the uploads had to wait.
+#
+# Uploads arrive spread evenly over ARRIVAL_SECONDS.
+#
+#   python bench_centroids.py [uploads] [write_latency_ms]
+import sys
+import asyncio
+import time
+import numpy as np
+
+sys.path.append(".")
+
+from services.clustering import calculate_new_centroid
+from services.cluster_index import ClusterIndex
+from services.centroid_accumulator import CentroidAccumulator
+
+DIM = 1024
+CLUSTER_ID = 1
+ARRIVAL_SECONDS = 0.5
+
+
+class FakeClusterTable:
+    """One Cluster row, every statement takes latency seconds."""
+
+    def __init__(self, centroid, count, latency):
+        self.centroid = np.asarray(centroid, dtype=np.float64)
+        self.count = count
+        self.latency = latency
+        self.lock = asyncio.Lock()
+        self.statements = 0
+
+    async def read(self):
+        await asyncio.sleep(self.latency)
+        self.statements += 1
+        return self.centroid.copy(), self.count
+
+    async def write(self, centroid, count):
+        await asyncio.sleep(self.latency)
+        self.statements += 1
+        self.centroid, self.count = np.asarray(centroid, dtype=np.float64), count
+
+    async def merge(self, cluster_id, total, count):
+        # What merge_cluster_samples does in one statement under the row lock
+        async with self.lock:
+            await asyncio.sleep(self.latency)
+            self.statements += 1
+            self.centroid = (self.centroid * self.count + total) / (self.count + count)
+            self.count += count
+
+
+async def read_modify_write(table, embeddings):
+    async def upload(i, embedding):
+        await asyncio.sleep(i * ARRIVAL_SECONDS / len(embeddings))
+        centroid, count = await table.read()
+        await table.write(calculate_new_centroid(centroid, count, embedding), count + 1)
+
+    await asyncio.gather(*[upload(i, e) for i, e in enumerate(embeddings)])
+
+
+async def accumulated(table, embeddings):
+    index = ClusterIndex()
+    index.upsert(CLUSTER_ID, table.centroid, table.count)
+
+    accumulator = CentroidAccumulator(index=index, write=table.merge, flush_seconds=0.05, flush_batch=64)
+    accumulator.start()
+
+    async def upload(i, embedding):
+        await asyncio.sleep(i * ARRIVAL_SECONDS / len(embeddings))
+        accumulator.add(CLUSTER_ID, embedding)
+
+    await asyncio.gather(*[upload(i, e) for i, e in enumerate(embeddings)])
+    await accumulator.shutdown()
+
+    return index
+
+
+def report(name, table, expected, expected_count, elapsed):
+    error = float(np.max(np.abs(table.centroid - expected)))
+    print(
+        f"{name:18} count {table.count:6d}/{expected_count} "
+        f"lost {expected_count - table.count:6d}  max error {error:.2e}  "
+        f"statements {table.statements:6d}  {elapsed * 1000:8.1f} ms"
+    )
+
+
+async def main(uploads, latency):
+    rng = np.random.default_rng(0)
+    start_centroid = rng.standard_normal(DIM)
+    start_count = 10
+    embeddings = rng.standard_normal((uploads, DIM))
+
+    expected = (start_centroid * start_count + embeddings.sum(axis=0)) / (start_count + uploads)
+    expected_count = start_count + uploads
+
+    for name, run in (("read-modify-write", read_modify_write), ("accumulator", accumulated)):
+        table = FakeClusterTable(start_centroid, start_count, latency)
+        started = time.perf_counter()
+        result = await run(table, embeddings)
+        report(name, table, expected, expected_count, time.perf_counter() - started)
+
+        if isinstance(result, ClusterIndex):
+            centroid, _ = result.get(CLUSTER_ID)
+            print(f"{'':18} index centroid max error {float(np.max(np.abs(centroid - expected))):.2e} (float32)")
+
+
+if __name__ == "__main__":
+    uploads = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.002
+    asyncio.run(main(uploads, latency))
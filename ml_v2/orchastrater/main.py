@@ -1,23 +1,47 @@
 from fileinput import filename
 import os
-import shutil
-import tempfile
 from typing import final
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 import uvicorn
 
 
 from utils.logger import get_logger
+from utils.env import INGEST_MODE
 
-from services import whisper_utils
-from services import remote_encoder
-from services import db_embeddings
-from services import db_clusters
-from services import clustering
-from services import supabase
+from services import pipeline
+from services.whisper_utils import whisper_pool
+from services.jobs import job_queue
+from services.transcripts import transcript_queue
+from services.remote_encoder import encoder_client
+from services.cluster_index import cluster_index
+from services.centroid_accumulator import centroid_accumulator
+from utils import db
 
-app = FastAPI(title="BhashaSuraksha Orchastrator")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await db.open_pool()
+    await cluster_index.start()
+    centroid_accumulator.start()
+    encoder_client.start()
+    whisper_pool.start()
+    await transcript_queue.start()
+    if INGEST_MODE == "async":
+        await job_queue.start()
+
+    yield
+
+    await job_queue.shutdown()
+    await transcript_queue.shutdown()
+    await whisper_pool.shutdown()
+    await encoder_client.close()
+    await centroid_accumulator.shutdown()
+    await cluster_index.shutdown()
+    await db.close_pool()
+
+app = FastAPI(title="BhashaSuraksha Orchastrator", lifespan=lifespan)
 logger = get_logger("main")
 
 
@@ -33,6 +57,19 @@ allow_headers=["*"],
 def health_check():
     return {"status" : "healthy", "service": "orchastrator"}
 
+@app.get("/stats")
+async def stats():
+    return {
+        "whisper": whisper_pool.stats(),
+        "routing": pipeline.stats(),
+        "encoder": encoder_client.stats(),
+        "db": db.db_stats(),
+        "clusters": cluster_index.stats(),
+        "centroids": centroid_accumulator.stats(),
+        "transcripts": await transcript_queue.stats(),
+        "jobs": await job_queue.stats() if INGEST_MODE == "async" else None
+    }
+
 @app.post("/process-audio")
 async def process_audio(
     file: UploadFile = File(...),
@@ -40,91 +77,41 @@ async def process_audio(
     lat:float = Form(None),
     lng:float = Form(None)
 ):
-    tmp_path = None
     try:
         logger.info(f"Recieved request:{file.filename} from region:{region}")
         
         filename = file.filename or "audio.wav"
-        file_ext = os.path.splitext(filename)[1] or ".wav"
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as tmp:
-            shutil.copyfileobj(file.file,tmp)
-            tmp_path = tmp.name
-            logger.info(f"saved temp file into {tmp_path}")
-        
-        #whisper
-        transcription = whisper_utils.transcribe_audio(tmp_path)
-        transcript_text = transcription["text"]
-        detected_language = transcription["language"]
-        confidence = transcription["probability"]
-        logger.info(f"Whisper results: transcription:{transcript_text} with language:{detected_language} with confidence:{confidence}")
-        
-        #encoder
-        embedding = await remote_encoder.get_audio_embedding(tmp_path)
-        
-        if not embedding:
-            raise HTTPException(status_code=500,detail="Failed to generate embedding")
-
-        #clustering
-        existing_clusters = db_clusters.get_all_clusters()        
-        best_cluster_id, distance = clustering.find_best_cluster(embedding,existing_clusters)
-        final_cluster_id = None
+        audio_bytes = await file.read()
+        logger.info(f"Read {len(audio_bytes)} bytes from upload")
         
-        if best_cluster_id is not None:
-            logger.info(f"Joining Cluster {best_cluster_id} (Distance:{distance:.4f})")
-            final_cluster_id = best_cluster_id
-            
-            match = next(c for c in existing_clusters if c['id']==best_cluster_id)
-            
-            new_centroid = clustering.calculate_new_centroid(
-                match["centroid"],
-                match["sampleCount"],
-                embedding
+        if INGEST_MODE == "async":
+            job_id = await job_queue.enqueue(audio_bytes, filename, region, lat, lng)
+            return JSONResponse(
+                status_code=202,
+                content={"status": "queued", "job_id": job_id, "job_url": f"/jobs/{job_id}"}
             )
-            
-            db_clusters.update_cluster_centroid(
-                best_cluster_id,
-                new_centroid,
-                match["sampleCount"]+1
-            )
-            
-        else:
-            logger.info("No matching cluster found, Creating new Cluster")
-            final_cluster_id = db_clusters.create_new_cluster(embedding)
-            
-        public_url = supabase.upload_audio_file(tmp_path,filename)
-            
-        sample_id = db_embeddings.create_unknown_sample(
-            file_url=public_url,
-            language_guess=detected_language,
-            confidence=confidence,
-            transcript=transcript_text,
-            region=region,
-            lat=lat,
-            lng=lng,
-            keywords="",
-            embedding=embedding,
-            cluster_id=final_cluster_id
-        )
-        
-        return {
-            "status": "success",
-            "sample_id": sample_id,
-            "transcript": transcript_text,
-            "detected_language":detected_language,
-            "assigned_cluster_id": final_cluster_id,
-            "is_new_cluster": (final_cluster_id != best_cluster_id) if best_cluster_id is not None else True,
-            "file_url": public_url
-        }
+
+        return await pipeline.process_upload(audio_bytes, filename, region, lat, lng)
     
     except Exception as e:
+        # Stage failures arrive wrapped in (possibly nested) ExceptionGroups
+        while isinstance(e, ExceptionGroup):
+            e = e.exceptions[0]
         logger.error(f"Processing failed: {e}")
         raise HTTPException(status_code=500,detail=str(e))
-    
-    finally:
-        if tmp_path and os.path.exists(tmp_path):
-            os.remove(tmp_path)
-            logger.info("cleaned temp path")
         
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = Query(0, ge=0, le=60)):
+    """wait > 0 long-polls for up to that many seconds until the job has finished"""
+    if INGEST_MODE != "async":
+        raise HTTPException(status_code=404, detail="Async ingest mode is not enabled")
+
+    job = await job_queue.get(job_id, wait)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+
+    return job
+
 def main():
     uvicorn.run(
         "main:app",
@@ -0,0 +1,130 @@
+# orchestrator/migrate_vectors.py
+#
+# Moves embeddings and centroids from the JSONB columns to the binary
+# "embeddingVec" / "centroidVec" columns (migration 20261017000000_binary_vectors).
+#
+# Switch the services to VECTOR_STORAGE=bytea first, then run the backfill. Rows
+# are converted in id order, one committed batch at a time, so it can be stopped
+# and resumed. A row that already has a binary vector is never overwritten.
+#
+#   python migrate_vectors.py measure [--rows N]
+#   python migrate_vectors.py backfill [--batch N] [--drop-json]
+#
+# measure prints table sizes and how fast N vectors are read from each column,
+# run it before and after the backfill.
+import sys
+import argparse
+import time
+import numpy as np
+import psycopg
+from psycopg.rows import dict_row
+
+sys.path.append(".")
+
+from utils.env import DATABASE_URL
+from services.vector_codec import encode_vector, decode_vector
+
+# table, id column, JSON column, binary column
+TARGETS = [
+    ("UnknownSample", "id", "embedding", "embeddingVec"),
+    ("Cluster", "id", "centroid", "centroidVec"),
+]
+
+
+def backfill_table(conn, table, key, json_column, binary_column, batch, drop_json):
+    last_id = 0
+    converted = 0
+    started = time.perf_counter()
+
+    while True:
+        with conn.transaction():
+            rows = conn.execute(
+                f"""
+                    SELECT "{key}" AS id, "{json_column}" AS vector FROM "{table}"
+                    WHERE "{key}" > %s AND "{binary_column}" IS NULL AND "{json_column}" IS NOT NULL
+                    ORDER BY "{key}"
+                    LIMIT %s
+                """,
+                (last_id, batch)
+            ).fetchall()
+
+            if not rows:
+                break
+
+            ids = [row["id"] for row in rows]
+            vectors = [encode_vector(row["vector"]) for row in rows]
+            clear_json = f', "{json_column}" = NULL' if drop_json else ""
+
+            conn.execute(
+                f"""
+                    UPDATE "{table}" AS t
+                    SET "{binary_column}" = v.vector{clear_json}
+                    FROM unnest(%s::int[], %s::bytea[]) AS v(id, vector)
+                    WHERE t."{key}" = v.id AND t."{binary_column}" IS NULL
+                """,
+                (ids, vectors)
+            )
+
+        converted += len(rows)
+        last_id = ids[-1]
+        rate = converted / (time.perf_counter() - started)
+        print(f"{table}: {converted} rows converted, up to id {last_id} ({rate:.0f} rows/s)")
+
+    print(f"{table}: done, {converted} rows converted")
+
+
+def measure_table(conn, table, key, json_column, binary_column, rows):
+    sizes = conn.execute(
+        f"""
+            SELECT
+                pg_total_relation_size('"{table}"') AS total_bytes,
+                count(*) AS row_count,
+                avg(pg_column_size("{json_column}")) AS json_bytes,
+                avg(pg_column_size("{binary_column}")) AS binary_bytes,
+                count("{binary_column}") AS binary_rows
+            FROM "{table}"
+        """
+    ).fetchone()
+
+    print(
+        f"{table}: {sizes['total_bytes'] / 2**20:.1f} MiB for {sizes['row_count']} rows, "
+        f"{sizes['binary_rows']} binary; avg vector {sizes['json_bytes'] or 0:.0f} B as JSON, "
+        f"{sizes['binary_bytes'] or 0:.0f} B as binary"
+    )
+
+    for column, decode in ((json_column, lambda v: np.asarray(v, dtype=np.float32)), (binary_column, decode_vector)):
+        started = time.perf_counter()
+        with conn.cursor(name=f"measure_{table}_{column}") as cur:
+            cur.execute(
+                f'SELECT "{column}" AS vector FROM "{table}" WHERE "{column}" IS NOT NULL ORDER BY "{key}" LIMIT %s',
+                (rows,)
+            )
+            read = 0
+            for row in cur:
+                decode(row["vector"])
+                read += 1
+
+        elapsed = time.perf_counter() - started
+        if read:
+            print(f"  read {read} vectors from {column} in {elapsed * 1000:.0f} ms ({read / elapsed:.0f} vectors/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill or measure binary vector columns")
+    parser.add_argument("command", choices=["backfill", "measure"])
+    parser.add_argument("--batch", type=int, default=500, help="rows per committed batch")
+    parser.add_argument("--drop-json", action="store_true", help="clear the JSON column of converted rows")
+    parser.add_argument("--rows", type=int, default=5000, help="vectors read per column by measure")
+    args = parser.parse_args()
+
+    with psycopg.connect(DATABASE_URL, row_factory=dict_row, autocommit=True) as conn:
+        for target in TARGETS:
+            if args.command == "backfill":
+                backfill_table(conn, *target, args.batch, args.drop_json)
+            else:
+                with conn.transaction():
+                    measure_table(conn, *target, args.rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import asyncio
+import numpy as np
+from utils.logger import get_logger
+from utils.env import CENTROID_FLUSH_SECONDS, CENTROID_FLUSH_BATCH
+from services import db_clusters
+from services.cluster_index import cluster_index
+
+logger = get_logger("centroid_accumulator")
+
+
+class CentroidAccumulator:
+    """
+        Write-behind buffer for cluster centroid updates.
+
+        add() only adds the embedding to an in-memory running sum for its
+        cluster, so concurrent uploads to one cluster never wait on each other
+        or on the database. A flush runs every CENTROID_FLUSH_SECONDS, or sooner
+        once CENTROID_FLUSH_BATCH samples are waiting, and merges each cluster's
+        (sum, count) with one atomic UPDATE:
+
+            centroid = (centroid * sampleCount + sum) / (sampleCount + count)
+
+        The database does the read-modify-write under the row lock, so no update
+        is lost, whichever replica or request it came from.
+    """
+
+    def __init__(self, index=cluster_index, write=None,
+                 flush_seconds: float = CENTROID_FLUSH_SECONDS, flush_batch: int = CENTROID_FLUSH_BATCH):
+        self.index = index
+        self.write = write or db_clusters.merge_cluster_samples
+        self.flush_seconds = flush_seconds
+        self.flush_batch = max(1, flush_batch)
+
+        # cluster_id -> [sum vector, count], waiting for the next flush
+        self.pending = {}
+        # the same for the batch a running flush is writing
+        self.flushing = {}
+        self.pending_samples = 0
+
+        self.task = None
+        self.stopping = False
+        self.wake = asyncio.Event()
+        self.lock = asyncio.Lock()
+
+        self.samples = 0
+        self.flushes = 0
+        self.statements = 0
+        self.failures = 0
+
+        # Refreshed index rows get the not yet written samples applied on top
+        self.index.overlay = self.unflushed
+
+    def add(self, cluster_id: int, embedding):
+        vector = np.asarray(embedding, dtype=np.float64)
+
+        entry = self.pending.get(cluster_id)
+        if entry is None:
+            self.pending[cluster_id] = [vector.copy(), 1]
+        else:
+            entry[0] += vector
+            entry[1] += 1
+
+        self.pending_samples += 1
+        self.samples += 1
+        self.index.add_sample(cluster_id, vector)
+
+        if self.pending_samples >= self.flush_batch:
+            self.wake.set()
+
+    def unflushed(self, cluster_id: int):
+        """(sum, count) of the samples of cluster_id that aren't in the database yet."""
+        total, count = None, 0
+        for batch in (self.flushing, self.pending):
+            entry = batch.get(cluster_id)
+            if entry is not None:
+                total = entry[0] if total is None else total + entry[0]
+                count += entry[1]
+
+        return (total, count) if count else None
+
+    async def flush(self):
+        async with self.lock:
+            if not self.pending:
+                return
+
+            self.flushing, self.pending = self.pending, {}
+            self.pending_samples = 0
+            self.flushes += 1
+
+            try:
+                await asyncio.gather(*[self._merge(cluster_id) for cluster_id in list(self.flushing)])
+
+            except asyncio.CancelledError:
+                # What's still in flushing isn't known to be written, keep it for the next flush
+                for cluster_id, (total, count) in self.flushing.items():
+                    self._requeue(cluster_id, total, count)
+                self.flushing = {}
+                raise
+
+    async def _merge(self, cluster_id: int):
+        """
+            Writes one cluster of the running flush. It leaves flushing right after
+            its UPDATE commits, so an index refresh triggered by that commit's
+            NOTIFY doesn't apply the same samples again through the overlay.
+        """
+        total, count = self.flushing[cluster_id]
+        self.statements += 1
+
+        try:
+            await self.write(cluster_id, total, count)
+        except Exception as e:
+            # Keep the samples, they go out with the next flush
+            self.failures += 1
+            logger.error(f"Failed to merge {count} samples into cluster {cluster_id}: {e}")
+            self._requeue(cluster_id, total, count)
+
+        del self.flushing[cluster_id]
+
+    def _requeue(self, cluster_id: int, total, count: int):
+        entry = self.pending.setdefault(cluster_id, [np.zeros_like(total), 0])
+        entry[0] += total
+        entry[1] += count
+        self.pending_samples += count
+
+    async def _run(self):
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout=self.flush_seconds)
+            except TimeoutError:
+                pass
+            self.wake.clear()
+
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Centroid flush failed: {e}")
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run(), name="centroid-accumulator")
+
+    async def shutdown(self):
+        # Let a running flush finish instead of cancelling it halfway
+        if self.task is not None:
+            self.stopping = True
+            self.wake.set()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+        await self.flush()
+        if self.pending:
+            logger.error(f"Dropping {self.pending_samples} centroid samples that could not be written")
+
+    def stats(self):
+        return {
+            "pending_clusters": len(self.pending),
+            "pending_samples": self.pending_samples,
+            "samples": self.samples,
+            "flushes": self.flushes,
+            "statements": self.statements,
+            "failures": self.failures,
+            "flush_seconds": self.flush_seconds,
+            "flush_batch": self.flush_batch
+        }
+
+
+centroid_accumulator = CentroidAccumulator()
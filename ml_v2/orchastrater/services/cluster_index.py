@@ -0,0 +1,214 @@
+import asyncio
+import numpy as np
+from utils.logger import get_logger
+from utils import db
+from services import db_clusters
+from services.clustering import SIMILARITY_THRESHOLD
+
+logger = get_logger("cluster_index")
+
+# Full reload interval, catches anything a dropped LISTEN connection missed
+RESYNC_SECONDS = 60.0
+# Seconds to wait before reconnecting a dropped LISTEN connection
+RECONNECT_SECONDS = 5.0
+
+
+def normalize(vector: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+class ClusterIndex:
+    """
+        Process-resident copy of the Cluster table.
+
+        Unit-length float32 centroids sit in one contiguous matrix, so finding
+        the closest cluster is a single matrix-vector product plus argmax instead
+        of parsing every JSONB centroid on every request. The raw centroids and
+        sample counts are kept next to it for the running-mean update.
+
+        Writes through db_clusters update the index in place and NOTIFY
+        cluster_changed. Every replica LISTENs on that channel and reloads just
+        the changed row, with a periodic full reload as a fallback for
+        connections that can't LISTEN (e.g. behind pgbouncer).
+    """
+
+    def __init__(self):
+        self.ids = np.empty(0, dtype=np.int64)
+        self.unit = np.empty((0, 0), dtype=np.float32)
+        self.centroids = np.empty((0, 0), dtype=np.float32)
+        self.counts = np.empty(0, dtype=np.int64)
+        self.size = 0
+        self.rows = {}
+
+        # callable(cluster_id) -> (sum, count) of samples not written to the
+        # database yet, set by the centroid accumulator
+        self.overlay = None
+
+        self.tasks = []
+        self.notifications = 0
+        self.reloads = 0
+
+    def _reserve(self, dim: int, capacity: int):
+        if self.unit.shape[1] not in (0, dim):
+            raise ValueError(f"Centroid has {dim} dimensions, the index holds {self.unit.shape[1]}")
+
+        if capacity <= len(self.ids) and self.unit.shape[1] == dim:
+            return
+
+        # Grow by doubling so appends stay amortised O(dim)
+        capacity = max(capacity, 2 * len(self.ids), 16)
+        for name, shape, dtype in (
+            ("ids", (capacity,), np.int64),
+            ("counts", (capacity,), np.int64),
+            ("unit", (capacity, dim), np.float32),
+            ("centroids", (capacity, dim), np.float32)
+        ):
+            grown = np.zeros(shape, dtype=dtype)
+            if self.size:
+                grown[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, grown)
+
+    def replace_all(self, clusters: list):
+        self.size = 0
+        self.rows = {}
+        self.ids = np.empty(0, dtype=np.int64)
+
+        if clusters:
+            dim = len(clusters[0]["centroid"])
+            self.unit = np.empty((0, dim), dtype=np.float32)
+            self.centroids = np.empty((0, dim), dtype=np.float32)
+            self._reserve(dim, len(clusters))
+
+        for cluster in clusters:
+            self.load_row(cluster)
+
+        self.reloads += 1
+
+    def upsert(self, cluster_id: int, centroid, count: int):
+        vector = np.asarray(centroid, dtype=np.float32)
+        row = self.rows.get(cluster_id)
+
+        if row is None:
+            self._reserve(len(vector), self.size + 1)
+            row = self.size
+            self.size += 1
+            self.rows[cluster_id] = row
+            self.ids[row] = cluster_id
+
+        self.centroids[row] = vector
+        self.unit[row] = normalize(vector)
+        self.counts[row] = count
+
+    def load_row(self, cluster: dict):
+        """Indexes a row read from the database, plus whatever hasn't been flushed to it."""
+        centroid = np.asarray(cluster["centroid"], dtype=np.float64)
+        count = cluster["sampleCount"]
+
+        pending = self.overlay(cluster["id"]) if self.overlay is not None else None
+        if pending is not None:
+            total, extra = pending
+            centroid = (centroid * count + total) / (count + extra)
+            count += extra
+
+        self.upsert(cluster["id"], centroid, count)
+
+    def add_sample(self, cluster_id: int, embedding):
+        """Moves a centroid by one new sample: New = ((Old * Count) + New_sample) / Count+1"""
+        row = self.rows.get(cluster_id)
+        if row is None:
+            return
+
+        count = int(self.counts[row])
+        centroid = (self.centroids[row].astype(np.float64) * count + embedding) / (count + 1)
+
+        self.upsert(cluster_id, centroid, count + 1)
+
+    def get(self, cluster_id: int):
+        """Returns (centroid, sampleCount) of a cluster, or None if it isn't indexed."""
+        row = self.rows.get(cluster_id)
+        if row is None:
+            return None
+
+        return self.centroids[row], int(self.counts[row])
+
+    def search(self, embedding, threshold: float = SIMILARITY_THRESHOLD):
+        """
+            Same contract as clustering.find_best_cluster:
+            tuple(best_cluster_id, distance), (None, distance) when the closest
+            cluster is too far away and (None, None) when there are none.
+        """
+        if self.size == 0:
+            return None, None
+
+        query = normalize(np.asarray(embedding, dtype=np.float32))
+        similarities = self.unit[:self.size] @ query
+
+        best = int(np.argmax(similarities))
+        distance = float(1 - similarities[best])
+        cluster_id = int(self.ids[best])
+        logger.info(f"Closest cluster: ID {cluster_id} and Distance {distance:.4f}")
+
+        if distance < threshold:
+            return cluster_id, distance
+
+        return None, distance
+
+    async def reload(self):
+        clusters = await db_clusters.get_all_clusters()
+        self.replace_all(clusters)
+        logger.info(f"Loaded {self.size} clusters into the index")
+
+    async def refresh(self, cluster_id: int):
+        cluster = await db_clusters.get_cluster(cluster_id)
+        if cluster is not None:
+            self.load_row(cluster)
+
+    async def start(self):
+        await self.reload()
+        self.tasks = [
+            asyncio.create_task(self._listen(), name="cluster-index-listen"),
+            asyncio.create_task(self._resync(), name="cluster-index-resync")
+        ]
+
+    async def shutdown(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def _listen(self):
+        while True:
+            try:
+                async with await db.listen_connection(db_clusters.CHANNEL) as conn:
+                    # Anything changed while we weren't listening is picked up here
+                    await self.reload()
+                    async for notify in conn.notifies():
+                        self.notifications += 1
+                        await self.refresh(int(notify.payload))
+
+            except asyncio.CancelledError:
+                raise
+
+            except Exception as e:
+                logger.warning(f"Cluster LISTEN connection lost ({e}), retrying in {RECONNECT_SECONDS}s")
+                await asyncio.sleep(RECONNECT_SECONDS)
+
+    async def _resync(self):
+        while True:
+            await asyncio.sleep(RESYNC_SECONDS)
+            try:
+                await self.reload()
+            except Exception as e:
+                logger.warning(f"Cluster index resync failed: {e}")
+
+    def stats(self):
+        return {
+            "clusters": self.size,
+            "dimensions": self.unit.shape[1],
+            "notifications": self.notifications,
+            "reloads": self.reloads
+        }
+
+
+cluster_index = ClusterIndex()
@@ -1,39 +1,142 @@
 import json 
-from utils.db import excecute_query
+import numpy as np
+from utils.db import excecute_query, transaction
+from utils.env import VECTOR_STORAGE
 from utils.logger import get_logger
+from services.vector_codec import encode_vector, row_vector
 
 logger = get_logger("db_clusters")
 
-def get_all_clusters():
-    query = 'SELECT "id", "centroid", "sampleCount" FROM "Cluster";'
+# Every write NOTIFYs this channel with the cluster id, see cluster_index.py
+CHANNEL = "cluster_changed"
+
+# Rows come back with "centroid" as a float32 array, whichever column holds it
+CLUSTER_COLUMNS = '"id", "centroid", "centroidVec", "sampleCount"'
+
+def with_centroid(row):
+    if row is not None:
+        row["centroid"] = row_vector(row, "centroid", "centroidVec")
+    return row
+
+def centroid_params(centroid):
+    """(json, binary) column values for the configured VECTOR_STORAGE, the other one is NULL"""
+    if VECTOR_STORAGE == "bytea":
+        return None, encode_vector(centroid)
+
+    return json.dumps(np.asarray(centroid).tolist()), None
+
+async def get_all_clusters():
+    query = f'SELECT {CLUSTER_COLUMNS} FROM "Cluster" WHERE "centroid" IS NOT NULL OR "centroidVec" IS NOT NULL;'
     
-    return excecute_query(query, fetch_all=True)
+    return [with_centroid(row) for row in await excecute_query(query, fetch_all=True)]
+
+async def get_cluster(cluster_id: int):
+    query = f'SELECT {CLUSTER_COLUMNS} FROM "Cluster" WHERE "id" = %s;'
 
-def create_new_cluster(centroid: list):
+    return with_centroid(await excecute_query(query, (cluster_id,), fetch_one=True))
+
+async def create_new_cluster(centroid):
     
-    query = """
-        INSERT INTO "Cluster" ("centroid", "sampleCount","createdAt") VALUES (%s::jsonb, 1, NOW())
-        RETURNING id;
+    query = f"""
+        WITH created AS (
+            INSERT INTO "Cluster" ("centroid", "centroidVec", "sampleCount","createdAt") VALUES (%s::jsonb, %s, 1, NOW())
+            RETURNING id
+        )
+        SELECT id, pg_notify('{CHANNEL}', id::text) FROM created;
     """
     
-    centroid_json = json.dumps(centroid)
-    result = excecute_query(query, (centroid_json,), fetch_one=True)
+    result = await excecute_query(query, centroid_params(centroid), fetch_one=True)
     logger.info(f"Created a new cluster with id: {result['id']}")
     
     return result['id']    
 
-def update_cluster_centroid(cluster_id: int, new_centroid: list, new_count: int):
+async def update_cluster_centroid(cluster_id: int, new_centroid, new_count: int):
     
-    query = """
-        UPDATE "Cluster"
-        SET "centroid" = %s::jsonb, "sampleCount" = %s
-        WHERE "id" = %s;
+    query = f"""
+        WITH updated AS (
+            UPDATE "Cluster"
+            SET "centroid" = %s::jsonb, "centroidVec" = %s, "sampleCount" = %s
+            WHERE "id" = %s
+            RETURNING id
+        )
+        SELECT pg_notify('{CHANNEL}', id::text) FROM updated;
     """
     
-    centroid_json = json.dumps(new_centroid)
-    excecute_query(query, (centroid_json, new_count, cluster_id))
+    await excecute_query(query, (*centroid_params(new_centroid), new_count, cluster_id))
     
     logger.info(f"Updated cluster: {cluster_id} centroid with the new count: {new_count}")
-    
-    
-    
\ No newline at end of file
+
+async def merge_cluster_samples(cluster_id: int, sample_sum, sample_count: int):
+    """
+        Folds sample_count new samples, given as their element-wise sum, into a
+        cluster's running mean. Postgres computes the new centroid from the row it
+        has locked, so concurrent merges from any replica all land.
+
+        Only rows whose centroid is still JSON are merged in SQL. Rows that hold
+        "centroidVec" (written in bytea mode or converted by migrate_vectors.py)
+        go through the binary merge instead.
+    """
+    if VECTOR_STORAGE == "bytea":
+        return await merge_cluster_samples_binary(cluster_id, sample_sum, sample_count)
+
+    query = f"""
+        WITH updated AS (
+            UPDATE "Cluster" AS c
+            SET "centroid" = (
+                    SELECT jsonb_agg(
+                        (old.value::float8 * c."sampleCount" + new.value) / (c."sampleCount" + %(count)s)
+                        ORDER BY old.position
+                    )
+                    FROM jsonb_array_elements_text(c."centroid") WITH ORDINALITY AS old(value, position)
+                    JOIN unnest(%(sum)s::float8[]) WITH ORDINALITY AS new(value, position)
+                        ON old.position = new.position
+                ),
+                "centroidVec" = NULL,
+                "sampleCount" = c."sampleCount" + %(count)s
+            WHERE c."id" = %(id)s AND c."centroidVec" IS NULL
+            RETURNING c."id"
+        )
+        SELECT id, pg_notify('{CHANNEL}', id::text) FROM updated;
+    """
+
+    params = {
+        "id": cluster_id,
+        "count": sample_count,
+        "sum": np.asarray(sample_sum, dtype=np.float64).tolist()
+    }
+    if await excecute_query(query, params, fetch_one=True) is None:
+        # The centroid is binary (or the cluster is gone, which the binary merge logs)
+        return await merge_cluster_samples_binary(cluster_id, sample_sum, sample_count)
+
+    logger.info(f"Merged {sample_count} samples into cluster: {cluster_id}")
+
+async def merge_cluster_samples_binary(cluster_id: int, sample_sum, sample_count: int):
+    """
+        Same merge for binary centroids. Postgres can't do arithmetic on bytea, so
+        the row is locked with FOR UPDATE and the mean is computed here, inside
+        one transaction.
+    """
+    async with transaction() as cur:
+        await cur.execute(
+            f'SELECT {CLUSTER_COLUMNS} FROM "Cluster" WHERE "id" = %s FOR UPDATE;',
+            (cluster_id,)
+        )
+        row = with_centroid(await cur.fetchone())
+        if row is None:
+            logger.warning(f"Cluster {cluster_id} disappeared before {sample_count} samples were merged")
+            return
+
+        count = row["sampleCount"]
+        centroid = (row["centroid"].astype(np.float64) * count + sample_sum) / (count + sample_count)
+
+        await cur.execute(
+            """
+                UPDATE "Cluster"
+                SET "centroid" = NULL, "centroidVec" = %s, "sampleCount" = %s
+                WHERE "id" = %s;
+            """,
+            (encode_vector(centroid), count + sample_count, cluster_id)
+        )
+        await cur.execute(f"SELECT pg_notify('{CHANNEL}', %s);", (str(cluster_id),))
+
+    logger.info(f"Merged {sample_count} samples into cluster: {cluster_id}")
@@ -1,10 +1,13 @@
 import json
+import numpy as np
 from utils.db import excecute_query
+from utils.env import VECTOR_STORAGE
 from utils.logger import get_logger
+from services.vector_codec import encode_vector
 
 logger = get_logger("db_embeddings")
 
-def create_unknown_sample(
+async def create_unknown_sample(
     file_url: str,
     language_guess: str,
     confidence: str,
@@ -13,7 +16,7 @@ def create_unknown_sample(
     lat: float,
     lng: float,
     keywords: str,
-    embedding: list,
+    embedding,
     cluster_id: int = None
 ):
     """To insert into the unknown samples table"""
@@ -29,13 +32,17 @@ def create_unknown_sample(
             "lng",
             "keywords",
             "embedding",
+            "embeddingVec",
             "clusterId"
         ) 
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s::jsonb, %s)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s::jsonb, %s, %s)
         RETURNING id;
     """
     
-    embedding_json = json.dumps(embedding)
+    if VECTOR_STORAGE == "bytea":
+        embedding_json, embedding_vec = None, encode_vector(embedding)
+    else:
+        embedding_json, embedding_vec = json.dumps(np.asarray(embedding).tolist()), None
     
     params = (
         file_url,
@@ -47,15 +54,81 @@ def create_unknown_sample(
         lng,
         keywords,
         embedding_json,
+        embedding_vec,
         cluster_id,
     )
     
     try:
-        result = excecute_query(query,params,fetch_one=True)
+        result = await excecute_query(query,params,fetch_one=True)
         if result: 
             logger.info(f"Saved UnknownSample with id: {result['id']}")
             return result['id']
         
     except Exception as e:
         logger.error(f"Failed to save UnknownSample: {e}")
-        raise 
\ No newline at end of file
+        raise
+
+async def create_known_sample(
+    file_url: str,
+    language: str,
+    confidence: float,
+    transcript: str,
+    region: str,
+    lat: float,
+    lng: float,
+    keywords: str
+):
+    """To insert into the known samples table, these have no embedding or cluster"""
+
+    query = """
+        INSERT INTO "KnownSample"(
+            "fileUrl",
+            "language",
+            "confidence",
+            "transcript",
+            "region",
+            "lat",
+            "lng",
+            "keywords"
+        )
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        RETURNING id;
+    """
+
+    params = (
+        file_url,
+        language,
+        confidence,
+        transcript,
+        region,
+        lat,
+        lng,
+        keywords,
+    )
+
+    try:
+        result = await excecute_query(query,params,fetch_one=True)
+        if result:
+            logger.info(f"Saved KnownSample with id: {result['id']}")
+            return result['id']
+
+    except Exception as e:
+        logger.error(f"Failed to save KnownSample: {e}")
+        raise
+
+SAMPLE_TABLES = ("UnknownSample", "KnownSample")
+
+async def update_transcript(sample_id: int, transcript: str, table: str = "UnknownSample"):
+    """Fills in the transcript of a sample once the background transcription is done"""
+
+    if table not in SAMPLE_TABLES:
+        raise ValueError(f"Unknown sample table '{table}'")
+
+    query = f"""
+        UPDATE "{table}"
+        SET "transcript" = %s
+        WHERE "id" = %s;
+    """
+
+    await excecute_query(query, (transcript, sample_id))
+    logger.info(f"Updated transcript of {table} {sample_id}")
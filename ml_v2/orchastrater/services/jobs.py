@@ -0,0 +1,323 @@
+import asyncio
+import json
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+from utils.logger import get_logger
+from utils.env import JOB_DIR, JOB_WORKERS, JOB_MAX_ATTEMPTS, JOB_RETRY_BASE_SECONDS, JOB_RETRY_MAX_SECONDS
+
+from services import pipeline
+
+logger = get_logger("jobs")
+
+# Idle workers look for jobs at least this often, enqueue() wakes them up sooner
+POLL_SECONDS = 5.0
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        status TEXT NOT NULL,
+        filename TEXT NOT NULL,
+        upload_path TEXT NOT NULL,
+        region TEXT,
+        lat REAL,
+        lng REAL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        result TEXT,
+        checkpoint TEXT,
+        not_before REAL,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+"""
+
+FINISHED = ("succeeded", "failed")
+
+
+class JobQueue:
+    """
+        Durable ingest queue in a local SQLite file.
+
+        POST /process-audio stores the upload under JOB_DIR and inserts a queued
+        row. JOB_WORKERS tasks claim rows one at a time and run the regular
+        pipeline on them. A job that fails goes back to the queue until it used
+        up JOB_MAX_ATTEMPTS, waiting longer after every failed attempt (see
+        retry_delay()) so a dependency that is down isn't hammered. Jobs that
+        were running when the process died are queued again on start, so
+        nothing accepted is lost, unless that was their last attempt.
+
+        The pipeline stages with side effects record their result in the job's
+        checkpoint column. Retries pass it back, so they skip what's done.
+    """
+
+    def __init__(self, directory: str = JOB_DIR, workers: int = JOB_WORKERS, max_attempts: int = JOB_MAX_ATTEMPTS,
+                 retry_base_seconds: float = JOB_RETRY_BASE_SECONDS, retry_max_seconds: float = JOB_RETRY_MAX_SECONDS):
+        self.directory = Path(directory)
+        self.db_path = self.directory / "jobs.sqlite3"
+        self.workers = max(0, workers)
+        self.max_attempts = max(1, max_attempts)
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+
+        self.tasks = []
+        self.wake = None
+        # Long-polls waiting for a job, and how many of them share its event
+        self.finished = {}
+        self.waiters = {}
+
+    @contextmanager
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _setup(self):
+        (self.directory / "uploads").mkdir(parents=True, exist_ok=True)
+
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+            # Queue files written before these columns existed
+            columns = [row["name"] for row in conn.execute("PRAGMA table_info(jobs)")]
+            for column, definition in (("checkpoint", "TEXT"), ("not_before", "REAL")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+
+            now = time.time()
+            exhausted = conn.execute(
+                "SELECT upload_path FROM jobs WHERE status = 'running' AND attempts >= ?",
+                (self.max_attempts,)
+            ).fetchall()
+            conn.execute(
+                """
+                    UPDATE jobs SET status = 'failed', error = 'Interrupted by a restart on its last attempt', updated_at = ?
+                    WHERE status = 'running' AND attempts >= ?
+                """,
+                (now, self.max_attempts)
+            )
+            recovered = conn.execute(
+                "UPDATE jobs SET status = 'queued', updated_at = ? WHERE status = 'running'",
+                (now,)
+            ).rowcount
+
+        for row in exhausted:
+            Path(row["upload_path"]).unlink(missing_ok=True)
+
+        if exhausted:
+            logger.warning(f"Failed {len(exhausted)} jobs that were on their last attempt before the restart")
+        if recovered:
+            logger.info(f"Re-queued {recovered} jobs that were running before the restart")
+
+    async def start(self):
+        await asyncio.to_thread(self._setup)
+
+        self.wake = asyncio.Event()
+        self.tasks = [
+            asyncio.create_task(self._worker(i), name=f"job-worker-{i}") for i in range(self.workers)
+        ]
+        logger.info(f"Started {self.workers} job workers on {self.db_path}")
+
+    async def shutdown(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def _insert(self, job_id: str, audio_bytes: bytes, filename: str, region: str, lat: float, lng: float):
+        upload_path = self.directory / "uploads" / job_id
+        upload_path.write_bytes(audio_bytes)
+        now = time.time()
+
+        with self.connect() as conn:
+            conn.execute(
+                """
+                    INSERT INTO jobs (id, status, filename, upload_path, region, lat, lng, created_at, updated_at)
+                    VALUES (?, 'queued', ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (job_id, filename, str(upload_path), region, lat, lng, now, now)
+            )
+
+    async def enqueue(self, audio_bytes: bytes, filename: str, region: str, lat: float, lng: float) -> str:
+        job_id = uuid.uuid4().hex
+        await asyncio.to_thread(self._insert, job_id, audio_bytes, filename, region, lat, lng)
+        logger.info(f"Queued job {job_id} for {filename}")
+
+        if self.wake is not None:
+            self.wake.set()
+
+        return job_id
+
+    def _claim(self):
+        """
+            Moves the oldest queued job whose retry delay is over to running,
+            BEGIN IMMEDIATE keeps two claimers apart.
+        """
+        with self.connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    """
+                        SELECT * FROM jobs
+                        WHERE status = 'queued' AND (not_before IS NULL OR not_before <= ?)
+                        ORDER BY created_at LIMIT 1
+                    """,
+                    (time.time(),)
+                ).fetchone()
+
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                        (time.time(), row["id"])
+                    )
+                conn.execute("COMMIT")
+
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        return dict(row) if row is not None else None
+
+    def retry_delay(self, attempt: int) -> float:
+        """Seconds a job waits after its attempt-th failure, doubling up to retry_max_seconds."""
+        return min(self.retry_base_seconds * 2 ** (attempt - 1), self.retry_max_seconds)
+
+    def _finish(self, job: dict, status: str, result: dict = None, error: str = None, not_before: float = None):
+        with self.connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, not_before = ?, updated_at = ? WHERE id = ?",
+                (status, json.dumps(result) if result is not None else None, error, not_before, time.time(), job["id"])
+            )
+
+        if status in FINISHED:
+            Path(job["upload_path"]).unlink(missing_ok=True)
+
+    def _checkpoint(self, job_id: str, stage: str, value):
+        """Records one finished stage, json_set keeps concurrent stages from overwriting each other."""
+        with self.connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET checkpoint = json_set(COALESCE(checkpoint, '{}'), '$.' || ?, json(?)) WHERE id = ?",
+                (stage, json.dumps(value), job_id)
+            )
+
+    async def _run(self, job: dict):
+        attempt = job["attempts"] + 1
+        logger.info(f"Running job {job['id']} (attempt {attempt}/{self.max_attempts})")
+
+        try:
+            audio_bytes = await asyncio.to_thread(Path(job["upload_path"]).read_bytes)
+            result = await pipeline.process_upload(
+                audio_bytes,
+                job["filename"],
+                job["region"],
+                job["lat"],
+                job["lng"],
+                checkpoint=json.loads(job["checkpoint"]) if job["checkpoint"] else {},
+                on_checkpoint=lambda stage, value: asyncio.to_thread(self._checkpoint, job["id"], stage, value),
+                transcribe_inline=True
+            )
+            await asyncio.to_thread(self._finish, job, "succeeded", result)
+
+        except Exception as e:
+            while isinstance(e, ExceptionGroup):
+                e = e.exceptions[0]
+
+            if attempt >= self.max_attempts:
+                logger.error(f"Job {job['id']} attempt {attempt} failed, giving up: {e}")
+                await asyncio.to_thread(self._finish, job, "failed", None, str(e))
+            else:
+                delay = self.retry_delay(attempt)
+                logger.error(f"Job {job['id']} attempt {attempt} failed, retrying in {delay:.0f}s: {e}")
+                await asyncio.to_thread(self._finish, job, "queued", None, str(e), time.time() + delay)
+                return
+
+        event = self.finished.pop(job["id"], None)
+        if event is not None:
+            event.set()
+
+    async def _worker(self, index: int):
+        while True:
+            job = await asyncio.to_thread(self._claim)
+
+            if job is None:
+                self.wake.clear()
+                try:
+                    await asyncio.wait_for(self.wake.wait(), timeout=POLL_SECONDS)
+                except TimeoutError:
+                    pass
+                continue
+
+            await self._run(job)
+
+    def _get(self, job_id: str):
+        with self.connect() as conn:
+            row = conn.execute(
+                "SELECT id, status, filename, attempts, error, result, created_at, updated_at FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    async def get(self, job_id: str, wait: float = 0):
+        """
+            Returns the job, or None if it doesn't exist. With wait > 0 this long-polls:
+            it returns as soon as the job finished or after wait seconds.
+        """
+        if wait <= 0:
+            return await asyncio.to_thread(self._get, job_id)
+
+        # Registered before the first read so a job finishing in between still wakes us
+        event = self.finished.setdefault(job_id, asyncio.Event())
+        self.waiters[job_id] = self.waiters.get(job_id, 0) + 1
+
+        try:
+            job = await asyncio.to_thread(self._get, job_id)
+            if job is None or job["status"] in FINISHED:
+                return job
+
+            try:
+                await asyncio.wait_for(event.wait(), timeout=wait)
+            except TimeoutError:
+                pass
+
+            return await asyncio.to_thread(self._get, job_id)
+
+        finally:
+            # The last waiter to leave drops the event, finished or not, so timed out polls don't pile up
+            self.waiters[job_id] -= 1
+            if not self.waiters[job_id]:
+                del self.waiters[job_id]
+                if self.finished.get(job_id) is event:
+                    del self.finished[job_id]
+
+    def _counts(self):
+        with self.connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+
+        return {row["status"]: row["n"] for row in rows}
+
+    async def stats(self):
+        counts = await asyncio.to_thread(self._counts)
+
+        return {
+            "workers": self.workers,
+            "max_attempts": self.max_attempts,
+            "backlog": counts.get("queued", 0) + counts.get("running", 0),
+            "by_status": counts
+        }
+
+
+job_queue = JobQueue()
@@ -0,0 +1,245 @@
+import asyncio
+import time
+
+from utils.logger import get_logger
+from utils.env import KNOWN_LANGUAGE_THRESHOLD, KNOWN_LANGUAGES
+
+from services import whisper_utils
+from services import remote_encoder
+from services import db_embeddings
+from services import db_clusters
+from services import supabase
+from services.cluster_index import cluster_index
+from services.centroid_accumulator import centroid_accumulator
+from services.transcripts import transcript_queue
+
+logger = get_logger("pipeline")
+
+routing_stats = {"known": 0, "unknown": 0, "encoder_calls_cancelled": 0}
+
+
+class StageTimings:
+    """Wall time of every pipeline stage in ms, returned with the response."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    async def run(self, name: str, awaitable):
+        started = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.stages[name] = round((time.perf_counter() - started) * 1000, 1)
+
+    def as_dict(self):
+        return {**self.stages, "total": round((time.perf_counter() - self.started) * 1000, 1)}
+
+
+async def assign_cluster(embedding):
+    """
+        Joins the closest cluster and moves its centroid, or starts a new cluster.
+        The lookup runs against the in-memory cluster index. Centroid moves are
+        buffered by the accumulator, only new clusters are written right away.
+
+        output:
+            tuple(final_cluster_id, is_new_cluster)
+    """
+    best_cluster_id, distance = cluster_index.search(embedding)
+
+    if best_cluster_id is None:
+        logger.info("No matching cluster found, Creating new Cluster")
+        cluster_id = await db_clusters.create_new_cluster(embedding)
+        cluster_index.upsert(cluster_id, embedding, 1)
+        return cluster_id, True
+
+    logger.info(f"Joining Cluster {best_cluster_id} (Distance:{distance:.4f})")
+    centroid_accumulator.add(best_cluster_id, embedding)
+
+    return best_cluster_id, False
+
+
+def is_known_language(language: dict) -> bool:
+    if KNOWN_LANGUAGES and language["language"] not in KNOWN_LANGUAGES:
+        return False
+
+    return language["probability"] >= KNOWN_LANGUAGE_THRESHOLD
+
+
+def stats():
+    return dict(routing_stats)
+
+
+async def process_upload(
+    audio_bytes: bytes,
+    filename: str,
+    region: str,
+    lat: float,
+    lng: float,
+    checkpoint: dict = None,
+    on_checkpoint=None,
+    transcribe_inline: bool = False
+):
+    """
+        Runs the ingest pipeline as a stage graph:
+
+            upload -----------------------------------------------.
+            decode --+-- language ID --+-- (known) ---------------+-- save sample -- (transcribe)
+                     '-- encode -------+-- (unknown) -- cluster --'
+
+        Stages on the same row run one after the other, everything else overlaps.
+        Blocking stages run on threads, DB stages on the async connection pool. The stages share a TaskGroup, so a failing
+        stage or a cancelled request cancels the rest.
+
+        The encoder call starts speculatively next to language ID. Clips whose
+        language clears the KNOWN_LANGUAGE_THRESHOLD gate cancel it and are saved
+        as KnownSample, they never touch the clusters. It runs outside the
+        TaskGroup, so an encoder failure only fails clips that need the
+        embedding. Routing only needs the
+        language, so the response goes out once the sample is saved and the full
+        transcript is written afterwards by the transcript queue. Job workers
+        pass transcribe_inline, they aren't holding a request open, so the job
+        only succeeds once the transcript is written.
+
+        The stages with side effects (upload, cluster, save) record their result
+        in checkpoint and report it through on_checkpoint(stage, value). A retry
+        that passes the recorded checkpoint back skips them, so it doesn't upload
+        the file, move a centroid or insert the sample a second time, or
+        transcribe it again.
+    """
+    timings = StageTimings()
+    checkpoint = checkpoint if checkpoint is not None else {}
+
+    async def reached(stage: str, value):
+        checkpoint[stage] = value
+        if on_checkpoint is not None:
+            await on_checkpoint(stage, value)
+
+    async def upload_audio():
+        if "file_url" in checkpoint:
+            return checkpoint["file_url"]
+
+        public_url = await timings.run(
+            "upload",
+            asyncio.to_thread(supabase.upload_audio_file, audio_bytes, filename)
+        )
+        await reached("file_url", public_url)
+        return public_url
+
+    async def identify_and_encode():
+        audio = await timings.run(
+            "decode",
+            asyncio.to_thread(whisper_utils.decode_audio_bytes, audio_bytes)
+        )
+
+        # Not in a TaskGroup: a failing encoder must not take language ID down
+        # with it, known languages never need the embedding
+        encoding = asyncio.create_task(
+            timings.run("encode", remote_encoder.get_pcm_embedding(audio))
+        )
+        try:
+            language = await timings.run("language_id", whisper_utils.identify_language_async(audio))
+        except BaseException:
+            encoding.cancel()
+            raise
+
+        if is_known_language(language):
+            if encoding.cancel():
+                routing_stats["encoder_calls_cancelled"] += 1
+            elif not encoding.cancelled() and encoding.exception() is not None:
+                logger.warning(f"Encoder call failed, not needed for a known language: {encoding.exception()}")
+            return audio, language, None
+
+        embedding = await encoding
+        if embedding is None or len(embedding) == 0:
+            raise ValueError("Failed to generate embedding")
+
+        if "cluster" in checkpoint:
+            cluster = tuple(checkpoint["cluster"])
+        else:
+            cluster = await timings.run("cluster", assign_cluster(embedding))
+            await reached("cluster", list(cluster))
+
+        return audio, language, (embedding, cluster)
+
+    async with asyncio.TaskGroup() as stages:
+        upload = stages.create_task(upload_audio())
+        analysis = stages.create_task(identify_and_encode())
+
+    audio, language, clustered = analysis.result()
+    public_url = upload.result()
+
+    detected_language = language["language"]
+    confidence = language["probability"]
+    logger.info(f"Whisper results: language:{detected_language} with confidence:{confidence}")
+
+    sample_id = checkpoint.get("sample_id")
+
+    if clustered is None:
+        routing_stats["known"] += 1
+        table = "KnownSample"
+        final_cluster_id, is_new_cluster = None, False
+
+        if sample_id is None:
+            sample_id = await timings.run("save", db_embeddings.create_known_sample(
+                file_url=public_url,
+                language=detected_language,
+                confidence=confidence,
+                transcript="",
+                region=region,
+                lat=lat,
+                lng=lng,
+                keywords=""
+            ))
+
+    else:
+        routing_stats["unknown"] += 1
+        table = "UnknownSample"
+        embedding, (final_cluster_id, is_new_cluster) = clustered
+
+        if sample_id is None:
+            sample_id = await timings.run("save", db_embeddings.create_unknown_sample(
+                file_url=public_url,
+                language_guess=detected_language,
+                confidence=confidence,
+                transcript="",
+                region=region,
+                lat=lat,
+                lng=lng,
+                keywords="",
+                embedding=embedding,
+                cluster_id=final_cluster_id
+            ))
+
+    if "sample_id" not in checkpoint:
+        await reached("sample_id", sample_id)
+
+    if not transcribe_inline:
+        await timings.run("enqueue_transcript", transcript_queue.enqueue(sample_id, audio_bytes, filename, table))
+        transcript, transcript_status = None, "pending"
+
+    elif "transcript" in checkpoint:
+        transcript, transcript_status = checkpoint["transcript"], "done"
+
+    else:
+        transcription = await timings.run("transcribe", whisper_utils.transcribe_audio_async(audio))
+        transcript, transcript_status = transcription["text"], "done"
+        await db_embeddings.update_transcript(sample_id, transcript, table)
+        await reached("transcript", transcript)
+
+    stage_timings = timings.as_dict()
+    logger.info(f"Processed {filename} as {table} in {stage_timings['total']}ms: {stage_timings}")
+
+    return {
+        "status": "success",
+        "sample_id": sample_id,
+        "sample_type": "known" if clustered is None else "unknown",
+        "transcript": transcript,
+        "transcript_status": transcript_status,
+        "detected_language": detected_language,
+        "confidence": confidence,
+        "assigned_cluster_id": final_cluster_id,
+        "is_new_cluster": is_new_cluster,
+        "file_url": public_url,
+        "timings_ms": stage_timings
+    }
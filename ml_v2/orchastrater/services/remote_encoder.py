@@ -1,38 +1,242 @@
+import asyncio
+import io
+import random
+import time
+from collections import deque
 import httpx
-import requests
-import os
+import numpy as np
 from utils.logger import get_logger
-from utils.env import ENCODER_URL
+from services.vector_codec import decode_vector
+from utils.env import (
+    ENCODER_URL,
+    ENCODER_RESPONSE_FORMAT,
+    ENCODER_PCM_FORMAT,
+    ENCODER_TIMEOUT,
+    ENCODER_MAX_CONNECTIONS,
+    ENCODER_RETRIES,
+    ENCODER_HEDGE
+)
 
 logger = get_logger(__name__)
 
-async def get_audio_embedding(file_path: str):
+# Backoff between retries is drawn from [0, RETRY_BASE_DELAY * 2^attempt], capped.
+# A longer Retry-After from the encoder is honoured as long as it fits the call's ENCODER_TIMEOUT
+RETRY_BASE_DELAY = 0.1
+RETRY_MAX_DELAY = 2.0
+# Hedging waits for this many calls before trusting the p95, and never fires sooner
+LATENCY_WINDOW = 200
+MIN_HEDGE_SAMPLES = 20
+MIN_HEDGE_DELAY = 0.05
+
+def decode_embedding_response(response: httpx.Response) -> np.ndarray:
     """
-    Sends an audio file to the Encoder service and returns the vector.
+    Turns an encoder response into a float32 numpy vector.
+
+    Binary bodies are read with np.frombuffer, so no Python float objects are
+    created on the way.
     """
-    
-    url = f"{ENCODER_URL}/vectorize"
+    content_type = response.headers.get("content-type", "").split(";")[0].strip()
+    body = response.content
 
-    if not os.path.exists(file_path):
-        raise FileNotFoundError(f"AudioFIle not found at:{file_path}")
+    if content_type.startswith("application/x-embedding-"):
+        return decode_vector(body)
 
-    logger.info(f"Sending {file_path} to Encoder service at {url}...")
+    if content_type == "application/x-npy":
+        return np.load(io.BytesIO(body), allow_pickle=False).astype(np.float32, copy=False)
 
-    try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            with open(file_path,"rb") as f:
-                files = {"file": f}
-                response = await client.post(url, files=files)
+    data = response.json()
+    if "embedding" not in data:
+        raise KeyError("embedding")
+
+    return np.asarray(data["embedding"], dtype=np.float32)
+
+class EncoderClient:
+    """
+        One httpx.AsyncClient for the lifetime of the app, so encoder calls reuse
+        keep-alive connections instead of paying TCP setup every time.
+
+        Connect errors and 5xx responses are retried up to ENCODER_RETRIES times
+        with full-jitter exponential backoff, or after the Retry-After the encoder
+        sent. A call that would have to wait past ENCODER_TIMEOUT fails right away. With ENCODER_HEDGE on, a second copy
+        of a request is sent once the first has taken longer than the p95 of recent
+        calls, and whichever answers first wins. /vectorize is idempotent, so a
+        duplicate only costs encoder time.
+    """
+
+    def __init__(self):
+        self.client = None
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+        self.requests = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failures = 0
+
+    def start(self):
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                timeout=httpx.Timeout(ENCODER_TIMEOUT, connect=5.0),
+                limits=httpx.Limits(
+                    max_connections=ENCODER_MAX_CONNECTIONS,
+                    max_keepalive_connections=ENCODER_MAX_CONNECTIONS,
+                    keepalive_expiry=60.0
+                )
+            )
+
+        return self.client
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def hedge_delay(self):
+        """p95 of the recent successful calls, None until there is enough history."""
+        if len(self.latencies) < MIN_HEDGE_SAMPLES:
+            return None
+
+        ordered = sorted(self.latencies)
+        return max(ordered[int(len(ordered) * 0.95) - 1], MIN_HEDGE_DELAY)
+
+    async def _attempt(self, url: str, request_args: dict):
+        client = self.start()
+        deadline = time.monotonic() + ENCODER_TIMEOUT
+
+        for attempt in range(ENCODER_RETRIES + 1):
+            try:
+                response = await client.post(url, **request_args)
+                if response.status_code < 500 or attempt == ENCODER_RETRIES:
+                    response.raise_for_status()
+                    return response
+
+                retry_after = response.headers.get("retry-after")
+                remaining = deadline - time.monotonic()
+                if retry_after and retry_after.isdigit() and float(retry_after) > remaining:
+                    logger.warning(
+                        f"Encoder answered {response.status_code} and asked to retry in {retry_after}s, "
+                        f"only {max(remaining, 0):.1f}s left"
+                    )
+                    response.raise_for_status()
+
+                logger.warning(f"Encoder answered {response.status_code}, retrying")
+
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError) as e:
+                if attempt == ENCODER_RETRIES:
+                    raise
+                logger.warning(f"Could not reach Encoder ({e}), retrying")
+                retry_after = None
+
+            self.retries += 1
+            delay = min(random.uniform(0, RETRY_BASE_DELAY * 2 ** attempt), RETRY_MAX_DELAY)
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            await asyncio.sleep(delay)
+
+    async def post(self, url: str, **request_args):
+        self.requests += 1
+        started = time.perf_counter()
+
+        try:
+            delay = self.hedge_delay() if ENCODER_HEDGE else None
+            if delay is None:
+                response = await self._attempt(url, request_args)
+            else:
+                response = await self._hedged(url, request_args, delay)
+
+        except Exception:
+            self.failures += 1
+            raise
 
-        response.raise_for_status()
-        data = response.json()
+        self.latencies.append(time.perf_counter() - started)
+        return response
 
-        return data["embedding"]
+    async def _hedged(self, url: str, request_args: dict, delay: float):
+        primary = asyncio.create_task(self._attempt(url, request_args))
+        attempts = [primary]
 
-    except requests.exceptions.RequestException as e:
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=delay)
+            if not done:
+                self.hedges += 1
+                logger.info(f"Encoder call slower than {delay * 1000:.0f}ms, sending a hedged request")
+                attempts.append(asyncio.create_task(self._attempt(url, request_args)))
+
+            # First successful answer wins, an error only counts once both failed
+            pending = set(attempts)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        return task.result()
+
+            return primary.result()
+
+        finally:
+            for task in attempts:
+                task.cancel()
+
+    def stats(self):
+        delay = self.hedge_delay()
+
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "failures": self.failures,
+            "hedging": ENCODER_HEDGE,
+            "hedged_requests": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "p95_ms": round(delay * 1000, 1) if delay is not None else None
+        }
+
+encoder_client = EncoderClient()
+
+async def post_to_encoder(url: str, **request_args):
+    headers = {"Accept": ENCODER_RESPONSE_FORMAT, **request_args.pop("headers", {})}
+
+    try:
+        response = await encoder_client.post(url, headers=headers, **request_args)
+
+        return decode_embedding_response(response)
+
+    except httpx.HTTPError as e:
         logger.error(f"Failed to contact Encoder service: {e}")
         raise
 
     except KeyError:
-        logger.error(f"Encoder response did not contain 'embedding' field. Response: {data}")
-        raise ValueError("Invalid response format from Encoder")
\ No newline at end of file
+        logger.error(f"Encoder response did not contain 'embedding' field. Response: {response.text[:200]}")
+        raise ValueError("Invalid response format from Encoder")
+
+async def get_audio_embedding(audio_bytes: bytes, filename: str = "audio.wav"):
+    """
+    Sends the raw bytes of an audio file to the Encoder service and returns the vector.
+    """
+    
+    url = f"{ENCODER_URL}/vectorize"
+
+    logger.info(f"Sending {filename} ({len(audio_bytes)} bytes) to Encoder service at {url}...")
+
+    return await post_to_encoder(url, files={"file": (filename, audio_bytes)})
+
+async def get_pcm_embedding(audio: np.ndarray):
+    """
+    Sends audio that was already decoded to 16 kHz mono float32 to the Encoder,
+    so it doesn't have to decode and resample the original file again.
+    """
+    
+    url = f"{ENCODER_URL}/vectorize/pcm"
+
+    if ENCODER_PCM_FORMAT == "s16":
+        body = (np.clip(audio, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+    else:
+        body = np.asarray(audio, dtype="<f4").tobytes()
+
+    logger.info(f"Sending {len(audio) / 16000:.1f}s of {ENCODER_PCM_FORMAT} PCM to Encoder service at {url}...")
+
+    return await post_to_encoder(
+        url,
+        content=body,
+        headers={"Content-Type": f"application/x-pcm-{ENCODER_PCM_FORMAT}"}
+    )
@@ -13,7 +13,7 @@ supabase: Client = create_client(
     options=ClientOptions(storage_client_timeout=60)
 )
 
-def upload_audio_file(file_path: str, original_filename: str) -> str:
+def upload_audio_file(audio_bytes: bytes, original_filename: str) -> str:
     try:
         # Check if the file is an audio file
         content_type, _ = mimetypes.guess_type(original_filename)
@@ -25,13 +25,12 @@ def upload_audio_file(file_path: str, original_filename: str) -> str:
 
         logger.info(f"Uploading {unique_name} to Supabase bucket '{SUPABASE_BUCKET}'...")
 
-        # Upload the file using the Supabase client
-        with open(file_path, "rb") as f:
-            response = supabase.storage.from_(SUPABASE_BUCKET).upload(
-                path=unique_name,
-                file=f,
-                file_options={"x-upsert": "false", "content-type": content_type}
-            )
+        # Upload the bytes using the Supabase client
+        response = supabase.storage.from_(SUPABASE_BUCKET).upload(
+            path=unique_name,
+            file=audio_bytes,
+            file_options={"x-upsert": "false", "content-type": content_type}
+        )
 
         # The key for the uploaded object is in the response JSON
         logger.info(f"Supabase upload response: {response}")
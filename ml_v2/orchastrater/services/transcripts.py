@@ -0,0 +1,233 @@
+import asyncio
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+from utils.logger import get_logger
+from utils.env import JOB_DIR, JOB_MAX_ATTEMPTS, TRANSCRIBE_WORKERS, TRANSCRIBE_DRAIN_SECONDS
+
+from services import whisper_utils
+from services import db_embeddings
+
+logger = get_logger("transcripts")
+
+# Idle workers look for work at least this often, enqueue() wakes them up sooner
+POLL_SECONDS = 5.0
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS transcripts (
+        id TEXT PRIMARY KEY,
+        status TEXT NOT NULL,
+        sample_id INTEGER NOT NULL,
+        sample_table TEXT NOT NULL,
+        filename TEXT NOT NULL,
+        audio_path TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS transcripts_status ON transcripts (status, created_at);
+"""
+
+
+class TranscriptQueue:
+    """
+        Durable queue of the transcriptions that run after a sample was saved.
+
+        enqueue() stores the upload's bytes under JOB_DIR/transcripts and inserts
+        a queued row in a local SQLite file, so the pending work outlives the
+        process. TRANSCRIBE_WORKERS tasks decode and transcribe one entry at a
+        time, which bounds the decoded audio held in memory however many uploads
+        are waiting. A failed transcription is tried again until it used up
+        JOB_MAX_ATTEMPTS.
+
+        shutdown() stops claiming new entries and lets the running ones finish
+        for up to TRANSCRIBE_DRAIN_SECONDS. Anything left, running or queued, is
+        picked up again on the next start.
+    """
+
+    def __init__(self, directory: str = JOB_DIR, workers: int = TRANSCRIBE_WORKERS,
+                 max_attempts: int = JOB_MAX_ATTEMPTS, drain_seconds: float = TRANSCRIBE_DRAIN_SECONDS):
+        self.directory = Path(directory)
+        self.db_path = self.directory / "transcripts.sqlite3"
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self.drain_seconds = drain_seconds
+
+        self.tasks = []
+        self.wake = None
+        self.stopping = False
+
+        self.completed = 0
+        self.failed = 0
+
+    @contextmanager
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _setup(self):
+        (self.directory / "transcripts").mkdir(parents=True, exist_ok=True)
+
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            recovered = conn.execute(
+                "UPDATE transcripts SET status = 'queued', updated_at = ? WHERE status = 'running'",
+                (time.time(),)
+            ).rowcount
+            pending = conn.execute("SELECT COUNT(*) FROM transcripts WHERE status = 'queued'").fetchone()[0]
+
+        if recovered:
+            logger.info(f"Re-queued {recovered} transcriptions that were running before the restart")
+        if pending:
+            logger.info(f"Resuming {pending} pending transcriptions")
+
+    async def start(self):
+        await asyncio.to_thread(self._setup)
+
+        self.stopping = False
+        self.wake = asyncio.Event()
+        self.tasks = [
+            asyncio.create_task(self._worker(i), name=f"transcript-worker-{i}") for i in range(self.workers)
+        ]
+        logger.info(f"Started {self.workers} transcription workers on {self.db_path}")
+
+    async def shutdown(self):
+        """Lets running transcriptions finish for up to drain_seconds, the rest resumes on the next start."""
+        if not self.tasks:
+            return
+
+        self.stopping = True
+        self.wake.set()
+
+        _, running = await asyncio.wait(self.tasks, timeout=self.drain_seconds)
+        if running:
+            logger.warning(f"{len(running)} transcriptions still running after {self.drain_seconds}s, resuming them on the next start")
+            for task in running:
+                task.cancel()
+
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def _insert(self, entry_id: str, audio_bytes: bytes, sample_id: int, filename: str, table: str):
+        audio_path = self.directory / "transcripts" / entry_id
+        audio_path.write_bytes(audio_bytes)
+        now = time.time()
+
+        with self.connect() as conn:
+            conn.execute(
+                """
+                    INSERT INTO transcripts (id, status, sample_id, sample_table, filename, audio_path, created_at, updated_at)
+                    VALUES (?, 'queued', ?, ?, ?, ?, ?, ?)
+                """,
+                (entry_id, sample_id, table, filename, str(audio_path), now, now)
+            )
+
+    async def enqueue(self, sample_id: int, audio_bytes: bytes, filename: str, table: str) -> str:
+        """Queues the transcription of a saved sample, audio_bytes is the upload as received."""
+        entry_id = uuid.uuid4().hex
+        await asyncio.to_thread(self._insert, entry_id, audio_bytes, sample_id, filename, table)
+
+        if self.wake is not None:
+            self.wake.set()
+
+        return entry_id
+
+    def _claim(self):
+        """Moves the oldest queued entry to running, BEGIN IMMEDIATE keeps two claimers apart."""
+        with self.connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT * FROM transcripts WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+
+                if row is not None:
+                    conn.execute(
+                        "UPDATE transcripts SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                        (time.time(), row["id"])
+                    )
+                conn.execute("COMMIT")
+
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        return dict(row) if row is not None else None
+
+    def _finish(self, entry: dict, status: str, error: str = None):
+        with self.connect() as conn:
+            if status == "done":
+                conn.execute("DELETE FROM transcripts WHERE id = ?", (entry["id"],))
+            else:
+                conn.execute(
+                    "UPDATE transcripts SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                    (status, error, time.time(), entry["id"])
+                )
+
+        if status in ("done", "failed"):
+            Path(entry["audio_path"]).unlink(missing_ok=True)
+
+    async def _run(self, entry: dict):
+        attempt = entry["attempts"] + 1
+        table, sample_id = entry["sample_table"], entry["sample_id"]
+
+        try:
+            started = time.perf_counter()
+            audio_bytes = await asyncio.to_thread(Path(entry["audio_path"]).read_bytes)
+            audio = await asyncio.to_thread(whisper_utils.decode_audio_bytes, audio_bytes)
+            transcription = await whisper_utils.transcribe_audio_async(audio)
+            await db_embeddings.update_transcript(sample_id, transcription["text"], table)
+
+            await asyncio.to_thread(self._finish, entry, "done")
+            self.completed += 1
+            logger.info(f"Transcribed {entry['filename']} for {table} {sample_id} in {time.perf_counter() - started:.2f}s")
+
+        except Exception as e:
+            status = "failed" if attempt >= self.max_attempts else "queued"
+            if status == "failed":
+                self.failed += 1
+            logger.error(f"Transcription of {table} {sample_id} attempt {attempt} failed, {status}: {e}")
+            await asyncio.to_thread(self._finish, entry, status, str(e))
+
+    async def _worker(self, index: int):
+        while not self.stopping:
+            entry = await asyncio.to_thread(self._claim)
+
+            if entry is None:
+                self.wake.clear()
+                try:
+                    await asyncio.wait_for(self.wake.wait(), timeout=POLL_SECONDS)
+                except TimeoutError:
+                    pass
+                continue
+
+            await self._run(entry)
+
+    def _counts(self):
+        with self.connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM transcripts GROUP BY status").fetchall()
+
+        return {row["status"]: row["n"] for row in rows}
+
+    async def stats(self):
+        counts = await asyncio.to_thread(self._counts)
+
+        return {
+            "workers": self.workers,
+            "backlog": counts.get("queued", 0) + counts.get("running", 0),
+            "by_status": counts,
+            "completed": self.completed,
+            "failed": self.failed
+        }
+
+
+transcript_queue = TranscriptQueue()
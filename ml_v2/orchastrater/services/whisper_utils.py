@@ -1,32 +1,59 @@
-from faster_whisper import WhisperModel
+from faster_whisper import WhisperModel, decode_audio
 from utils.logger import get_logger
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import io
+import itertools
 import os
+import time
 
 logger = get_logger("whisper-app")
 
 MODEL_SIZE = os.getenv("WHISPER_MODEL_SIZE","small")
 DEVICE = "cpu"
 COMPUTE_TYPE = "int8"
+SAMPLE_RATE = 16000
+
+# CTranslate2 threads per model instance and decoding workers inside each one
+WHISPER_CPU_THREADS = int(os.getenv("WHISPER_CPU_THREADS", "4"))
+WHISPER_NUM_WORKERS = int(os.getenv("WHISPER_NUM_WORKERS", "1"))
+# Model instances in the pool, 0 means as many as the cores can feed
+WHISPER_POOL_SIZE = int(os.getenv("WHISPER_POOL_SIZE", "0"))
+
+def load_whisper_model():
+    logger.info(f"Loading whisper model '{MODEL_SIZE}' on {DEVICE}")
+    model = WhisperModel(
+        MODEL_SIZE,
+        device=DEVICE,
+        compute_type=COMPUTE_TYPE,
+        cpu_threads=WHISPER_CPU_THREADS,
+        num_workers=WHISPER_NUM_WORKERS
+    )
+    logger.info(f"Loaded whisper model successfully")
+    return model
 
 class WhisperService:
-    _instance = None 
-    
+    _instance = None
+
     @classmethod
     def get_instance(cls):
-        
+
         if cls._instance is None:
-            logger.info(f"Loading whisper model '{MODEL_SIZE}' on {DEVICE}")
-            cls._instance = WhisperModel(MODEL_SIZE,device=DEVICE,compute_type=COMPUTE_TYPE)
-            logger.info(f"Loaded whisper model successfully")
+            cls._instance = load_whisper_model()
         return cls._instance
 
-def transcribe_audio(file_path: str):
-    model = WhisperService.get_instance()
+def decode_audio_bytes(audio_bytes: bytes):
+    """
+        Decodes an upload once into 16 kHz mono float32, the format both Whisper
+        and the encoder's /vectorize/pcm route take.
+    """
+    return decode_audio(io.BytesIO(audio_bytes), sampling_rate=SAMPLE_RATE)
 
+def transcribe_with(model, audio):
     try:
 
         segments, info = model.transcribe(
-            file_path,
+            audio,
             beam_size = 5,
             vad_filter = True,
             vad_parameters = dict(min_silence_duration_ms = 500)
@@ -43,8 +70,143 @@ def transcribe_audio(file_path: str):
         logger.info(f"Transcribed audio successfully: {info.language} ({info.language_probability:.2f})")
 
         return result
-    
+
     except Exception as e:
         logger.error(f"Failed to transcribe audio: {e}")
         raise
 
+def identify_language(model, audio):
+    """
+        Language ID only: one pass of the encoder over the first 30 s window, no
+        decoding. Returns the same language / probability keys as transcribe_with.
+    """
+    try:
+        language, probability, _ = model.detect_language(audio[: 30 * SAMPLE_RATE])
+
+        logger.info(f"Identified language: {language} ({probability:.2f})")
+
+        return {
+            "language" : language,
+            "probability" : probability
+        }
+
+    except Exception as e:
+        logger.error(f"Failed to identify language: {e}")
+        raise
+
+def transcribe_audio(audio):
+    """
+        audio can be a path, a file-like object or a float32 16 kHz numpy array,
+        faster-whisper decodes the first two itself.
+    """
+    return transcribe_with(WhisperService.get_instance(), audio)
+
+class WhisperPool:
+    """
+        N WhisperModel instances, each owned by one worker task with its own
+        thread, fed from a shared asyncio queue. Queue wait and service time are
+        tracked separately: a growing wait with a flat service time means the
+        pool is too small, a growing service time means the cores are
+        oversubscribed.
+
+        Jobs with a lower priority number are served first, so language ID for a
+        waiting request overtakes background transcriptions.
+    """
+
+    def __init__(self, size: int = WHISPER_POOL_SIZE):
+        self.size = size if size > 0 else max(1, (os.cpu_count() or 1) // WHISPER_CPU_THREADS)
+        self.queue = None
+        self.workers = []
+        self.sequence = itertools.count()
+
+        self.completed = 0
+        self.failed = 0
+        self.busy = 0
+        # Exponential moving averages in seconds
+        self.avg_wait_time = 0.0
+        self.avg_service_time = 0.0
+
+    def start(self):
+        if self.queue is not None:
+            return
+
+        logger.info(f"Starting {self.size} whisper workers with {WHISPER_CPU_THREADS} cpu threads each")
+        self.queue = asyncio.PriorityQueue()
+        self.workers = [
+            asyncio.create_task(self._worker(i), name=f"whisper-{i}") for i in range(self.size)
+        ]
+
+    async def _worker(self, index: int):
+        # One thread per model keeps each instance on its own CTranslate2 context
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"whisper-{index}")
+        loop = asyncio.get_running_loop()
+        model = None
+
+        try:
+            while True:
+                _, _, job, audio, future, enqueued_at = await self.queue.get()
+                if future.cancelled():
+                    continue
+
+                started = time.perf_counter()
+                self.avg_wait_time = 0.8 * self.avg_wait_time + 0.2 * (started - enqueued_at)
+                self.busy += 1
+
+                try:
+                    if model is None:
+                        model = await loop.run_in_executor(executor, load_whisper_model)
+                    result = await loop.run_in_executor(executor, job, model, audio)
+                    self.completed += 1
+                    if not future.done():
+                        future.set_result(result)
+
+                except Exception as e:
+                    self.failed += 1
+                    if not future.done():
+                        future.set_exception(e)
+
+                finally:
+                    self.busy -= 1
+                    self.avg_service_time = 0.8 * self.avg_service_time + 0.2 * (time.perf_counter() - started)
+
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def submit(self, job, audio, priority: int = 1):
+        """Runs job(model, audio) on the next free model instance."""
+        self.start()
+
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((priority, next(self.sequence), job, audio, future, time.perf_counter()))
+
+        return await future
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "cpu_threads": WHISPER_CPU_THREADS,
+            "num_workers": WHISPER_NUM_WORKERS,
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "busy": self.busy,
+            "completed": self.completed,
+            "failed": self.failed,
+            "avg_wait_time_ms": round(self.avg_wait_time * 1000, 1),
+            "avg_service_time_ms": round(self.avg_service_time * 1000, 1)
+        }
+
+    async def shutdown(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        self.queue = None
+
+whisper_pool = WhisperPool()
+
+async def transcribe_audio_async(audio):
+    """Transcribes audio on the whisper pool without blocking the event loop."""
+    return await whisper_pool.submit(transcribe_with, audio)
+
+async def identify_language_async(audio):
+    """Identifies the language of audio on the whisper pool."""
+    return await whisper_pool.submit(identify_language, audio, priority=0)
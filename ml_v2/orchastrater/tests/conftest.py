@@ -0,0 +1,6 @@
+import os
+
+# utils.env exits on missing required variables, none of the tests reach these services
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/test")
+os.environ.setdefault("SUPABASE_URL", "https://test.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "test")
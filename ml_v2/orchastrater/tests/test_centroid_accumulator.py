@@ -0,0 +1,108 @@
+from services import db_clusters
+from services.centroid_accumulator import CentroidAccumulator
+from services.cluster_index import ClusterIndex
+from services.vector_codec import encode_vector, decode_vector
+from contextlib import asynccontextmanager
+import asyncio
+import numpy as np
+
+
+class FakeClusterTable:
+    """
+        Cluster rows behind db_clusters' two merges: the jsonb UPDATE is applied
+        with the same float8 formula Postgres runs, the bytea merge runs for real
+        against a cursor over the same rows.
+    """
+
+    def __init__(self):
+        self.rows = {}
+        self.json_merges = 0
+        self.binary_merges = 0
+
+    async def excecute_query(self, query, params=None, fetch_one=False, fetch_all=False):
+        assert "jsonb_agg" in query
+        row = self.rows[params["id"]]
+        if row["centroidVec"] is not None:
+            return None
+
+        count = row["sampleCount"]
+        row["centroid"] = [
+            (old * count + new) / (count + params["count"]) for old, new in zip(row["centroid"], params["sum"])
+        ]
+        row["sampleCount"] = count + params["count"]
+        self.json_merges += 1
+        return {"id": params["id"], "pg_notify": ""}
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield FakeCursor(self)
+
+
+class FakeCursor:
+    def __init__(self, table):
+        self.table = table
+        self.selected = None
+
+    async def execute(self, query, params=None):
+        if "FOR UPDATE" in query:
+            self.selected = dict(self.table.rows[params[0]])
+        elif query.strip().startswith("UPDATE"):
+            vector, count, cluster_id = params
+            self.table.rows[cluster_id].update(centroid=None, centroidVec=vector, sampleCount=count)
+            self.table.binary_merges += 1
+
+    async def fetchone(self):
+        return self.selected
+
+
+def stored_centroid(row):
+    if row["centroidVec"] is not None:
+        return decode_vector(row["centroidVec"]).astype(np.float64)
+    return np.asarray(row["centroid"])
+
+
+def test_flushed_centroids_are_the_running_mean(monkeypatch):
+    table = FakeClusterTable()
+    monkeypatch.setattr(db_clusters, "excecute_query", table.excecute_query)
+    monkeypatch.setattr(db_clusters, "transaction", table.transaction)
+    monkeypatch.setattr(db_clusters, "VECTOR_STORAGE", "jsonb")
+
+    rng = np.random.default_rng(0)
+    dim = 8
+    starts = {1: (rng.standard_normal(dim), 5), 2: (rng.standard_normal(dim), 2)}
+    # Cluster 1 still has a JSON centroid, cluster 2 was converted to bytea
+    table.rows[1] = {"id": 1, "centroid": starts[1][0].tolist(), "centroidVec": None, "sampleCount": 5}
+    table.rows[2] = {"id": 2, "centroid": None, "centroidVec": encode_vector(starts[2][0], "f32"), "sampleCount": 2}
+
+    index = ClusterIndex()
+    index.replace_all([
+        {"id": cluster_id, "centroid": centroid, "sampleCount": count} for cluster_id, (centroid, count) in starts.items()
+    ])
+    accumulator = CentroidAccumulator(index=index, flush_batch=1000)
+    added = {1: [], 2: []}
+
+    async def scenario():
+        for flush in range(4):
+            for _ in range(3 + flush):
+                cluster_id = int(rng.integers(1, 3))
+                embedding = rng.standard_normal(dim)
+                added[cluster_id].append(embedding)
+                accumulator.add(cluster_id, embedding)
+            await accumulator.flush()
+
+    asyncio.run(scenario())
+
+    assert accumulator.failures == 0 and not accumulator.pending and not accumulator.flushing
+    assert table.json_merges > 1 and table.binary_merges > 1
+
+    for cluster_id, (centroid, count) in starts.items():
+        samples = added[cluster_id]
+        expected = (centroid * count + np.sum(samples, axis=0)) / (count + len(samples))
+
+        assert table.rows[cluster_id]["sampleCount"] == count + len(samples)
+        # bytea stores f32, each merge rounds once
+        assert np.allclose(stored_centroid(table.rows[cluster_id]), expected, atol=1e-5)
+
+        indexed, indexed_count = index.get(cluster_id)
+        assert indexed_count == count + len(samples)
+        assert np.allclose(indexed, expected, atol=1e-5)
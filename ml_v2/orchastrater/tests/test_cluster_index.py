@@ -0,0 +1,112 @@
+from services import cluster_index as module
+from services import db_clusters
+from services.cluster_index import ClusterIndex
+from types import SimpleNamespace
+from utils import db
+import asyncio
+import numpy as np
+
+
+class FakeClusterTable:
+    """The Cluster rows db_clusters would read, and the NOTIFYs a write would send."""
+
+    def __init__(self):
+        self.rows = {1: {"id": 1, "centroid": [1.0, 0.0], "sampleCount": 3}}
+        self.notifies = asyncio.Queue()
+
+    async def get_all_clusters(self):
+        return [dict(row) for row in self.rows.values()]
+
+    async def get_cluster(self, cluster_id):
+        row = self.rows.get(cluster_id)
+        return dict(row) if row is not None else None
+
+    def write(self, cluster_id, centroid, count):
+        self.rows[cluster_id] = {"id": cluster_id, "centroid": centroid, "sampleCount": count}
+        self.notifies.put_nowait(SimpleNamespace(payload=str(cluster_id)))
+
+
+class ListenConnection:
+    def __init__(self, table):
+        self.table = table
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def notifies(self):
+        while True:
+            yield await self.table.notifies.get()
+
+
+def patch_table(monkeypatch, table):
+    monkeypatch.setattr(db_clusters, "get_all_clusters", table.get_all_clusters)
+    monkeypatch.setattr(db_clusters, "get_cluster", table.get_cluster)
+
+
+async def wait_for(condition, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "index never caught up"
+        await asyncio.sleep(0.01)
+
+
+def test_notify_refreshes_only_the_changed_cluster(monkeypatch):
+    async def scenario():
+        table = FakeClusterTable()
+        patch_table(monkeypatch, table)
+
+        async def listen_connection(channel):
+            assert channel == db_clusters.CHANNEL
+            return ListenConnection(table)
+
+        monkeypatch.setattr(db, "listen_connection", listen_connection)
+        index = ClusterIndex()
+        await index.start()
+        try:
+            await wait_for(lambda: index.reloads == 2)
+
+            # Another replica moves cluster 1 and creates cluster 2
+            table.write(1, [0.0, 1.0], 4)
+            table.write(2, [1.0, 1.0], 1)
+            await wait_for(lambda: index.notifications == 2)
+
+            assert index.reloads == 2 and index.size == 2
+            centroid, count = index.get(1)
+            assert np.allclose(centroid, [0.0, 1.0]) and count == 4
+            assert index.search([0.0, 1.0])[0] == 1
+
+        finally:
+            await index.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_periodic_reload_covers_replicas_that_cant_listen(monkeypatch):
+    async def scenario():
+        table = FakeClusterTable()
+        patch_table(monkeypatch, table)
+
+        async def listen_connection(channel):
+            raise RuntimeError("LISTEN is not supported in transaction pooling mode")
+
+        monkeypatch.setattr(db, "listen_connection", listen_connection)
+        monkeypatch.setattr(module, "RESYNC_SECONDS", 0.05)
+        monkeypatch.setattr(module, "RECONNECT_SECONDS", 10)
+        index = ClusterIndex()
+        await index.start()
+        try:
+            assert index.size == 1
+
+            table.write(2, [0.0, 1.0], 1)
+            await wait_for(lambda: index.size == 2)
+
+            assert index.notifications == 0
+            assert index.search([0.0, 1.0])[0] == 2
+
+        finally:
+            await index.shutdown()
+
+    asyncio.run(scenario())
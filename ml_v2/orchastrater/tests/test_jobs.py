@@ -0,0 +1,87 @@
+from services import pipeline
+from services.jobs import JobQueue
+import asyncio
+
+
+def queue(tmp_path, **options):
+    job_queue = JobQueue(directory=str(tmp_path), workers=0, **options)
+    job_queue._setup()
+    return job_queue
+
+
+def test_restart_requeues_running_jobs_and_fails_exhausted_ones(tmp_path):
+    job_queue = queue(tmp_path, max_attempts=2)
+    first = asyncio.run(job_queue.enqueue(b"first", "first.wav", "north", 1.0, 2.0))
+    second = asyncio.run(job_queue.enqueue(b"second", "second.wav", "north", 1.0, 2.0))
+
+    # The process dies with both running, the second on its last attempt
+    assert job_queue._claim()["id"] == first
+    assert job_queue._claim()["id"] == second
+    with job_queue.connect() as conn:
+        conn.execute("UPDATE jobs SET attempts = 2 WHERE id = ?", (second,))
+
+    restarted = queue(tmp_path, max_attempts=2)
+    assert restarted._get(first)["status"] == "queued"
+    assert restarted._get(second)["status"] == "failed"
+    assert not (tmp_path / "uploads" / second).exists()
+    assert restarted._claim()["id"] == first
+
+
+def test_failed_attempts_back_off_until_exhausted(tmp_path, monkeypatch):
+    async def failing(*args, **kwargs):
+        raise RuntimeError("encoder down")
+
+    monkeypatch.setattr(pipeline, "process_upload", failing)
+    job_queue = queue(tmp_path, max_attempts=2, retry_base_seconds=60)
+    job_id = asyncio.run(job_queue.enqueue(b"audio", "clip.wav", None, None, None))
+
+    asyncio.run(job_queue._run(job_queue._claim()))
+    job = job_queue._get(job_id)
+    assert job["status"] == "queued" and job["attempts"] == 1 and job["error"] == "encoder down"
+    # Not claimable again before its delay is over
+    assert job_queue._claim() is None
+    assert job_queue.retry_delay(1) == 60 and job_queue.retry_delay(3) == 240
+
+    with job_queue.connect() as conn:
+        conn.execute("UPDATE jobs SET not_before = 0 WHERE id = ?", (job_id,))
+    asyncio.run(job_queue._run(job_queue._claim()))
+
+    job = job_queue._get(job_id)
+    assert job["status"] == "failed" and job["attempts"] == 2
+    assert not (tmp_path / "uploads" / job_id).exists()
+    assert job_queue._claim() is None
+
+
+def test_retry_replays_the_checkpoint(tmp_path, monkeypatch):
+    calls = []
+
+    async def process_upload(audio_bytes, filename, region, lat, lng, checkpoint, on_checkpoint, transcribe_inline):
+        calls.append(dict(checkpoint))
+        assert transcribe_inline
+        if "file_url" not in checkpoint:
+            await on_checkpoint("file_url", "https://storage/clip.wav")
+            await on_checkpoint("cluster", [7, False])
+            raise RuntimeError("database down")
+        return {"status": "success", "file_url": checkpoint["file_url"]}
+
+    monkeypatch.setattr(pipeline, "process_upload", process_upload)
+    job_queue = queue(tmp_path, retry_base_seconds=0)
+    job_id = asyncio.run(job_queue.enqueue(b"audio", "clip.wav", None, None, None))
+
+    asyncio.run(job_queue._run(job_queue._claim()))
+    asyncio.run(job_queue._run(job_queue._claim()))
+
+    assert calls == [{}, {"file_url": "https://storage/clip.wav", "cluster": [7, False]}]
+    job = job_queue._get(job_id)
+    assert job["status"] == "succeeded" and job["result"]["file_url"] == "https://storage/clip.wav"
+
+
+def test_timed_out_long_polls_leave_nothing_behind(tmp_path):
+    job_queue = queue(tmp_path)
+    job_id = asyncio.run(job_queue.enqueue(b"audio", "clip.wav", None, None, None))
+
+    async def poll():
+        return await asyncio.gather(*(job_queue.get(job_id, wait=0.05) for _ in range(3)))
+
+    assert [job["status"] for job in asyncio.run(poll())] == ["queued"] * 3
+    assert job_queue.finished == {} and job_queue.waiters == {}
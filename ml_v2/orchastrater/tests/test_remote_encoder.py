@@ -0,0 +1,94 @@
+from services import remote_encoder
+from services.remote_encoder import EncoderClient
+import asyncio
+import httpx
+import pytest
+
+URL = "http://encoder/vectorize/pcm"
+
+
+def client_for(handler):
+    encoder = EncoderClient()
+    encoder.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return encoder
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(remote_encoder, "RETRY_BASE_DELAY", 0)
+
+
+def test_server_error_is_retried():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            return httpx.Response(503)
+        return httpx.Response(200, json={"embedding": [1.0, 2.0]})
+
+    encoder = client_for(handler)
+    response = asyncio.run(encoder._attempt(URL, {"content": b"pcm"}))
+
+    assert response.status_code == 200 and len(calls) == 2
+    assert encoder.retries == 1
+
+
+def test_retry_after_past_the_budget_fails_fast():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(503, headers={"Retry-After": str(int(remote_encoder.ENCODER_TIMEOUT) + 60)})
+
+    encoder = client_for(handler)
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(encoder._attempt(URL, {"content": b"pcm"}))
+
+    # Waiting would outlive the call, so it doesn't wait or retry
+    assert len(calls) == 1 and encoder.retries == 0
+
+
+def test_connect_error_is_retried():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            raise httpx.ConnectError("connection refused", request=request)
+        return httpx.Response(200, json={"embedding": [1.0]})
+
+    encoder = client_for(handler)
+    response = asyncio.run(encoder._attempt(URL, {"content": b"pcm"}))
+
+    assert response.status_code == 200 and len(calls) == 2
+    assert encoder.retries == 1
+
+
+def test_hedged_request_wins_and_the_slow_one_is_cancelled():
+    calls, cancelled = [], []
+
+    async def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(request)
+                raise
+            return httpx.Response(200, json={"embedding": [0.0]})
+        return httpx.Response(200, json={"embedding": [1.0]})
+
+    encoder = client_for(handler)
+
+    async def scenario():
+        response = await encoder._hedged(URL, {"content": b"pcm"}, delay=0.05)
+        # Let the cancelled primary unwind
+        await asyncio.sleep(0.01)
+        return response
+
+    response = asyncio.run(scenario())
+
+    assert response.json() == {"embedding": [1.0]}
+    assert len(calls) == 2 and len(cancelled) == 1
+    assert encoder.hedges == 1 and encoder.hedge_wins == 1
@@ -1,43 +1,97 @@
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import time
+from contextlib import asynccontextmanager
+from psycopg import AsyncConnection
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
 from utils.logger import get_logger
-from utils.env import DATABASE_URL
+from utils.env import DATABASE_URL, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_PREPARE_THRESHOLD
 
 logger = get_logger("db")
 
-def get_db_connection():
+# One pool per process, opened and closed by the FastAPI lifespan. Connections
+# prepare a statement server side once it ran DB_PREPARE_THRESHOLD times.
+pool = AsyncConnectionPool(
+    DATABASE_URL,
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=DB_POOL_MAX_SIZE,
+    kwargs={"row_factory": dict_row, "prepare_threshold": DB_PREPARE_THRESHOLD},
+    open=False
+)
 
-    try:
-        conn = psycopg2.connect(DATABASE_URL)
-        return conn
-    except Exception as e:
-        logger.error("Failed to connect to the db")
-        raise
+class PoolWaitStats:
+    """Time spent waiting for a pooled connection, a growing average means the pool is too small"""
+
+    def __init__(self):
+        self.acquired = 0
+        self.avg_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait: float):
+        self.acquired += 1
+        self.avg_wait = 0.8 * self.avg_wait + 0.2 * wait
+        self.max_wait = max(self.max_wait, wait)
+
+pool_wait = PoolWaitStats()
+
+async def open_pool():
+    await pool.open(wait=True)
+    logger.info(f"Opened DB pool with {DB_POOL_MIN_SIZE}-{DB_POOL_MAX_SIZE} connections")
+
+async def close_pool():
+    await pool.close()
+
+async def listen_connection(channel: str):
+    """Dedicated autocommit connection outside the pool that LISTENs on channel"""
+    conn = await AsyncConnection.connect(DATABASE_URL, autocommit=True)
+    await conn.execute(f'LISTEN "{channel}"')
+    return conn
+
+async def excecute_query(query: str, params: tuple = None, fetch_one = False, fetch_all = False):
+    """Runs one query in its own transaction on a pooled connection, an error rolls it back"""
+    started = time.perf_counter()
 
-def excecute_query(query: str, params: tuple = None, fetch_one = False, fetch_all = False):
-    conn = None
     try:
-        conn = get_db_connection()
+        async with pool.connection() as conn:
+            pool_wait.record(time.perf_counter() - started)
 
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(query, params)
+            async with conn.cursor() as cur:
+                await cur.execute(query, params)
 
-            if fetch_one:
-                result = cur.fetchone()
-            elif fetch_all:
-                result = cur.fetchall()
-            else:
-                result = None
+                if fetch_one:
+                    result = await cur.fetchone()
+                elif fetch_all:
+                    result = await cur.fetchall()
+                else:
+                    result = None
 
-            conn.commit()
             return result
 
     except Exception as e:
-        if conn: 
-            conn.rollback()
         logger.error(f"DB Query Failed: {e} | Query: {query}")
         raise
 
-    finally: 
-        if conn:
-            conn.close()
+@asynccontextmanager
+async def transaction():
+    """Cursor for several statements in one transaction, committed on exit, rolled back on error"""
+    started = time.perf_counter()
+
+    async with pool.connection() as conn:
+        pool_wait.record(time.perf_counter() - started)
+
+        async with conn.transaction():
+            async with conn.cursor() as cur:
+                yield cur
+
+def db_stats():
+    stats = pool.get_stats()
+
+    return {
+        "min_size": DB_POOL_MIN_SIZE,
+        "max_size": DB_POOL_MAX_SIZE,
+        "pool_size": stats.get("pool_size"),
+        "pool_available": stats.get("pool_available"),
+        "requests_waiting": stats.get("requests_waiting"),
+        "acquired": pool_wait.acquired,
+        "avg_wait_ms": round(pool_wait.avg_wait * 1000, 2),
+        "max_wait_ms": round(pool_wait.max_wait * 1000, 2)
+    }
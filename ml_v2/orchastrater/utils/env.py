@@ -12,7 +12,51 @@ def get_env_variable(key: str, default: str = None, required: bool = False) -> s
     return value
 
 DATABASE_URL = get_env_variable("DATABASE_URL", required=True)
+# Per-process Postgres pool. Set DB_PREPARE_THRESHOLD=none behind a transaction
+# mode pooler (pgbouncer / Supabase :6543), those don't keep prepared statements
+DB_POOL_MIN_SIZE = int(get_env_variable("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(get_env_variable("DB_POOL_MAX_SIZE", "10"))
+_prepare_threshold = get_env_variable("DB_PREPARE_THRESHOLD", "5")
+DB_PREPARE_THRESHOLD = None if _prepare_threshold.lower() == "none" else int(_prepare_threshold)
+# jsonb keeps vectors in the JSON columns, bytea writes "embeddingVec" / "centroidVec"
+# instead (see vector_codec.py), packed as f32 or f16. Reads understand both.
+VECTOR_STORAGE = get_env_variable("VECTOR_STORAGE", "jsonb")
+VECTOR_DTYPE = get_env_variable("VECTOR_DTYPE", "f32")
 ENCODER_URL = get_env_variable("ENCODER_URL", "http://localhost:8001")
+# application/x-embedding-f32, application/x-embedding-f16, application/x-npy or application/json
+ENCODER_RESPONSE_FORMAT = get_env_variable("ENCODER_RESPONSE_FORMAT", "application/x-embedding-f32")
+# PCM sent to /vectorize/pcm: f32 (exact) or s16 (half the bytes)
+ENCODER_PCM_FORMAT = get_env_variable("ENCODER_PCM_FORMAT", "f32")
+# Shared HTTP client for encoder calls
+ENCODER_TIMEOUT = float(get_env_variable("ENCODER_TIMEOUT", "30"))
+ENCODER_MAX_CONNECTIONS = int(get_env_variable("ENCODER_MAX_CONNECTIONS", "20"))
+ENCODER_RETRIES = int(get_env_variable("ENCODER_RETRIES", "2"))
+# Send a second request when the first is slower than the recent p95
+ENCODER_HEDGE = get_env_variable("ENCODER_HEDGE", "0") == "1"
+
+# Clips Whisper identifies with at least this probability are stored as KnownSample
+# without being encoded or clustered, 1.1 turns the gate off
+KNOWN_LANGUAGE_THRESHOLD = float(get_env_variable("KNOWN_LANGUAGE_THRESHOLD", "0.9"))
+# Comma separated language codes the gate applies to, empty means any language
+KNOWN_LANGUAGES = [code.strip() for code in get_env_variable("KNOWN_LANGUAGES", "").split(",") if code.strip()]
+
+# Centroid updates are buffered and written at most this often, or once this many samples wait
+CENTROID_FLUSH_SECONDS = float(get_env_variable("CENTROID_FLUSH_SECONDS", "1.0"))
+CENTROID_FLUSH_BATCH = int(get_env_variable("CENTROID_FLUSH_BATCH", "64"))
+
+# sync answers /process-audio when the pipeline is done, async returns a job id
+INGEST_MODE = get_env_variable("INGEST_MODE", "sync")
+# SQLite job queue and stored uploads for async mode
+JOB_DIR = get_env_variable("JOB_DIR", "jobs")
+JOB_WORKERS = int(get_env_variable("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(get_env_variable("JOB_MAX_ATTEMPTS", "3"))
+# A failed job waits JOB_RETRY_BASE_SECONDS * 2^(attempt - 1), at most JOB_RETRY_MAX_SECONDS, before it runs again
+JOB_RETRY_BASE_SECONDS = float(get_env_variable("JOB_RETRY_BASE_SECONDS", "5"))
+JOB_RETRY_MAX_SECONDS = float(get_env_variable("JOB_RETRY_MAX_SECONDS", "300"))
+# Transcriptions written after the response, queued under JOB_DIR so a restart resumes them
+TRANSCRIBE_WORKERS = int(get_env_variable("TRANSCRIBE_WORKERS", "1"))
+# How long shutdown lets running transcriptions finish before leaving them for the next start
+TRANSCRIBE_DRAIN_SECONDS = float(get_env_variable("TRANSCRIBE_DRAIN_SECONDS", "30"))
 
 SUPABASE_URL = get_env_variable("SUPABASE_URL", required=True)
 SUPABASE_KEY = get_env_variable("SUPABASE_KEY", required=True)